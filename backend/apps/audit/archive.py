@@ -0,0 +1,134 @@
+"""Cold storage for expired audit entries
+
+Retention moves entries out of the hot SQLite log into compressed NDJSON
+part files under ``audit_archive_dir``, partitioned by the UTC day of the
+entry (``YYYY/MM/DD/<first seq>-<last seq>.ndjson.gz``). A part is written to
+a temporary file, fsynced, made read-only and renamed into place, and never
+changes afterwards. Each part is registered in the ``audit_archive`` manifest
+table together with its time range and SHA-256, in the same transaction
+that deletes the archived rows from the hot log, so an entry is always in
+exactly one of the two places. Parts left behind by a crash before that
+transaction are not in the manifest and are ignored.
+
+Readers use the manifest to pick the parts overlapping a time range and
+verify each part's checksum before decoding it.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from collections.abc import Mapping, Sequence
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit_archive (
+    path TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    min_ts INTEGER NOT NULL,
+    max_ts INTEGER NOT NULL,
+    entries INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archive_day ON audit_archive (day);
+"""
+
+MANIFEST_COLUMNS = (
+    "path",
+    "day",
+    "min_ts",
+    "max_ts",
+    "entries",
+    "size",
+    "sha256",
+    "created_at",
+)
+
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+
+class ArchiveIntegrityError(RuntimeError):
+    """Raised when an archive part does not match its manifest checksum"""
+
+
+def partition_day(ts: int) -> str:
+    """UTC day (``YYYY-MM-DD``) of a timestamp in epoch microseconds"""
+    return datetime.fromtimestamp(ts // 1_000_000, tz=UTC).date().isoformat()
+
+
+def ulid_millis(log_id: str) -> int | None:
+    """Creation time in epoch milliseconds encoded in a ULID, if it is one"""
+    if len(log_id) != 26:
+        return None
+    millis = 0
+    for char in log_id[:10].upper():
+        index = _CROCKFORD.find(char)
+        if index < 0:
+            return None
+        millis = millis * 32 + index
+    return millis
+
+
+def _fsync_dir(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_part(directory: Path, rows: Sequence[Mapping[str, Any]]) -> dict[str, Any]:
+    """Write rows from one UTC day as an immutable part, returning its manifest row
+
+    ``rows`` are raw ``audit_log`` rows sorted by ``(ts, seq)``.
+    """
+    day = partition_day(rows[0]["ts"])
+    seqs = [row["seq"] for row in rows]
+    relative = Path(
+        day[:4], day[5:7], day[8:], f"{min(seqs):012d}-{max(seqs):012d}.ndjson.gz"
+    )
+    path = directory / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+
+    digest = hashlib.sha256()
+    with open(tmp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as part:
+            for row in rows:
+                record = dict(row)
+                record["details"] = json.loads(record["details"])
+                part.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    with open(tmp, "rb") as written:
+        for block in iter(lambda: written.read(1 << 20), b""):
+            digest.update(block)
+    os.chmod(tmp, 0o444)
+    os.replace(tmp, path)
+    _fsync_dir(path.parent)
+
+    return {
+        "path": relative.as_posix(),
+        "day": day,
+        "min_ts": rows[0]["ts"],
+        "max_ts": rows[-1]["ts"],
+        "entries": len(rows),
+        "size": path.stat().st_size,
+        "sha256": digest.hexdigest(),
+        "created_at": int(datetime.now(tz=UTC).timestamp()),
+    }
+
+
+def read_part(directory: Path, manifest: Mapping[str, Any]) -> list[dict[str, Any]]:
+    """Decode a part's rows after checking it against its manifest row
+
+    Raises ``ArchiveIntegrityError`` if the file was modified.
+    """
+    data = (directory / manifest["path"]).read_bytes()
+    if hashlib.sha256(data).hexdigest() != manifest["sha256"]:
+        raise ArchiveIntegrityError(f"Archive part {manifest['path']} is corrupt")
+    return [json.loads(line) for line in gzip.decompress(data).splitlines() if line]
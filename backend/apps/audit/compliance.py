@@ -0,0 +1,792 @@
+"""Compliance engine fed by highstate returns
+
+Compliance is derived from what the fleet actually reports. The collector
+polls the master's job cache for ``state.highstate``, ``state.apply`` and
+``state.sls`` jobs (test runs included) and hands every minion's return to
+the engine, which turns it into a ``MinionCompliance`` record: the failed
+states, the share of states in the desired state and the time of the last
+highstate. A state counts as failed when its result is ``False``, or
+``None`` in a test run, meaning it would change.
+
+A full highstate replaces a minion's failed states; a run of selected SLS
+(``state.sls`` or ``state.apply`` with mods, such as a remediation) only
+updates the states it ran. Returns older than the last one applied to a
+minion are ignored, so jobs can be ingested in any order and more than once.
+
+Fleet totals are running counters kept next to the records and adjusted in
+the same transaction, by at most one per minion, so ``status()`` is a single
+row read however large the fleet is. Nodegroups, resolved periodically from
+the master's cache, have counters of their own. Failed states are indexed
+the same way (see ``apps.audit.failures``) and every change of a counter is
+appended to the compliance history (see ``apps.audit.history``).
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from collections.abc import Iterable
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from apps.audit.failures import FAILURE_SCHEMA, index_failures, rebuild_index
+from apps.audit.history import (
+    HISTORY_SCHEMA,
+    append_snapshot,
+    percentage,
+    prune_history,
+    query_history,
+)
+from apps.audit.schemas import (
+    ComplianceStatus,
+    FailedState,
+    FailingState,
+    FailureCluster,
+    MinionCompliance,
+    MinionFailedState,
+    NodegroupCompliance,
+    RemediationRun,
+)
+from apps.salt.job_engine import jid_time
+from apps.salt.salt_api_client import SaltAPIClient, salt_client
+from config.database import (
+    LEASE_SCHEMA,
+    WORKER_ID,
+    acquire_lease,
+    connect,
+    database_path,
+    transaction,
+)
+from config.pagination import decode_cursor, encode_cursor
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Salt functions whose returns describe state compliance
+STATE_FUNCTIONS = ("state.highstate", "state.apply", "state.sls")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS minion_compliance (
+    minion_id TEXT PRIMARY KEY,
+    is_compliant INTEGER NOT NULL,
+    compliance_score REAL NOT NULL,
+    total_states INTEGER NOT NULL,
+    failed_states TEXT NOT NULL DEFAULT '[]',
+    last_highstate TEXT,
+    last_jid TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_compliance_compliant
+    ON minion_compliance (is_compliant, minion_id);
+
+CREATE TABLE IF NOT EXISTS compliance_counters (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total INTEGER NOT NULL DEFAULT 0,
+    compliant INTEGER NOT NULL DEFAULT 0,
+    last_check TEXT
+);
+INSERT OR IGNORE INTO compliance_counters (id) VALUES (1);
+
+CREATE TABLE IF NOT EXISTS minion_nodegroups (
+    minion_id TEXT NOT NULL,
+    nodegroup TEXT NOT NULL,
+    PRIMARY KEY (minion_id, nodegroup)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_nodegroup_members
+    ON minion_nodegroups (nodegroup, minion_id);
+
+CREATE TABLE IF NOT EXISTS nodegroup_counters (
+    nodegroup TEXT PRIMARY KEY,
+    total INTEGER NOT NULL DEFAULT 0,
+    compliant INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS compliance_jobs (
+    jid TEXT PRIMARY KEY,
+    settled INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS remediations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run TEXT NOT NULL
+);
+"""
+
+_LEASE_NAME = "compliance"
+
+# Failed state recorded when a run's states did not even render
+RENDER_FAILURE = ("highstate", "render")
+
+
+def _state_key(key: str, entry: dict[str, Any]) -> tuple[str, str]:
+    """``(state_name, state_id)`` of a state return entry
+
+    The name is the SLS the state comes from; the ``module_|-id_|-name_|-fun``
+    key is the fallback for returns without ``__sls__``/``__id__``.
+    """
+    parts = key.split("_|-")
+    state_id = entry.get("__id__") or (parts[1] if len(parts) > 1 else key)
+    state_name = entry.get("__sls__") or (
+        f"{parts[0]}.{parts[-1]}" if len(parts) == 4 else key
+    )
+    return str(state_name), str(state_id)
+
+
+def summarize_states(
+    ret: Any, failed_at: str
+) -> tuple[list[tuple[str, str]], list[FailedState]]:
+    """Split one minion's state return into succeeded keys and failed states
+
+    A return that is not a dict of states (render or compile errors) is one
+    failure of the whole run.
+    """
+    if not isinstance(ret, dict):
+        errors = ret if isinstance(ret, list) else [ret]
+        return [], [
+            FailedState(
+                state_name=RENDER_FAILURE[0],
+                state_id=RENDER_FAILURE[1],
+                reason="; ".join(str(error) for error in errors),
+                failed_at=failed_at,
+            )
+        ]
+    succeeded: list[tuple[str, str]] = []
+    failed: list[FailedState] = []
+    for key, entry in ret.items():
+        if not isinstance(entry, dict) or "result" not in entry:
+            continue
+        state_name, state_id = _state_key(key, entry)
+        if entry["result"] is True:
+            succeeded.append((state_name, state_id))
+            continue
+        comment = entry.get("comment") or ""
+        if isinstance(comment, list):
+            comment = "; ".join(str(line) for line in comment)
+        failed.append(
+            FailedState(
+                state_name=state_name,
+                state_id=state_id,
+                reason=str(comment),
+                failed_at=failed_at,
+            )
+        )
+    return succeeded, failed
+
+
+def parse_job_arguments(arguments: Any) -> tuple[list[str], bool]:
+    """SLS mods and test flag of a state job from its cached ``Arguments``"""
+    mods: list[str] = []
+    test = False
+    for argument in arguments or []:
+        if isinstance(argument, dict):
+            test = test or bool(argument.get("test"))
+        elif isinstance(argument, str) and "=" in argument:
+            key, _, value = argument.partition("=")
+            if key == "test":
+                test = value.lower() in ("true", "1", "yes")
+        elif isinstance(argument, str):
+            mods.extend(mod for mod in argument.split(",") if mod)
+    return mods, test
+
+
+def _merge(
+    minion_id: str,
+    previous: MinionCompliance | None,
+    ret: Any,
+    jid: str,
+    when: str,
+    partial: bool,
+) -> MinionCompliance:
+    """New compliance record of a minion after one state run"""
+    succeeded, failed = summarize_states(ret, when)
+    failures = {(f.state_name, f.state_id): f for f in failed}
+    recovered = set(succeeded)
+    last_highstate = when
+    total = len(succeeded) + len(failed)
+    if previous is not None:
+        # A state that keeps failing keeps the time it first failed
+        for state in previous.failed_states:
+            key = (state.state_name, state.state_id)
+            if key in failures:
+                failures[key] = state.model_copy(
+                    update={"reason": failures[key].reason}
+                )
+            elif partial and key not in recovered:
+                failures[key] = state
+    if partial:
+        last_highstate = previous.last_highstate if previous else None
+        total = max(previous.total_states if previous else 0, total)
+    score = 100.0 * (total - len(failures)) / total if total else 100.0
+    return MinionCompliance(
+        minion_id=minion_id,
+        is_compliant=not failures,
+        failed_states=list(failures.values()),
+        last_highstate=last_highstate,
+        compliance_score=round(max(score, 0.0), 1),
+        total_states=total,
+        last_jid=jid,
+    )
+
+
+def _row_to_compliance(row: sqlite3.Row) -> MinionCompliance:
+    return MinionCompliance(
+        minion_id=row["minion_id"],
+        is_compliant=bool(row["is_compliant"]),
+        failed_states=[FailedState(**f) for f in json.loads(row["failed_states"])],
+        last_highstate=row["last_highstate"],
+        compliance_score=row["compliance_score"],
+        total_states=row["total_states"],
+        last_jid=row["last_jid"],
+    )
+
+
+class ComplianceStore:
+    """SQLite persistence for per-minion compliance and the fleet counters"""
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            conn = connect(self._path or database_path("compliance"))
+            conn.executescript(_SCHEMA + FAILURE_SCHEMA + HISTORY_SCHEMA + LEASE_SCHEMA)
+            with transaction(conn):
+                rebuild_index(conn)
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        """Close the underlying connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def record(
+        self, returns: dict[str, Any], jid: str, partial: bool = False
+    ) -> list[MinionCompliance]:
+        """Apply the state returns of job ``jid`` to the minions' records
+
+        Returns the records that changed; minions whose last applied jid was
+        not issued before ``jid`` are skipped. Counters that change get a point
+        in the compliance history.
+        """
+        issued = jid_time(jid)
+        when = issued.isoformat()
+        updated: list[MinionCompliance] = []
+        with self._lock, transaction(self.conn) as conn:
+            total_delta = compliant_delta = 0
+            group_deltas: dict[str, tuple[int, int]] = {}
+            for minion_id, ret in returns.items():
+                row = conn.execute(
+                    "SELECT * FROM minion_compliance WHERE minion_id = ?",
+                    (minion_id,),
+                ).fetchone()
+                if row and jid_time(row["last_jid"]) >= issued:
+                    continue
+                previous = _row_to_compliance(row) if row else None
+                compliance = _merge(minion_id, previous, ret, jid, when, partial)
+                conn.execute(
+                    "INSERT OR REPLACE INTO minion_compliance (minion_id, "
+                    "is_compliant, compliance_score, total_states, failed_states, "
+                    "last_highstate, last_jid) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        minion_id,
+                        int(compliance.is_compliant),
+                        compliance.compliance_score,
+                        compliance.total_states,
+                        json.dumps([f.model_dump() for f in compliance.failed_states]),
+                        compliance.last_highstate,
+                        jid,
+                    ),
+                )
+                index_failures(
+                    conn,
+                    minion_id,
+                    previous.failed_states if previous else [],
+                    compliance.failed_states,
+                )
+                added = int(previous is None)
+                flipped = int(compliance.is_compliant) - int(
+                    bool(previous and previous.is_compliant)
+                )
+                total_delta += added
+                compliant_delta += flipped
+                updated.append(compliance)
+                if added or flipped:
+                    rows = conn.execute(
+                        "SELECT nodegroup FROM minion_nodegroups WHERE minion_id = ?",
+                        (minion_id,),
+                    )
+                    for row in rows:
+                        total, compliant = group_deltas.get(row["nodegroup"], (0, 0))
+                        group_deltas[row["nodegroup"]] = (
+                            total + added,
+                            compliant + flipped,
+                        )
+            if updated:
+                conn.execute(
+                    "UPDATE compliance_counters SET total = total + ?, "
+                    "compliant = compliant + ?, "
+                    "last_check = MAX(COALESCE(last_check, ''), ?) WHERE id = 1",
+                    (total_delta, compliant_delta, when),
+                )
+            now = datetime.now(tz=UTC)
+            if total_delta or compliant_delta:
+                row = conn.execute(
+                    "SELECT total, compliant FROM compliance_counters"
+                ).fetchone()
+                append_snapshot(conn, "", row["total"], row["compliant"], now)
+            for nodegroup, (total, compliant) in group_deltas.items():
+                if total or compliant:
+                    conn.execute(
+                        "UPDATE nodegroup_counters SET total = total + ?, "
+                        "compliant = compliant + ? WHERE nodegroup = ?",
+                        (total, compliant, nodegroup),
+                    )
+                    row = conn.execute(
+                        "SELECT total, compliant FROM nodegroup_counters "
+                        "WHERE nodegroup = ?",
+                        (nodegroup,),
+                    ).fetchone()
+                    append_snapshot(
+                        conn, nodegroup, row["total"], row["compliant"], now
+                    )
+        return updated
+
+    def status(self) -> ComplianceStatus:
+        """Fleet-wide compliance from the running counters"""
+        row = self.conn.execute(
+            "SELECT total, compliant, last_check FROM compliance_counters"
+        ).fetchone()
+        total, compliant = row["total"], row["compliant"]
+        return ComplianceStatus(
+            total_minions=total,
+            compliant_minions=compliant,
+            non_compliant_minions=total - compliant,
+            compliance_percentage=percentage(total, compliant),
+            last_check=row["last_check"],
+        )
+
+    def nodegroup_status(self) -> list[NodegroupCompliance]:
+        """Compliance of every nodegroup from its running counters"""
+        rows = self.conn.execute(
+            "SELECT * FROM nodegroup_counters ORDER BY nodegroup"
+        ).fetchall()
+        return [
+            NodegroupCompliance(
+                nodegroup=row["nodegroup"],
+                total_minions=row["total"],
+                compliant_minions=row["compliant"],
+                non_compliant_minions=row["total"] - row["compliant"],
+                compliance_percentage=percentage(row["total"], row["compliant"]),
+            )
+            for row in rows
+        ]
+
+    def set_nodegroups(
+        self, nodegroups: dict[str, Iterable[str]], now: datetime | None = None
+    ) -> None:
+        """Replace nodegroup membership and recount the nodegroups
+
+        Nodegroups whose counters change get a point in the history.
+        """
+        now = now or datetime.now(tz=UTC)
+        with self._lock, transaction(self.conn) as conn:
+            previous = {
+                row["nodegroup"]: (row["total"], row["compliant"])
+                for row in conn.execute("SELECT * FROM nodegroup_counters")
+            }
+            conn.execute("DELETE FROM minion_nodegroups")
+            conn.executemany(
+                "INSERT OR IGNORE INTO minion_nodegroups (minion_id, nodegroup) "
+                "VALUES (?, ?)",
+                [
+                    (minion_id, nodegroup)
+                    for nodegroup, minion_ids in nodegroups.items()
+                    for minion_id in minion_ids
+                ],
+            )
+            conn.execute("DELETE FROM nodegroup_counters")
+            conn.executemany(
+                "INSERT INTO nodegroup_counters (nodegroup) VALUES (?)",
+                [(nodegroup,) for nodegroup in nodegroups],
+            )
+            conn.execute(
+                "UPDATE nodegroup_counters SET (total, compliant) = ("
+                "SELECT COUNT(c.minion_id), COALESCE(SUM(c.is_compliant), 0) "
+                "FROM minion_nodegroups g JOIN minion_compliance c "
+                "ON c.minion_id = g.minion_id "
+                "WHERE g.nodegroup = nodegroup_counters.nodegroup)"
+            )
+            for row in conn.execute("SELECT * FROM nodegroup_counters").fetchall():
+                counters = (row["total"], row["compliant"])
+                if previous.get(row["nodegroup"]) != counters:
+                    append_snapshot(conn, row["nodegroup"], *counters, now)
+
+    def history(
+        self,
+        nodegroup: str | None,
+        granularity: str,
+        since: datetime,
+        until: datetime,
+        limit: int,
+    ) -> list[dict[str, Any]]:
+        """Compliance history of the fleet or one nodegroup, oldest first
+
+        Raises ``ValueError`` for an unknown granularity.
+        """
+        return query_history(
+            self.conn, nodegroup or "", granularity, since, until, limit
+        )
+
+    def prune_history(self, now: datetime | None = None) -> int:
+        """Drop history points past their retention"""
+        with self._lock, transaction(self.conn) as conn:
+            return prune_history(conn, now or datetime.now(tz=UTC))
+
+    def get(self, minion_id: str) -> MinionCompliance | None:
+        """Compliance record of one minion"""
+        row = self.conn.execute(
+            "SELECT * FROM minion_compliance WHERE minion_id = ?", (minion_id,)
+        ).fetchone()
+        return _row_to_compliance(row) if row else None
+
+    def list_page(
+        self,
+        compliant: bool | None = None,
+        cursor: str | None = None,
+        limit: int = 100,
+    ) -> tuple[list[MinionCompliance], str | None]:
+        """List compliance records by minion id, returning the next cursor
+
+        Raises ``ValueError`` for a malformed cursor.
+        """
+        where: list[str] = []
+        params: list[Any] = []
+        if compliant is not None:
+            where.append("is_compliant = ?")
+            params.append(int(compliant))
+        if cursor:
+            where.append("minion_id > ?")
+            params.append(str(decode_cursor(cursor, 1)[0]))
+        sql = "SELECT * FROM minion_compliance"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        rows = self.conn.execute(
+            sql + " ORDER BY minion_id LIMIT ?", (*params, limit)
+        ).fetchall()
+        next_cursor = (
+            encode_cursor(rows[-1]["minion_id"]) if len(rows) == limit else None
+        )
+        return [_row_to_compliance(row) for row in rows], next_cursor
+
+    def list_failures(
+        self,
+        state_name: str | None = None,
+        state_id: str | None = None,
+        cluster: str | None = None,
+        since: datetime | None = None,
+        cursor: str | None = None,
+        limit: int = 100,
+    ) -> tuple[list[MinionFailedState], str | None]:
+        """List failed states from the index, newest failures first
+
+        ``since`` keeps states that started failing at or after it. Raises
+        ``ValueError`` for a malformed cursor.
+        """
+        where: list[str] = []
+        params: list[Any] = []
+        for column, value in (
+            ("state_name", state_name),
+            ("state_id", state_id),
+            ("cluster", cluster),
+        ):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("failed_at >= ?")
+            params.append(since.astimezone(UTC).isoformat())
+        if cursor:
+            where.append("(failed_at, minion_id, state_name, state_id) < (?, ?, ?, ?)")
+            params.extend(str(part) for part in decode_cursor(cursor, 4))
+        sql = "SELECT * FROM failed_states"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        rows = self.conn.execute(
+            sql + " ORDER BY failed_at DESC, minion_id DESC, state_name DESC, "
+            "state_id DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        next_cursor = None
+        if len(rows) == limit:
+            last = rows[-1]
+            next_cursor = encode_cursor(
+                last["failed_at"],
+                last["minion_id"],
+                last["state_name"],
+                last["state_id"],
+            )
+        return [MinionFailedState(**dict(row)) for row in rows], next_cursor
+
+    def top_failing_states(
+        self, cursor: str | None = None, limit: int = 100
+    ) -> tuple[list[FailingState], str | None]:
+        """States failing on the most minions first
+
+        Raises ``ValueError`` for a malformed cursor.
+        """
+        sql = "SELECT * FROM failing_states"
+        params: list[Any] = []
+        if cursor:
+            minions, state_name, state_id = decode_cursor(cursor, 3)
+            sql += (
+                " WHERE minions < ? OR "
+                "(minions = ? AND (state_name, state_id) > (?, ?))"
+            )
+            params.extend([int(minions), int(minions), str(state_name), str(state_id)])
+        rows = self.conn.execute(
+            sql + " ORDER BY minions DESC, state_name, state_id LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        next_cursor = None
+        if len(rows) == limit:
+            last = rows[-1]
+            next_cursor = encode_cursor(
+                last["minions"], last["state_name"], last["state_id"]
+            )
+        return [FailingState(**dict(row)) for row in rows], next_cursor
+
+    def failure_clusters(
+        self, cursor: str | None = None, limit: int = 100
+    ) -> tuple[list[FailureCluster], str | None]:
+        """Failure reason clusters, largest first
+
+        Raises ``ValueError`` for a malformed cursor.
+        """
+        sql = "SELECT * FROM failure_reasons"
+        params: list[Any] = []
+        if cursor:
+            failures, cluster = decode_cursor(cursor, 2)
+            sql += " WHERE failures < ? OR (failures = ? AND cluster > ?)"
+            params.extend([int(failures), int(failures), str(cluster)])
+        rows = self.conn.execute(
+            sql + " ORDER BY failures DESC, cluster LIMIT ?", (*params, limit)
+        ).fetchall()
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = encode_cursor(rows[-1]["failures"], rows[-1]["cluster"])
+        return [FailureCluster(**dict(row)) for row in rows], next_cursor
+
+    def unsettled(self, jids: Iterable[str]) -> list[str]:
+        """The given jids that are not yet fully ingested, oldest first"""
+        jids = list(jids)
+        settled: set[str] = set()
+        for start in range(0, len(jids), 500):
+            chunk = jids[start : start + 500]
+            rows = self.conn.execute(
+                "SELECT jid FROM compliance_jobs WHERE settled = 1 AND jid IN "  # noqa: S608
+                f"({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            settled.update(row["jid"] for row in rows)
+        return sorted(set(jids) - settled)
+
+    def mark_settled(self, jid: str) -> None:
+        """Stop re-reading a job whose minions have all had time to return"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO compliance_jobs (jid, settled) VALUES (?, 1) "
+                "ON CONFLICT (jid) DO UPDATE SET settled = 1",
+                (jid,),
+            )
+
+    def create_remediation(self, submitted_by: str | None) -> RemediationRun:
+        """Record a new running remediation"""
+        run = RemediationRun(
+            id="",
+            status="running",
+            submitted_by=submitted_by,
+            created_at=datetime.now(tz=UTC).isoformat(),
+        )
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT INTO remediations (run) VALUES (?)", (run.model_dump_json(),)
+            )
+        run.id = str(cursor.lastrowid)
+        self.save_remediation(run)
+        return run
+
+    def save_remediation(self, run: RemediationRun) -> None:
+        """Persist a remediation's progress"""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE remediations SET run = ? WHERE id = ?",
+                (run.model_dump_json(), int(run.id)),
+            )
+
+    def get_remediation(self, remediation_id: str) -> RemediationRun | None:
+        """A remediation by id"""
+        try:
+            key = int(remediation_id)
+        except ValueError:
+            return None
+        row = self.conn.execute(
+            "SELECT run FROM remediations WHERE id = ?", (key,)
+        ).fetchone()
+        return RemediationRun.model_validate_json(row["run"]) if row else None
+
+    def list_remediations(self, limit: int = 50) -> list[RemediationRun]:
+        """Most recent remediations first"""
+        rows = self.conn.execute(
+            "SELECT run FROM remediations ORDER BY id DESC LIMIT ?", (limit,)
+        )
+        return [RemediationRun.model_validate_json(row["run"]) for row in rows]
+
+    def acquire_lease(self, owner: str, ttl: float, now: datetime) -> bool:
+        """Take or renew the collector lease"""
+        with self._lock:
+            return acquire_lease(self.conn, _LEASE_NAME, owner, ttl, now.timestamp())
+
+
+class ComplianceEngine:
+    """Turns state returns into compliance records"""
+
+    def __init__(self, store: ComplianceStore) -> None:
+        self.store = store
+
+    async def ingest(
+        self, returns: dict[str, Any], jid: str, partial: bool = False
+    ) -> list[MinionCompliance]:
+        """Apply per-minion state returns of one job"""
+        return await asyncio.to_thread(self.store.record, returns, jid, partial)
+
+    async def ingest_job(self, jid: str, function: str, job: dict[str, Any]) -> int:
+        """Apply a job looked up on the master, returning the minions updated"""
+        info = (job.get("info") or [{}])[0]
+        mods, _ = parse_job_arguments(info.get("Arguments"))
+        partial = function == "state.sls" or bool(mods)
+        returns: dict[str, Any] = {}
+        for chunk in job.get("return", []):
+            if isinstance(chunk, dict):
+                returns.update(chunk)
+        if not returns:
+            return 0
+        return len(await self.ingest(returns, jid, partial))
+
+
+class ComplianceCollector:
+    """Polls the master's job cache for state runs"""
+
+    def __init__(self, engine: ComplianceEngine, client: SaltAPIClient) -> None:
+        self.engine = engine
+        self.client = client
+        self.owner = f"{WORKER_ID}:{id(self):x}"
+        self.nodegroups_refreshed: datetime | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    async def collect(self, now: datetime | None = None) -> int:
+        """Ingest state jobs not yet settled, returning the minions updated
+
+        A job is re-read on every poll until it is older than
+        ``compliance_settle_seconds``, so minions that return late are
+        picked up too.
+        """
+        now = now or datetime.now(tz=UTC)
+        jobs: dict[str, Any] = {}
+        for chunk in (await self.client.list_jobs()).get("return", []):
+            if isinstance(chunk, dict):
+                jobs.update(chunk)
+        functions = {
+            jid: info.get("Function")
+            for jid, info in jobs.items()
+            if isinstance(info, dict) and info.get("Function") in STATE_FUNCTIONS
+        }
+        unsettled = await asyncio.to_thread(self.engine.store.unsettled, functions)
+
+        updated = 0
+        for jid in unsettled:
+            try:
+                job = await self.client.get_job(jid)
+                updated += await self.engine.ingest_job(jid, functions[jid], job)
+            except Exception:
+                logger.exception("Failed to ingest state job %s", jid)
+                continue
+            age = (now - jid_time(jid)).total_seconds()
+            if age > settings.compliance_settle_seconds:
+                self.engine.store.mark_settled(jid)
+        return updated
+
+    async def refresh_nodegroups(self, now: datetime | None = None) -> int:
+        """Re-resolve nodegroup membership, returning the number of nodegroups
+
+        Members come from the master's grains cache (``cache.grains``
+        targeted at the nodegroup), so no minion is contacted.
+        """
+        nodegroups: dict[str, Any] = {}
+        for chunk in (await self.client.list_nodegroups()).get("return", []):
+            if isinstance(chunk, dict):
+                nodegroups.update(chunk)
+        members: dict[str, list[str]] = {}
+        for nodegroup in sorted(nodegroups):
+            response = await self.client.run_salt_runner(
+                "cache.grains", [f"tgt={nodegroup}", "tgt_type=nodegroup"]
+            )
+            members[nodegroup] = sorted(
+                minion_id
+                for chunk in response.get("return", [])
+                if isinstance(chunk, dict)
+                for minion_id in chunk
+            )
+        await asyncio.to_thread(self.engine.store.set_nodegroups, members, now)
+        self.nodegroups_refreshed = now or datetime.now(tz=UTC)
+        return len(members)
+
+    async def run_forever(self) -> None:
+        """Poll on a fixed interval while holding the collector lease
+
+        Nodegroup membership is refreshed and the compliance history pruned
+        every ``compliance_nodegroup_refresh_seconds``.
+        """
+        interval = settings.compliance_poll_seconds
+        while True:
+            try:
+                now = datetime.now(tz=UTC)
+                if self.engine.store.acquire_lease(self.owner, interval * 2, now):
+                    await self.collect(now)
+                    refresh = settings.compliance_nodegroup_refresh_seconds
+                    if (
+                        self.nodegroups_refreshed is None
+                        or (now - self.nodegroups_refreshed).total_seconds() >= refresh
+                    ):
+                        await self.refresh_nodegroups(now)
+                        await asyncio.to_thread(self.engine.store.prune_history, now)
+            except Exception:
+                logger.exception("Compliance collection failed")
+            await asyncio.sleep(interval)
+
+    def start(self) -> None:
+        """Start polling in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """Stop polling"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Global compliance instances
+compliance_store = ComplianceStore()
+compliance_engine = ComplianceEngine(compliance_store)
+compliance_collector = ComplianceCollector(compliance_engine, salt_client)
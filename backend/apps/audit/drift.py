@@ -0,0 +1,466 @@
+"""Scheduled configuration drift detection
+
+Every ``drift_scan_interval_seconds`` the worker holding the drift lease runs
+``state.highstate test=True`` over the accepted minions, ``drift_batch_size``
+minions per job and at most ``drift_concurrency`` jobs at a time, each given
+up to ``drift_job_timeout_seconds`` to return. Each state that would change
+becomes a drift record with the expected and actual value taken from its
+pending changes. Records are keyed by (minion, state), so a
+drift seen again only moves its ``last_seen``; one that no longer shows up is
+marked resolved. The test returns also feed the compliance engine.
+
+Reading drift only queries the stored records and never starts a scan.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from apps.audit.compliance import ComplianceEngine, compliance_engine
+from apps.audit.schemas import DriftDetection, DriftScan, DriftScanStatus
+from apps.salt.inventory import parse_minion_ids
+from apps.salt.job_engine import run_job
+from apps.salt.salt_api_client import SaltAPIClient, salt_client
+from config.database import (
+    LEASE_SCHEMA,
+    WORKER_ID,
+    acquire_lease,
+    connect,
+    database_path,
+    transaction,
+)
+from config.pagination import decode_cursor, encode_cursor
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS drift (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    minion_id TEXT NOT NULL,
+    state_key TEXT NOT NULL,
+    state_id TEXT,
+    sls TEXT,
+    resource_type TEXT NOT NULL,
+    resource_name TEXT NOT NULL,
+    expected_value TEXT NOT NULL,
+    actual_value TEXT NOT NULL,
+    drift_type TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    resolved_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_drift_state ON drift (minion_id, state_key);
+CREATE INDEX IF NOT EXISTS idx_drift_minion ON drift (minion_id, first_seen);
+CREATE INDEX IF NOT EXISTS idx_drift_resource ON drift (resource_type, first_seen);
+CREATE INDEX IF NOT EXISTS idx_drift_first_seen ON drift (first_seen);
+CREATE INDEX IF NOT EXISTS idx_drift_last_seen ON drift (last_seen);
+
+CREATE TABLE IF NOT EXISTS drift_scans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    minions INTEGER NOT NULL DEFAULT 0,
+    batches INTEGER NOT NULL DEFAULT 0,
+    drifted INTEGER NOT NULL DEFAULT 0,
+    failed_batches INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_LEASE_NAME = "drift"
+
+# How often the scan loop checks whether a scan is due
+_TICK_SECONDS = 60.0
+
+_MAX_VALUE_CHARS = 1024
+
+# Values that mean "not there" in pending changes
+_ABSENT = ("", "absent", "removed", "not installed")
+
+
+def _value(value: Any) -> str:
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, default=str)
+    return value[:_MAX_VALUE_CHARS]
+
+
+def _find_change(changes: Any, depth: int = 0) -> tuple[Any, Any] | None:
+    """First ``(new, old)`` pair in a state's pending changes"""
+    if not isinstance(changes, dict) or depth > 3:
+        return None
+    if "new" in changes or "old" in changes:
+        return changes.get("new"), changes.get("old")
+    for value in changes.values():
+        found = _find_change(value, depth + 1)
+        if found:
+            return found
+    return None
+
+
+def extract_drift(minion_id: str, ret: Any, seen_at: str) -> dict[str, DriftDetection]:
+    """Drift records for the states a test highstate says would change
+
+    Keyed by the state's ``module_|-id_|-name_|-function`` key. The expected
+    value is what the state would set, the actual value what is there now;
+    changes without an old/new pair (file diffs, for example) record the
+    changes as expected and the state's comment as actual.
+    """
+    drift: dict[str, DriftDetection] = {}
+    if not isinstance(ret, dict):
+        return drift
+    for key, entry in ret.items():
+        if not isinstance(entry, dict) or entry.get("result", True) is not None:
+            continue
+        parts = key.split("_|-")
+        module = parts[0] if len(parts) == 4 else "state"
+        name = entry.get("name") or (parts[2] if len(parts) == 4 else key)
+        changes = entry.get("changes") or {}
+        change = _find_change(changes)
+        if change is not None:
+            expected, actual = _value(change[0]), _value(change[1])
+            if actual in _ABSENT:
+                drift_type = "missing"
+            elif expected in _ABSENT:
+                drift_type = "unexpected"
+            else:
+                drift_type = "modified"
+        else:
+            expected = _value(changes) if changes else ""
+            actual = _value(entry.get("comment"))
+            drift_type = "modified"
+        drift[key] = DriftDetection(
+            minion_id=minion_id,
+            resource_type=module,
+            resource_name=str(name),
+            expected_value=expected,
+            actual_value=actual,
+            drift_type=drift_type,
+            detected_at=seen_at,
+            state_id=entry.get("__id__") or (parts[1] if len(parts) == 4 else None),
+            sls=entry.get("__sls__"),
+        )
+    return drift
+
+
+def _row_to_drift(row: sqlite3.Row) -> DriftDetection:
+    return DriftDetection(
+        minion_id=row["minion_id"],
+        resource_type=row["resource_type"],
+        resource_name=row["resource_name"],
+        expected_value=row["expected_value"],
+        actual_value=row["actual_value"],
+        drift_type=row["drift_type"],
+        detected_at=row["first_seen"],
+        state_id=row["state_id"],
+        sls=row["sls"],
+        first_seen=row["first_seen"],
+        last_seen=row["last_seen"],
+        resolved_at=row["resolved_at"],
+    )
+
+
+def _row_to_scan(row: sqlite3.Row) -> DriftScan:
+    return DriftScan(**dict(row))
+
+
+class DriftStore:
+    """SQLite persistence for drift records and scan history"""
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            conn = connect(self._path or database_path("drift"))
+            conn.executescript(_SCHEMA + LEASE_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        """Close the underlying connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def record(self, returns: dict[str, Any], seen_at: datetime) -> int:
+        """Store the drift in test highstate returns, resolving what is gone
+
+        Minions whose return is not a state dict (render errors, timeouts)
+        keep their records. Returns the number of minions with drift.
+        """
+        seen = seen_at.isoformat()
+        drifted = 0
+        with self._lock, transaction(self.conn) as conn:
+            for minion_id, ret in returns.items():
+                if not isinstance(ret, dict):
+                    continue
+                drift = extract_drift(minion_id, ret, seen)
+                drifted += bool(drift)
+                for key, item in drift.items():
+                    conn.execute(
+                        "INSERT INTO drift (minion_id, state_key, state_id, sls, "
+                        "resource_type, resource_name, expected_value, actual_value, "
+                        "drift_type, first_seen, last_seen) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (minion_id, state_key) DO UPDATE SET "
+                        "expected_value = excluded.expected_value, "
+                        "actual_value = excluded.actual_value, "
+                        "drift_type = excluded.drift_type, "
+                        "last_seen = excluded.last_seen, "
+                        # A drift that comes back after being resolved is new
+                        "first_seen = CASE WHEN resolved_at IS NULL "
+                        "THEN first_seen ELSE excluded.first_seen END, "
+                        "resolved_at = NULL",
+                        (
+                            minion_id,
+                            key,
+                            item.state_id,
+                            item.sls,
+                            item.resource_type,
+                            item.resource_name,
+                            item.expected_value,
+                            item.actual_value,
+                            item.drift_type,
+                            seen,
+                            seen,
+                        ),
+                    )
+                conn.execute(
+                    "UPDATE drift SET resolved_at = ? WHERE minion_id = ? "
+                    "AND resolved_at IS NULL AND last_seen < ?",
+                    (seen, minion_id, seen),
+                )
+        return drifted
+
+    def list_page(
+        self,
+        minion_id: str | None = None,
+        resource_type: str | None = None,
+        since: datetime | None = None,
+        include_resolved: bool = False,
+        cursor: str | None = None,
+        limit: int = 100,
+    ) -> tuple[list[DriftDetection], str | None]:
+        """List drift newest first by ``first_seen``, returning the next cursor
+
+        ``since`` keeps drift first seen at or after it.
+        Raises ``ValueError`` for a malformed cursor.
+        """
+        where: list[str] = []
+        params: list[Any] = []
+        if minion_id:
+            where.append("minion_id = ?")
+            params.append(minion_id)
+        if resource_type:
+            where.append("resource_type = ?")
+            params.append(resource_type)
+        if since is not None:
+            where.append("first_seen >= ?")
+            params.append(since.astimezone(UTC).isoformat())
+        if not include_resolved:
+            where.append("resolved_at IS NULL")
+        if cursor:
+            first_seen, row_id = decode_cursor(cursor, 2)
+            where.append("(first_seen, id) < (?, ?)")
+            params.extend((str(first_seen), int(row_id)))
+        sql = "SELECT * FROM drift"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        rows = self.conn.execute(
+            sql + " ORDER BY first_seen DESC, id DESC LIMIT ?", (*params, limit)
+        ).fetchall()
+        next_cursor = (
+            encode_cursor(rows[-1]["first_seen"], rows[-1]["id"])
+            if len(rows) == limit
+            else None
+        )
+        return [_row_to_drift(row) for row in rows], next_cursor
+
+    def start_scan(self, started_at: datetime) -> int:
+        """Record the start of a scan, returning its id"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT INTO drift_scans (started_at) VALUES (?)",
+                (started_at.isoformat(),),
+            )
+            return int(cursor.lastrowid or 0)
+
+    def finish_scan(self, scan: DriftScan) -> None:
+        """Record the outcome of a scan"""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE drift_scans SET finished_at = ?, minions = ?, batches = ?, "
+                "drifted = ?, failed_batches = ? WHERE id = ?",
+                (
+                    scan.finished_at,
+                    scan.minions,
+                    scan.batches,
+                    scan.drifted,
+                    scan.failed_batches,
+                    scan.id,
+                ),
+            )
+
+    def last_scan(self) -> DriftScan | None:
+        """The most recently started scan"""
+        row = self.conn.execute(
+            "SELECT * FROM drift_scans ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        return _row_to_scan(row) if row else None
+
+    def acquire_lease(self, owner: str, ttl: float, now: datetime) -> bool:
+        """Take or renew the scanner lease"""
+        with self._lock:
+            return acquire_lease(self.conn, _LEASE_NAME, owner, ttl, now.timestamp())
+
+
+class DriftScanner:
+    """Runs test highstates over the fleet in throttled batches"""
+
+    def __init__(
+        self,
+        store: DriftStore,
+        client: SaltAPIClient,
+        engine: ComplianceEngine | None = None,
+    ) -> None:
+        self.store = store
+        self.client = client
+        self.engine = engine
+        self.owner = f"{WORKER_ID}:{id(self):x}"
+        self._task: asyncio.Task[None] | None = None
+        self._scan: asyncio.Task[DriftScan] | None = None
+
+    @property
+    def running(self) -> bool:
+        """Whether a scan started by this worker is in progress"""
+        return self._scan is not None and not self._scan.done()
+
+    async def _scan_batch(self, batch: list[str]) -> dict[str, Any]:
+        outcome = await run_job(
+            self.client,
+            ",".join(batch),
+            "state.highstate",
+            kwargs={"test": True},
+            tgt_type="list",
+            timeout=settings.drift_job_timeout_seconds,
+        )
+        if outcome.running or outcome.lost:
+            logger.warning(
+                "Drift scan of %s got no return from %d of %d minions",
+                outcome.jid,
+                len(outcome.running) + len(outcome.lost),
+                len(outcome.minions),
+            )
+        if self.engine is not None and outcome.returns:
+            await self.engine.ingest(outcome.returns, outcome.jid)
+        return outcome.returns
+
+    async def scan(self, minion_ids: list[str] | None = None) -> DriftScan:
+        """Scan the fleet (or ``minion_ids``) for drift"""
+        started_at = datetime.now(tz=UTC)
+        scan_id = await asyncio.to_thread(self.store.start_scan, started_at)
+        if minion_ids is None:
+            minion_ids = parse_minion_ids(await self.client.list_keys())
+        batch_size = settings.drift_batch_size
+        batches = [
+            minion_ids[i : i + batch_size]
+            for i in range(0, len(minion_ids), batch_size)
+        ]
+        semaphore = asyncio.Semaphore(settings.drift_concurrency)
+
+        async def scan_batch(batch: list[str]) -> tuple[int, int] | None:
+            async with semaphore:
+                try:
+                    returns = await self._scan_batch(batch)
+                except Exception:
+                    logger.exception(
+                        "Drift scan batch of %d minions failed", len(batch)
+                    )
+                    returns = None
+            # Renewed per batch, as a whole scan can outlast the lease
+            await asyncio.to_thread(self._hold_lease, datetime.now(tz=UTC))
+            if returns is None:
+                return None
+            drifted = await asyncio.to_thread(
+                self.store.record, returns, datetime.now(tz=UTC)
+            )
+            return len(returns), drifted
+
+        results = await asyncio.gather(*(scan_batch(batch) for batch in batches))
+        done = [result for result in results if result is not None]
+        scan = DriftScan(
+            id=scan_id,
+            started_at=started_at.isoformat(),
+            finished_at=datetime.now(tz=UTC).isoformat(),
+            minions=sum(minions for minions, _ in done),
+            batches=len(batches),
+            drifted=sum(drifted for _, drifted in done),
+            failed_batches=len(results) - len(done),
+        )
+        await asyncio.to_thread(self.store.finish_scan, scan)
+        return scan
+
+    def start_scan(self) -> bool:
+        """Start a scan in the background unless one is already running"""
+        if self.running:
+            return False
+        self._scan = asyncio.create_task(self.scan())
+        return True
+
+    def status(self) -> DriftScanStatus:
+        """Whether a scan is running and the last scan's outcome"""
+        return DriftScanStatus(running=self.running, last_scan=self.store.last_scan())
+
+    def _due(self, now: datetime) -> bool:
+        last = self.store.last_scan()
+        if last is None:
+            return True
+        started = datetime.fromisoformat(last.started_at)
+        return (now - started).total_seconds() >= settings.drift_scan_interval_seconds
+
+    def _hold_lease(self, now: datetime) -> bool:
+        lease = settings.drift_scan_interval_seconds * 2
+        return self.store.acquire_lease(self.owner, lease, now)
+
+    async def run_forever(self) -> None:
+        """Scan whenever one is due while holding the scanner lease"""
+        while True:
+            try:
+                now = datetime.now(tz=UTC)
+                if self._hold_lease(now) and self._due(now):
+                    await self.scan()
+            except Exception:
+                logger.exception("Drift scan failed")
+            await asyncio.sleep(_TICK_SECONDS)
+
+    def start(self) -> None:
+        """Start scheduled scans in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """Stop scheduled scans and any scan in progress"""
+        for task in (self._task, self._scan):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._scan = None
+
+
+# Global drift instances
+drift_store = DriftStore()
+drift_scanner = DriftScanner(drift_store, salt_client, compliance_engine)
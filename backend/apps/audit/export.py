@@ -0,0 +1,197 @@
+"""Streaming audit log export
+
+Exports read the audit store one keyset page at a time and encode each page
+as soon as it is read, so memory use is bounded by the page size no matter
+how many entries match. CSV and NDJSON are optionally compressed with gzip
+or zstd as they stream; Parquet is written one row group per page and uses
+the codec inside the file instead.
+
+Parquet needs ``pyarrow`` and zstd needs ``zstandard``; both are optional
+(``pip install saltshark-backend[export]``).
+"""
+
+import csv
+import io
+import json
+import zlib
+from collections.abc import Iterable, Iterator
+from typing import Any, Protocol
+
+from apps.audit.schemas import AuditLog
+
+FORMATS = ("csv", "ndjson", "parquet")
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+FIELDS = (
+    "id",
+    "timestamp",
+    "user",
+    "action",
+    "resource_type",
+    "resource_id",
+    "result",
+    "ip_address",
+    "details",
+)
+
+
+class ExportUnavailableError(RuntimeError):
+    """Raised when an export needs an optional dependency that is missing"""
+
+
+class _Compressor(Protocol):
+    def compress(self, data: bytes) -> bytes: ...
+
+    def flush(self) -> bytes: ...
+
+
+class _Identity:
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _compressor(compression: str) -> _Compressor:
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ExportUnavailableError("zstd compression requires zstandard") from e
+        return zstandard.ZstdCompressor().compressobj()
+    return _Identity()
+
+
+def _record(log: AuditLog) -> dict[str, Any]:
+    return {
+        "id": log.id,
+        "timestamp": log.timestamp.isoformat(),
+        "user": log.user,
+        "action": log.action,
+        "resource_type": log.resource_type,
+        "resource_id": log.resource_id,
+        "result": log.result,
+        "ip_address": log.ip_address,
+        "details": json.dumps(log.details, default=str, sort_keys=True),
+    }
+
+
+def _csv_chunks(batches: Iterable[list[AuditLog]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(_record(log) for log in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only when nothing matched
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson_chunks(batches: Iterable[list[AuditLog]]) -> Iterator[bytes]:
+    for batch in batches:
+        yield "".join(
+            json.dumps(log.model_dump(mode="json"), default=str) + "\n" for log in batch
+        ).encode()
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only stream whose contents can be taken as they are produced"""
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _parquet_chunks(
+    batches: Iterable[list[AuditLog]], compression: str
+) -> Iterator[bytes]:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ExportUnavailableError("Parquet export requires pyarrow") from e
+
+    schema = pa.schema([(field, pa.string()) for field in FIELDS])
+    sink = _DrainableSink()
+    codec = {"none": "none", "gzip": "gzip", "zstd": "zstd"}[compression]
+    with pq.ParquetWriter(sink, schema, compression=codec) as writer:
+        for batch in batches:
+            records = [_record(log) for log in batch]
+            writer.write_table(pa.Table.from_pylist(records, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def check_export(export_format: str, compression: str) -> None:
+    """Fail before streaming starts if the export cannot be produced
+
+    Raises ``ValueError`` for unknown options and ``ExportUnavailableError``
+    when an optional dependency is missing.
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+    if export_format == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError as e:
+            raise ExportUnavailableError("Parquet export requires pyarrow") from e
+    else:
+        _compressor(compression)
+
+
+def export_filename(export_format: str, compression: str) -> str:
+    """File name offered to the client for an export"""
+    suffix = {"gzip": ".gz", "zstd": ".zst"}.get(compression, "")
+    if export_format == "parquet":
+        suffix = ""
+    return f"audit-log.{export_format}{suffix}"
+
+
+def stream_export(
+    batches: Iterable[list[AuditLog]], export_format: str, compression: str
+) -> Iterator[bytes]:
+    """Encode pages of audit entries into a stream of export bytes"""
+    if export_format == "parquet":
+        yield from (c for c in _parquet_chunks(batches, compression) if c)
+        return
+
+    chunks = _csv_chunks(batches) if export_format == "csv" else _ndjson_chunks(batches)
+    compressor = _compressor(compression)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    tail = compressor.flush()
+    if tail:
+        yield tail
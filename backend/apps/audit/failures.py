@@ -0,0 +1,168 @@
+"""Fleet-wide index of failed states
+
+Every failed state of every minion is a row of ``failed_states`` keyed by
+``(minion_id, state_name, state_id)`` and indexed by state and by the time
+it first failed, so "which minions fail nginx-install" or "what started
+failing since T" are index range scans rather than a walk over every
+compliance record. Next to it two aggregates are kept:
+
+- ``failing_states``: how many minions each state currently fails on,
+  ordered for "top failing states".
+- ``failure_reasons``: failures clustered by reason. Reasons are reduced to
+  a pattern by masking the parts that differ between minions (quoted
+  values, paths, numbers, hashes), so "Package 'nginx-1.18' not found" and
+  "Package 'nginx-1.20' not found" fall in one cluster.
+
+The index is maintained by ``ComplianceStore.record`` in the transaction
+that changes the minion's record, as a diff of its failed states before
+and after the run.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+from collections.abc import Iterable
+
+from apps.audit.schemas import FailedState
+
+FAILURE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS failed_states (
+    minion_id TEXT NOT NULL,
+    state_name TEXT NOT NULL,
+    state_id TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    cluster TEXT NOT NULL,
+    failed_at TEXT NOT NULL,
+    PRIMARY KEY (minion_id, state_name, state_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_failed_states_time
+    ON failed_states (failed_at, minion_id, state_name, state_id);
+CREATE INDEX IF NOT EXISTS idx_failed_states_state
+    ON failed_states (state_id, failed_at, minion_id, state_name);
+CREATE INDEX IF NOT EXISTS idx_failed_states_sls
+    ON failed_states (state_name, failed_at, minion_id, state_id);
+CREATE INDEX IF NOT EXISTS idx_failed_states_cluster
+    ON failed_states (cluster, failed_at, minion_id, state_name, state_id);
+
+CREATE TABLE IF NOT EXISTS failing_states (
+    state_name TEXT NOT NULL,
+    state_id TEXT NOT NULL,
+    minions INTEGER NOT NULL,
+    PRIMARY KEY (state_name, state_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_failing_states_minions
+    ON failing_states (minions DESC, state_name, state_id);
+
+CREATE TABLE IF NOT EXISTS failure_reasons (
+    cluster TEXT PRIMARY KEY,
+    pattern TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    failures INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_failure_reasons_failures
+    ON failure_reasons (failures DESC, cluster);
+"""
+
+# Masked in order; earlier patterns win over the number mask
+_REASON_MASKS = [
+    (re.compile(r"'[^']*'|\"[^\"]*\""), "'*'"),
+    (re.compile(r"(?<![\w.])/[\w.\-/]+"), "<path>"),
+    (re.compile(r"\b[0-9a-f]{8,}\b", re.IGNORECASE), "<hex>"),
+    (re.compile(r"\d+(?:\.\d+)*"), "<n>"),
+    (re.compile(r"\s+"), " "),
+]
+
+_PATTERN_LENGTH = 200
+
+
+def failure_cluster(reason: str) -> tuple[str, str]:
+    """``(cluster id, pattern)`` of a failure reason"""
+    pattern = reason
+    for mask, replacement in _REASON_MASKS:
+        pattern = mask.sub(replacement, pattern)
+    pattern = pattern.strip()[:_PATTERN_LENGTH]
+    digest = hashlib.sha1(pattern.encode(), usedforsecurity=False).hexdigest()
+    return digest[:16], pattern
+
+
+def _count_state(
+    conn: sqlite3.Connection, state_name: str, state_id: str, delta: int
+) -> None:
+    conn.execute(
+        "INSERT INTO failing_states (state_name, state_id, minions) "
+        "VALUES (?, ?, ?) ON CONFLICT (state_name, state_id) "
+        "DO UPDATE SET minions = minions + excluded.minions",
+        (state_name, state_id, delta),
+    )
+    conn.execute(
+        "DELETE FROM failing_states WHERE state_name = ? AND state_id = ? "
+        "AND minions <= 0",
+        (state_name, state_id),
+    )
+
+
+def _count_reason(conn: sqlite3.Connection, reason: str, delta: int) -> str:
+    cluster, pattern = failure_cluster(reason)
+    conn.execute(
+        "INSERT INTO failure_reasons (cluster, pattern, sample, failures) "
+        "VALUES (?, ?, ?, ?) ON CONFLICT (cluster) "
+        "DO UPDATE SET failures = failures + excluded.failures",
+        (cluster, pattern, reason[:1000], delta),
+    )
+    conn.execute(
+        "DELETE FROM failure_reasons WHERE cluster = ? AND failures <= 0", (cluster,)
+    )
+    return cluster
+
+
+def index_failures(
+    conn: sqlite3.Connection,
+    minion_id: str,
+    before: Iterable[FailedState],
+    after: Iterable[FailedState],
+) -> None:
+    """Bring the index of one minion from its old failed states to its new ones
+
+    Must run inside the transaction that writes the minion's record.
+    """
+    old = {(f.state_name, f.state_id): f for f in before}
+    new = {(f.state_name, f.state_id): f for f in after}
+    for key, state in old.items():
+        if key in new and new[key].reason == state.reason:
+            continue
+        _count_reason(conn, state.reason, -1)
+        if key not in new:
+            _count_state(conn, *key, -1)
+            conn.execute(
+                "DELETE FROM failed_states WHERE minion_id = ? AND state_name = ? "
+                "AND state_id = ?",
+                (minion_id, *key),
+            )
+    for key, state in new.items():
+        previous = old.get(key)
+        if previous is not None and previous.reason == state.reason:
+            continue
+        cluster = _count_reason(conn, state.reason, 1)
+        if previous is None:
+            _count_state(conn, *key, 1)
+        conn.execute(
+            "INSERT OR REPLACE INTO failed_states (minion_id, state_name, "
+            "state_id, reason, cluster, failed_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (minion_id, *key, state.reason, cluster, state.failed_at),
+        )
+
+
+def rebuild_index(conn: sqlite3.Connection) -> None:
+    """Index the failed states of records written before the index existed
+
+    Only runs while the index is empty; must run inside a transaction.
+    """
+    if conn.execute("SELECT 1 FROM failed_states LIMIT 1").fetchone():
+        return
+    rows = conn.execute(
+        "SELECT minion_id, failed_states FROM minion_compliance WHERE is_compliant = 0"
+    ).fetchall()
+    for row in rows:
+        failed = [FailedState(**f) for f in json.loads(row["failed_states"])]
+        index_failures(conn, row["minion_id"], [], failed)
@@ -0,0 +1,105 @@
+"""Compliance history time series
+
+Every change of the fleet's (or a nodegroup's) compliance counters appends
+a point to ``compliance_history``. Each point is written at three
+resolutions in the same transaction: a raw point at the second it happened,
+and the hour and day buckets it falls in. A bucket keeps the last counters
+seen in it and the lowest and highest compliance percentage, so trends read
+the pre-downsampled series directly. ``prune_history`` drops raw points
+after ``compliance_history_raw_days`` and hourly buckets after
+``compliance_history_hourly_days``; daily buckets are kept forever.
+
+The fleet-wide series has the empty string as its nodegroup.
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Any
+
+from config.settings import settings
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS compliance_history (
+    nodegroup TEXT NOT NULL,
+    granularity TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    compliant INTEGER NOT NULL,
+    low REAL NOT NULL,
+    high REAL NOT NULL,
+    PRIMARY KEY (nodegroup, granularity, bucket)
+) WITHOUT ROWID;
+"""
+
+# Bucket width in seconds per granularity
+GRANULARITIES = {"raw": 1, "hour": 3600, "day": 86400}
+
+
+def percentage(total: int, compliant: int) -> float:
+    """Compliance percentage of a set of minions"""
+    return round(100.0 * compliant / total, 1) if total else 0.0
+
+
+def append_snapshot(
+    conn: sqlite3.Connection,
+    nodegroup: str,
+    total: int,
+    compliant: int,
+    at: datetime,
+) -> None:
+    """Add a point to every resolution (call inside the writing transaction)"""
+    seconds = int(at.timestamp())
+    value = percentage(total, compliant)
+    conn.executemany(
+        "INSERT INTO compliance_history "
+        "(nodegroup, granularity, bucket, total, compliant, low, high) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT DO UPDATE SET total = excluded.total, "
+        "compliant = excluded.compliant, low = MIN(low, excluded.low), "
+        "high = MAX(high, excluded.high)",
+        [
+            (nodegroup, granularity, seconds - seconds % width, total, compliant)
+            + (value, value)
+            for granularity, width in GRANULARITIES.items()
+        ],
+    )
+
+
+def prune_history(conn: sqlite3.Connection, now: datetime) -> int:
+    """Drop raw and hourly points past their retention, returning the count"""
+    deleted = 0
+    for granularity, days in (
+        ("raw", settings.compliance_history_raw_days),
+        ("hour", settings.compliance_history_hourly_days),
+    ):
+        cursor = conn.execute(
+            "DELETE FROM compliance_history WHERE granularity = ? AND bucket < ?",
+            (granularity, int((now - timedelta(days=days)).timestamp())),
+        )
+        deleted += cursor.rowcount
+    return deleted
+
+
+def query_history(
+    conn: sqlite3.Connection,
+    nodegroup: str,
+    granularity: str,
+    since: datetime,
+    until: datetime,
+    limit: int,
+) -> list[dict[str, Any]]:
+    """Points of one series between ``since`` and ``until``, oldest first
+
+    Raises ``ValueError`` for an unknown granularity.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    width = GRANULARITIES[granularity]
+    start = int(since.timestamp())
+    rows = conn.execute(
+        "SELECT bucket, total, compliant, low, high FROM compliance_history "
+        "WHERE nodegroup = ? AND granularity = ? AND bucket >= ? AND bucket < ? "
+        "ORDER BY bucket LIMIT ?",
+        (nodegroup, granularity, start - start % width, until.timestamp(), limit),
+    )
+    return [dict(row) for row in rows]
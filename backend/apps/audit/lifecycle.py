@@ -0,0 +1,45 @@
+"""Audit app lifecycle - runs the audit writer and background loops"""
+
+from faster_app.apps.base import AppLifecycle
+
+from apps.audit.compliance import compliance_collector
+from apps.audit.drift import drift_scanner
+from apps.audit.mailer import mailer
+from apps.audit.pipeline import notification_pipeline
+from apps.audit.push import notification_hub
+from apps.audit.remediation import remediator
+from apps.audit.retention import audit_retention
+from apps.audit.writer import audit_writer
+from config.settings import settings
+
+
+class AuditAppLifecycle(AppLifecycle):
+    """Starts the audit writer and background loops, flushes the writer on shutdown"""
+
+    @property
+    def app_name(self) -> str:
+        return "audit"
+
+    async def on_startup(self) -> None:
+        """Start the audit writer, notifications, retention, compliance and drift"""
+        audit_writer.start()
+        notification_hub.start()
+        notification_pipeline.start()
+        mailer.start()
+        if settings.audit_retention_enabled:
+            audit_retention.start()
+        if settings.compliance_enabled:
+            compliance_collector.start()
+        if settings.drift_enabled:
+            drift_scanner.start()
+
+    async def on_shutdown(self) -> None:
+        """Stop background loops and commit queued audit entries"""
+        await notification_pipeline.stop()
+        await mailer.stop()
+        await notification_hub.stop()
+        await remediator.stop()
+        await drift_scanner.stop()
+        await compliance_collector.stop()
+        await audit_retention.stop()
+        await audit_writer.stop()
@@ -0,0 +1,439 @@
+"""Email delivery of notifications
+
+Notifications for users with ``email_enabled`` are queued in a persistent
+outbox (``mail.db``) by ``Mailer.enqueue``, which only inserts a row, so
+nothing on the request path talks to an SMTP server. One worker at a time,
+holding the mail lease, delivers the outbox in the background:
+
+- Rows are held for ``email_batch_seconds`` (critical ones are sent right
+  away) and every recipient's due rows go out as one message, a digest
+  when there is more than one.
+- Messages are sent from ``smtp_pool_size`` dedicated threads over a pool
+  of at most as many SMTP connections, which stay open between messages
+  and are replaced when they fail.
+- Rows are claimed (``sending``) before they are sent, so a worker taking
+  over the lease mid-batch does not send them again. A claim lapses after
+  ``email_claim_seconds``, when a sender that died is assumed to have
+  failed.
+- A failed delivery is retried with exponential backoff from
+  ``email_retry_base_seconds`` up to ``email_retry_max_seconds``, until
+  ``email_max_attempts``; permanent (5xx) rejections are not retried.
+
+Delivery is disabled while ``smtp_host`` is empty.
+"""
+
+import asyncio
+import logging
+import smtplib
+import sqlite3
+import ssl
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import UTC, datetime, timedelta
+from email.message import EmailMessage
+from pathlib import Path
+from typing import Any
+
+from apps.audit.notifications import NotificationStore, notification_store
+from apps.audit.schemas import MailOutboxStatus, Notification
+from config.database import (
+    LEASE_SCHEMA,
+    WORKER_ID,
+    acquire_lease,
+    connect,
+    database_path,
+    release_lease,
+    transaction,
+)
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    notification_id TEXT,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    sent_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt);
+"""
+
+_LEASE_NAME = "mail"
+
+# Idle connections older than this are checked with NOOP before reuse
+_IDLE_CHECK_SECONDS = 30.0
+
+
+class OutboxStore:
+    """SQLite persistence for queued emails"""
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            conn = connect(self._path or database_path("mail"))
+            conn.executescript(_SCHEMA + LEASE_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        """Close the underlying connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def add(
+        self,
+        user: str,
+        recipient: str,
+        subject: str,
+        body: str,
+        notification_id: str | None,
+        due: float,
+    ) -> int:
+        """Queue an email, returning its id"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT INTO outbox (user, recipient, notification_id, subject, "
+                "body, next_attempt, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user,
+                    recipient,
+                    notification_id,
+                    subject,
+                    body,
+                    due,
+                    datetime.now(tz=UTC).isoformat(),
+                ),
+            )
+        return int(cursor.lastrowid or 0)
+
+    def claim(self, now: float, limit: int) -> list[dict[str, Any]]:
+        """Claim due emails for sending, oldest first
+
+        Includes emails whose claim lapsed without a delivery being recorded.
+        """
+        expires = now + settings.email_claim_seconds
+        with self._lock, transaction(self.conn) as conn:
+            rows = [
+                dict(row)
+                for row in conn.execute(
+                    "SELECT * FROM outbox WHERE status IN ('pending', 'sending') "
+                    "AND next_attempt <= ? ORDER BY next_attempt, id LIMIT ?",
+                    (now, limit),
+                )
+            ]
+            conn.executemany(
+                "UPDATE outbox SET status = 'sending', next_attempt = ? WHERE id = ?",
+                [(expires, row["id"]) for row in rows],
+            )
+        return rows
+
+    def mark_sent(self, ids: list[int]) -> None:
+        """Record a successful delivery"""
+        with self._lock, transaction(self.conn) as conn:
+            conn.executemany(
+                "UPDATE outbox SET status = 'sent', attempts = attempts + 1, "
+                "sent_at = ?, last_error = NULL WHERE id = ?",
+                [(datetime.now(tz=UTC).isoformat(), i) for i in ids],
+            )
+
+    def mark_failed(
+        self, ids: list[int], error: str, now: float, permanent: bool = False
+    ) -> None:
+        """Record a failed delivery and schedule the retry, if any is left"""
+        base = settings.email_retry_base_seconds
+        with self._lock, transaction(self.conn) as conn:
+            for i in ids:
+                row = conn.execute(
+                    "SELECT attempts FROM outbox WHERE id = ?", (i,)
+                ).fetchone()
+                attempts = row["attempts"] + 1
+                status = "pending"
+                if permanent or attempts >= settings.email_max_attempts:
+                    status = "failed"
+                delay = min(
+                    base * 2 ** (attempts - 1), settings.email_retry_max_seconds
+                )
+                conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = ?, next_attempt = ?, "
+                    "last_error = ? WHERE id = ?",
+                    (status, attempts, now + delay, error[:1000], i),
+                )
+
+    def prune(self, before: datetime) -> int:
+        """Delete emails sent before ``before``"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?",
+                (before.isoformat(),),
+            )
+        return cursor.rowcount
+
+    def status(self) -> MailOutboxStatus:
+        """Number of emails per status"""
+        counts = {
+            row["status"]: row["count"]
+            for row in self.conn.execute(
+                "SELECT status, COUNT(*) AS count FROM outbox GROUP BY status"
+            )
+        }
+        return MailOutboxStatus(
+            enabled=bool(settings.smtp_host),
+            pending=counts.get("pending", 0),
+            sending=counts.get("sending", 0),
+            sent=counts.get("sent", 0),
+            failed=counts.get("failed", 0),
+        )
+
+    def acquire_lease(self, owner: str, ttl: float, now: float) -> bool:
+        """Take or renew the delivery lease"""
+        with self._lock:
+            return acquire_lease(self.conn, _LEASE_NAME, owner, ttl, now)
+
+    def release_lease(self, owner: str) -> None:
+        """Give up the delivery lease"""
+        with self._lock:
+            release_lease(self.conn, _LEASE_NAME, owner)
+
+
+class SMTPPool:
+    """A bounded pool of open SMTP connections"""
+
+    def __init__(self, size: int) -> None:
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: list[tuple[smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> smtplib.SMTP:
+        timeout = settings.smtp_timeout_seconds
+        smtp: smtplib.SMTP
+        if settings.smtp_use_ssl:
+            smtp = smtplib.SMTP_SSL(
+                settings.smtp_host,
+                settings.smtp_port,
+                timeout=timeout,
+                context=ssl.create_default_context(),
+            )
+        else:
+            smtp = smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=timeout)
+            if settings.smtp_starttls:
+                smtp.starttls(context=ssl.create_default_context())
+        if settings.smtp_username:
+            smtp.login(settings.smtp_username, settings.smtp_password)
+        return smtp
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        """Borrow a connection, opening one if none is idle
+
+        A connection that raised is closed instead of returned to the pool.
+        """
+        with self._slots:
+            smtp = None
+            with self._lock:
+                if self._idle:
+                    smtp, idle_since = self._idle.pop()
+            if smtp is not None and time.monotonic() - idle_since > _IDLE_CHECK_SECONDS:
+                try:
+                    smtp.noop()
+                except (smtplib.SMTPException, OSError):
+                    smtp.close()
+                    smtp = None
+            if smtp is None:
+                smtp = self._connect()
+            try:
+                yield smtp
+            except BaseException:
+                _quit(smtp)
+                raise
+            with self._lock:
+                self._idle.append((smtp, time.monotonic()))
+
+    def close(self) -> None:
+        """Close the idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for smtp, _ in idle:
+            _quit(smtp)
+
+
+def _quit(smtp: smtplib.SMTP) -> None:
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
+
+
+def compose(recipient: str, rows: list[dict[str, Any]]) -> EmailMessage:
+    """One email for a recipient's queued rows, a digest when there are several"""
+    message = EmailMessage()
+    message["From"] = settings.email_from
+    message["To"] = recipient
+    if len(rows) == 1:
+        message["Subject"] = rows[0]["subject"]
+        message.set_content(rows[0]["body"])
+        return message
+    message["Subject"] = f"[SaltShark] {len(rows)} notifications"
+    message.set_content("\n\n".join(f"{row['subject']}\n{row['body']}" for row in rows))
+    return message
+
+
+class Mailer:
+    """Queues notification emails and delivers the outbox in the background"""
+
+    def __init__(self, outbox: OutboxStore, notifications: NotificationStore) -> None:
+        self.outbox = outbox
+        self.notifications = notifications
+        self.pool = SMTPPool(settings.smtp_pool_size)
+        self.owner = f"{WORKER_ID}:{id(self):x}"
+        # Sends block on SMTP; keep them off the default executor
+        self._executor = ThreadPoolExecutor(
+            settings.smtp_pool_size, thread_name_prefix="smtp"
+        )
+        self._wake = asyncio.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    def _wake_up(self) -> None:
+        """Wake the delivery loop from any thread"""
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            # The loop closed since
+            pass
+
+    def enqueue(self, notification: Notification) -> int | None:
+        """Queue an email for a notification if its user wants one
+
+        Returns the outbox id. Only writes the outbox; delivery happens in
+        the background. Safe to call from worker threads.
+        """
+        prefs = self.notifications.get_settings(notification.user)
+        if not prefs or not prefs.email_enabled or not prefs.email_address:
+            return None
+        delay = (
+            0.0 if notification.priority == "critical" else settings.email_batch_seconds
+        )
+        outbox_id = self.outbox.add(
+            notification.user,
+            str(prefs.email_address),
+            f"[SaltShark] {notification.title}",
+            notification.message,
+            notification.id,
+            time.time() + delay,
+        )
+        if not delay:
+            self._wake_up()
+        return outbox_id
+
+    def _send(self, recipient: str, rows: list[dict[str, Any]]) -> None:
+        with self.pool.connection() as smtp:
+            smtp.send_message(compose(recipient, rows))
+
+    async def _deliver(
+        self, recipient: str, rows: list[dict[str, Any]], now: float
+    ) -> bool:
+        ids = [row["id"] for row in rows]
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._send, recipient, rows
+            )
+        except (smtplib.SMTPException, OSError) as e:
+            code = getattr(e, "smtp_code", 0)
+            if isinstance(e, smtplib.SMTPRecipientsRefused):
+                code = min(reply[0] for reply in e.recipients.values())
+            permanent = code >= 500
+            logger.warning("Email to %s failed: %s", recipient, e)
+            await asyncio.to_thread(
+                self.outbox.mark_failed, ids, str(e), now, permanent
+            )
+            return False
+        await asyncio.to_thread(self.outbox.mark_sent, ids)
+        return True
+
+    async def deliver(self, now: float | None = None) -> int:
+        """Send everything due, returning the number of messages sent"""
+        if not settings.smtp_host:
+            return 0
+        now = time.time() if now is None else now
+        rows = await asyncio.to_thread(
+            self.outbox.claim, now, settings.email_batch_size
+        )
+        if len(rows) == settings.email_batch_size:
+            # More is due; go again without waiting for the poll interval
+            self._wake.set()
+        by_recipient: dict[str, list[dict[str, Any]]] = {}
+        for row in rows:
+            by_recipient.setdefault(row["recipient"], []).append(row)
+        sent = await asyncio.gather(
+            *(
+                self._deliver(recipient, batch, now)
+                for recipient, batch in by_recipient.items()
+            )
+        )
+        return sum(sent)
+
+    async def run_forever(self) -> None:
+        """Deliver while holding the mail lease until cancelled"""
+        interval = settings.email_poll_seconds
+        self._loop = asyncio.get_running_loop()
+        while True:
+            try:
+                now = time.time()
+                self._wake.clear()
+                if self.outbox.acquire_lease(self.owner, interval * 4, now):
+                    await self.deliver(now)
+                    keep = timedelta(days=settings.email_keep_sent_days)
+                    await asyncio.to_thread(
+                        self.outbox.prune, datetime.now(tz=UTC) - keep
+                    )
+            except Exception:
+                logger.exception("Email delivery failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except TimeoutError:
+                pass
+
+    def start(self) -> None:
+        """Start delivering in the background"""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """Stop delivering, close pooled connections and release the lease"""
+        self._loop = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.pool.close)
+        self.outbox.release_lease(self.owner)
+
+
+# Global mailer instance
+mailer = Mailer(OutboxStore(), notification_store)
@@ -0,0 +1,325 @@
+"""Persistent per-user notification store
+
+Notifications live in SQLite so they survive restarts and are shared by every
+worker. Ids come from an AUTOINCREMENT rowid, so they are unique, never
+reused and increase with creation time; every per-user query walks the
+``(user, id)`` index from the newest end and costs a page, however many
+notifications other users have.
+
+Each user has a row of running counters: ``total``, ``unread`` and a
+``read_through`` watermark. Notifications with an id at or below the
+watermark count as read whatever their own flag says, so "mark all read"
+moves the watermark and zeroes the counter instead of touching every unread
+row. The unread count is therefore a single row read. Every write also bumps
+the row's ``seq`` to a new fleet-wide maximum, which lets other workers find
+the users whose notifications changed (see ``apps.audit.push``).
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from apps.audit.schemas import Notification, NotificationSettings
+from config.database import connect, database_path, transaction
+from config.pagination import decode_cursor, encode_cursor
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    type TEXT NOT NULL,
+    title TEXT NOT NULL,
+    message TEXT NOT NULL,
+    priority TEXT NOT NULL DEFAULT 'info',
+    is_read INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications (user, id);
+CREATE INDEX IF NOT EXISTS idx_notifications_unread
+    ON notifications (user, id) WHERE is_read = 0;
+
+CREATE TABLE IF NOT EXISTS notification_users (
+    user TEXT PRIMARY KEY,
+    total INTEGER NOT NULL DEFAULT 0,
+    unread INTEGER NOT NULL DEFAULT 0,
+    read_through INTEGER NOT NULL DEFAULT 0,
+    seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_notification_users_seq ON notification_users (seq);
+
+CREATE TABLE IF NOT EXISTS notification_settings (
+    user TEXT PRIMARY KEY,
+    settings TEXT NOT NULL
+);
+"""
+
+
+def _row_to_notification(row: sqlite3.Row, read_through: int) -> Notification:
+    return Notification(
+        id=str(row["id"]),
+        user=row["user"],
+        type=row["type"],
+        title=row["title"],
+        message=row["message"],
+        priority=row["priority"],
+        is_read=bool(row["is_read"]) or row["id"] <= read_through,
+        created_at=datetime.fromisoformat(row["created_at"]),
+        data=json.loads(row["data"]),
+    )
+
+
+def _parse_ids(notification_ids: list[str]) -> list[int]:
+    return [int(i) for i in notification_ids if i.isdigit()]
+
+
+# Next change sequence number, assigned to the user row being written
+_NEXT_SEQ = "(SELECT COALESCE(MAX(seq), 0) + 1 FROM notification_users)"
+
+
+class NotificationStore:
+    """SQLite-backed notifications and notification settings"""
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            conn = connect(self._path or database_path("notifications"))
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        """Close the underlying connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _read_through(self, user: str) -> int:
+        row = self.conn.execute(
+            "SELECT read_through FROM notification_users WHERE user = ?", (user,)
+        ).fetchone()
+        return row["read_through"] if row else 0
+
+    def create(
+        self,
+        user: str,
+        notification_type: str,
+        title: str,
+        message: str,
+        priority: str = "info",
+        data: dict[str, Any] | None = None,
+    ) -> Notification:
+        """Insert an unread notification and return it with its new id"""
+        created_at = datetime.now(tz=UTC)
+        with self._lock, transaction(self.conn) as conn:
+            cursor = conn.execute(
+                "INSERT INTO notifications (user, type, title, message, priority, "
+                "created_at, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user,
+                    notification_type,
+                    title,
+                    message,
+                    priority,
+                    created_at.isoformat(),
+                    json.dumps(data or {}),
+                ),
+            )
+            conn.execute(
+                "INSERT INTO notification_users (user, total, unread, seq) "  # noqa: S608
+                f"VALUES (?, 1, 1, {_NEXT_SEQ}) ON CONFLICT (user) DO UPDATE SET "
+                "total = total + 1, unread = unread + 1, seq = excluded.seq",
+                (user,),
+            )
+        return Notification(
+            id=str(cursor.lastrowid),
+            user=user,
+            type=notification_type,
+            title=title,
+            message=message,
+            priority=priority,
+            is_read=False,
+            created_at=created_at,
+            data=data or {},
+        )
+
+    def get(self, user: str, notification_id: str) -> Notification | None:
+        """A notification of ``user`` by id"""
+        if not notification_id.isdigit():
+            return None
+        row = self.conn.execute(
+            "SELECT * FROM notifications WHERE id = ? AND user = ?",
+            (int(notification_id), user),
+        ).fetchone()
+        return _row_to_notification(row, self._read_through(user)) if row else None
+
+    def list_page(
+        self,
+        user: str,
+        unread_only: bool = False,
+        cursor: str | None = None,
+        skip: int = 0,
+        limit: int = 100,
+    ) -> tuple[list[Notification], str | None]:
+        """List a user's notifications newest first, returning the next cursor
+
+        Raises ``ValueError`` for a malformed cursor.
+        """
+        read_through = self._read_through(user)
+        where = ["user = ?"]
+        params: list[Any] = [user]
+        if unread_only:
+            where += ["is_read = 0", "id > ?"]
+            params.append(read_through)
+        if cursor:
+            (before,) = decode_cursor(cursor, 1)
+            where.append("id < ?")
+            params.append(int(before))
+        rows = self.conn.execute(
+            f"SELECT * FROM notifications WHERE {' AND '.join(where)} "  # noqa: S608
+            "ORDER BY id DESC LIMIT ? OFFSET ?",
+            (*params, limit + 1, skip),
+        ).fetchall()
+        page = [_row_to_notification(row, read_through) for row in rows[:limit]]
+        next_cursor = (
+            encode_cursor(rows[limit - 1]["id"]) if len(rows) > limit else None
+        )
+        return page, next_cursor
+
+    def list_after(
+        self, user: str, after_id: int, limit: int = 100
+    ) -> list[Notification]:
+        """A user's notifications newer than ``after_id``, oldest first"""
+        read_through = self._read_through(user)
+        rows = self.conn.execute(
+            "SELECT * FROM notifications WHERE user = ? AND id > ? ORDER BY id LIMIT ?",
+            (user, after_id, limit),
+        )
+        return [_row_to_notification(row, read_through) for row in rows]
+
+    def last_id(self, user: str) -> int:
+        """Id of a user's newest notification, or 0"""
+        row = self.conn.execute(
+            "SELECT MAX(id) AS id FROM notifications WHERE user = ?", (user,)
+        ).fetchone()
+        return row["id"] or 0
+
+    def changed_since(self, seq: int) -> tuple[list[str], int]:
+        """Users whose notifications changed after ``seq``, and the latest seq"""
+        rows = self.conn.execute(
+            "SELECT user, seq FROM notification_users WHERE seq > ?", (seq,)
+        ).fetchall()
+        latest = max((row["seq"] for row in rows), default=seq)
+        return [row["user"] for row in rows], latest
+
+    def unread_count(self, user: str) -> int:
+        """Unread notifications of a user, from the running counter"""
+        row = self.conn.execute(
+            "SELECT unread FROM notification_users WHERE user = ?", (user,)
+        ).fetchone()
+        return row["unread"] if row else 0
+
+    def updates_after(
+        self, user: str, after_id: int, limit: int, count_only: bool = False
+    ) -> tuple[list[Notification], int]:
+        """``list_after`` and ``unread_count`` read from one snapshot
+
+        Without it a notification written between the two reads is counted
+        but not listed.
+        """
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                notifications = (
+                    [] if count_only else self.list_after(user, after_id, limit)
+                )
+                return notifications, self.unread_count(user)
+            finally:
+                self.conn.execute("COMMIT")
+
+    def mark_read(self, user: str, notification_ids: list[str]) -> int:
+        """Mark notifications of ``user`` read, returning how many were unread"""
+        ids = _parse_ids(notification_ids)
+        if not ids:
+            return 0
+        with self._lock, transaction(self.conn) as conn:
+            read_through = self._read_through(user)
+            marked = conn.execute(
+                "UPDATE notifications SET is_read = 1 WHERE user = ? AND "  # noqa: S608
+                f"is_read = 0 AND id > ? AND id IN ({', '.join('?' * len(ids))})",
+                (user, read_through, *ids),
+            ).rowcount
+            if marked:
+                conn.execute(
+                    "UPDATE notification_users SET unread = unread - ?, "  # noqa: S608
+                    f"seq = {_NEXT_SEQ} WHERE user = ?",
+                    (marked, user),
+                )
+        return marked
+
+    def mark_all_read(self, user: str) -> int:
+        """Mark every notification of ``user`` read, returning how many were unread"""
+        with self._lock, transaction(self.conn) as conn:
+            row = conn.execute(
+                "SELECT unread FROM notification_users WHERE user = ?", (user,)
+            ).fetchone()
+            if not row or not row["unread"]:
+                return 0
+            conn.execute(
+                "UPDATE notification_users SET unread = 0, read_through = "  # noqa: S608
+                "(SELECT MAX(id) FROM notifications WHERE user = ?), "
+                f"seq = {_NEXT_SEQ} WHERE user = ?",
+                (user, user),
+            )
+        return row["unread"]
+
+    def delete(self, user: str, notification_id: str) -> bool:
+        """Delete a notification of ``user``, returning whether it existed"""
+        if not notification_id.isdigit():
+            return False
+        with self._lock, transaction(self.conn) as conn:
+            row = conn.execute(
+                "SELECT id, is_read FROM notifications WHERE id = ? AND user = ?",
+                (int(notification_id), user),
+            ).fetchone()
+            if row is None:
+                return False
+            conn.execute("DELETE FROM notifications WHERE id = ?", (row["id"],))
+            unread = not row["is_read"] and row["id"] > self._read_through(user)
+            conn.execute(
+                "UPDATE notification_users SET total = total - 1, "  # noqa: S608
+                f"unread = unread - ?, seq = {_NEXT_SEQ} WHERE user = ?",
+                (int(unread), user),
+            )
+        return True
+
+    def get_settings(self, user: str) -> NotificationSettings | None:
+        """Notification settings of a user"""
+        row = self.conn.execute(
+            "SELECT settings FROM notification_settings WHERE user = ?", (user,)
+        ).fetchone()
+        return (
+            NotificationSettings.model_validate_json(row["settings"]) if row else None
+        )
+
+    def save_settings(self, settings: NotificationSettings) -> None:
+        """Create or replace a user's notification settings"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO notification_settings (user, settings) "
+                "VALUES (?, ?)",
+                (settings.user, settings.model_dump_json()),
+            )
+
+
+# Global notification store instance
+notification_store = NotificationStore()
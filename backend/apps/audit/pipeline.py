@@ -0,0 +1,350 @@
+"""Notification pipeline with storm control
+
+Producers call ``notification_pipeline.notify`` instead of writing
+notifications directly. Between them and the store sit four stages:
+
+1. Preferences: events of a type the user turned off in their
+   ``NotificationSettings`` are dropped. A user's settings are read once per
+   ``notification_group_window_seconds``, so a change takes effect within
+   one window.
+2. Deduplication: an event identical to one seen in the last
+   ``notification_dedupe_seconds`` is dropped. Events are identical when
+   user, type and ``key`` match (or title and message, without a key).
+3. Grouping: the first event of one type for one user is written at once
+   and opens a ``notification_group_window_seconds`` window. Events of that
+   type arriving within the window are held and written as a single
+   notification when it closes - one event as itself, more as a summary
+   such as "1,982 minions down" that lists a sample of their keys.
+   Critical events are never held.
+4. Rate limiting: every user has a token bucket of
+   ``notification_rate_burst`` notifications refilled at
+   ``notification_rate_per_minute``. Notifications over the limit are
+   folded into a digest written once every ``notification_digest_seconds``.
+
+Pending state is bounded: at most ``notification_max_pending_groups``
+groups (the oldest is written early to make room), at most
+``notification_group_sample`` keys per group, at most
+``notification_dedupe_entries`` remembered events and, per user, cached
+settings and one digest counter per notification type.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+from apps.audit.mailer import Mailer, mailer
+from apps.audit.notifications import NotificationStore, notification_store
+from apps.audit.push import NotificationHub, notification_hub
+from apps.audit.schemas import NotificationPipelineStatus, NotificationSettings
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("info", "warning", "high", "critical")
+
+# Setting that turns each notification type off
+PREFERENCES = {
+    "job_completed": "notify_on_job_completion",
+    "job_failed": "notify_on_job_failure",
+    "minion_down": "notify_on_minion_down",
+    "compliance_failure": "notify_on_compliance_failure",
+}
+
+# Title of a group summary, by notification type
+GROUP_TITLES = {
+    "job_completed": "{count:,} jobs completed",
+    "job_failed": "{count:,} jobs failed",
+    "minion_down": "{count:,} minions down",
+    "compliance_failure": "{count:,} minions out of compliance",
+}
+
+
+@dataclass
+class _Group:
+    """Events of one type for one user held for the grouping window"""
+
+    deadline: float
+    title: str = ""
+    message: str = ""
+    priority: str = "info"
+    data: dict[str, Any] = field(default_factory=dict)
+    count: int = 0
+    keys: list[str] = field(default_factory=list)
+
+
+@dataclass
+class _Bucket:
+    """Token bucket and digest of one user"""
+
+    tokens: float
+    refilled: float
+    digest: dict[str, int] = field(default_factory=dict)
+    digest_due: float | None = None
+
+
+def _refill(bucket: _Bucket, now: float) -> None:
+    rate = settings.notification_rate_per_minute / 60
+    tokens = bucket.tokens + (now - bucket.refilled) * rate
+    bucket.tokens = min(float(settings.notification_rate_burst), tokens)
+    bucket.refilled = now
+
+
+def _higher(a: str, b: str) -> str:
+    rank = {priority: i for i, priority in enumerate(PRIORITIES)}
+    return a if rank.get(a, 0) >= rank.get(b, 0) else b
+
+
+def _summary(notification_type: str, group: _Group) -> tuple[str, str]:
+    """Title and message of a group of more than one event"""
+    template = GROUP_TITLES.get(
+        notification_type, f"{{count:,}} {notification_type} notifications"
+    )
+    title = template.format(count=group.count)
+    message = f"Latest: {group.message}"
+    if group.keys:
+        more = group.count - len(group.keys)
+        message = ", ".join(group.keys) + (f" and {more:,} more" if more > 0 else "")
+    return title, message
+
+
+class NotificationPipeline:
+    """Deduplicates, groups and rate-limits notifications before storing them"""
+
+    def __init__(
+        self, store: NotificationStore, hub: NotificationHub, mailer: Mailer
+    ) -> None:
+        self.store = store
+        self.hub = hub
+        self.mailer = mailer
+        self._groups: OrderedDict[tuple[str, str], _Group] = OrderedDict()
+        self._seen: OrderedDict[tuple[str, ...], float] = OrderedDict()
+        self._prefs: OrderedDict[str, tuple[float, NotificationSettings]] = (
+            OrderedDict()
+        )
+        self._buckets: dict[str, _Bucket] = {}
+        self._lock = asyncio.Lock()
+        self._counts = {"received": 0, "filtered": 0, "deduplicated": 0}
+        self._counts |= {"grouped": 0, "written": 0, "digested": 0}
+        self._task: asyncio.Task[None] | None = None
+
+    async def _wants(self, user: str, notification_type: str, now: float) -> bool:
+        preference = PREFERENCES.get(notification_type)
+        if preference is None:
+            return True
+        cached = self._prefs.get(user)
+        if cached is not None and cached[0] > now:
+            prefs = cached[1]
+        else:
+            prefs = await asyncio.to_thread(self.store.get_settings, user)
+            prefs = prefs or NotificationSettings(user=user)
+            expires = now + settings.notification_group_window_seconds
+            self._prefs[user] = (expires, prefs)
+            self._prefs.move_to_end(user)
+        return bool(getattr(prefs, preference))
+
+    def _is_duplicate(self, identity: tuple[str, ...], now: float) -> bool:
+        expires = self._seen.get(identity)
+        if expires is not None and expires > now:
+            return True
+        self._seen[identity] = now + settings.notification_dedupe_seconds
+        self._seen.move_to_end(identity)
+        while len(self._seen) > settings.notification_dedupe_entries:
+            self._seen.popitem(last=False)
+        return False
+
+    async def notify(
+        self,
+        user: str,
+        notification_type: str,
+        title: str,
+        message: str,
+        priority: str = "info",
+        data: dict[str, Any] | None = None,
+        key: str | None = None,
+        now: float | None = None,
+    ) -> bool:
+        """Submit an event, returning whether it was accepted
+
+        ``key`` names what the event is about (a minion id, a job id); it
+        identifies duplicates and is listed in group summaries.
+        """
+        now = time.monotonic() if now is None else now
+        # Read outside the lock: a slow settings read must not hold up others
+        wanted = await self._wants(user, notification_type, now)
+        async with self._lock:
+            self._counts["received"] += 1
+            if not wanted:
+                self._counts["filtered"] += 1
+                return False
+            identity = (user, notification_type, key or f"{title}\0{message}")
+            if self._is_duplicate(identity, now):
+                self._counts["deduplicated"] += 1
+                return False
+
+            event = _Group(now, title, message, priority, data or {}, count=1)
+            if priority == "critical":
+                await self._write_group(user, notification_type, event, now)
+                return True
+            group = self._groups.get((user, notification_type))
+            if group is None:
+                # Written at once; only what follows within the window is held
+                if len(self._groups) >= settings.notification_max_pending_groups:
+                    oldest, early = self._groups.popitem(last=False)
+                    await self._write_group(*oldest, early, now)
+                deadline = now + settings.notification_group_window_seconds
+                self._groups[(user, notification_type)] = _Group(deadline)
+                await self._write_group(user, notification_type, event, now)
+                return True
+
+            self._counts["grouped"] += 1
+            if group.count == 0:
+                group.title, group.message, group.data = title, message, data or {}
+                group.priority = priority
+            else:
+                group.priority = _higher(group.priority, priority)
+                group.message = message
+            group.count += 1
+            if key is not None and len(group.keys) < settings.notification_group_sample:
+                group.keys.append(key)
+            return True
+
+    def _take_token(self, user: str, now: float) -> bool:
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            burst = settings.notification_rate_burst
+            bucket = self._buckets[user] = _Bucket(tokens=burst, refilled=now)
+        _refill(bucket, now)
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True
+        return False
+
+    async def _write(
+        self,
+        user: str,
+        notification_type: str,
+        title: str,
+        message: str,
+        priority: str,
+        data: dict[str, Any],
+    ) -> None:
+        notification = await asyncio.to_thread(
+            self.store.create, user, notification_type, title, message, priority, data
+        )
+        self.hub.publish(user)
+        await asyncio.to_thread(self.mailer.enqueue, notification)
+        self._counts["written"] += 1
+
+    async def _write_group(
+        self, user: str, notification_type: str, group: _Group, now: float
+    ) -> None:
+        if group.count == 0:
+            # Nothing followed the first event of the window
+            return
+        if not self._take_token(user, now):
+            bucket = self._buckets[user]
+            bucket.digest[notification_type] = (
+                bucket.digest.get(notification_type, 0) + group.count
+            )
+            if bucket.digest_due is None:
+                bucket.digest_due = now + settings.notification_digest_seconds
+            self._counts["digested"] += group.count
+            return
+        title, message, data = group.title, group.message, group.data
+        if group.count > 1:
+            title, message = _summary(notification_type, group)
+            data = {"count": group.count, "keys": group.keys}
+        await self._write(user, notification_type, title, message, group.priority, data)
+
+    async def _write_digest(self, user: str, bucket: _Bucket) -> None:
+        counts = dict(sorted(bucket.digest.items()))
+        bucket.digest, bucket.digest_due = {}, None
+        total = sum(counts.values())
+        held = ", ".join(f"{count:,} {kind}" for kind, count in counts.items())
+        await self._write(
+            user,
+            "digest",
+            f"{total:,} notifications held back",
+            f"Rate limit reached; held back {held}",
+            "info",
+            {"counts": counts, "total": total},
+        )
+
+    async def flush(self, now: float | None = None, force: bool = False) -> int:
+        """Write groups whose window closed and digests that are due
+
+        ``force`` writes everything pending. Returns the notifications
+        written.
+        """
+        now = time.monotonic() if now is None else now
+        async with self._lock:
+            written = self._counts["written"]
+            due = [
+                (key, group)
+                for key, group in self._groups.items()
+                if force or group.deadline <= now
+            ]
+            for key, group in due:
+                del self._groups[key]
+                await self._write_group(*key, group, now)
+            for user, bucket in list(self._buckets.items()):
+                if bucket.digest and (force or (bucket.digest_due or 0) <= now):
+                    await self._write_digest(user, bucket)
+                    continue
+                _refill(bucket, now)
+                if (
+                    not bucket.digest
+                    and bucket.tokens >= settings.notification_rate_burst
+                ):
+                    # A full bucket carries no state worth keeping
+                    del self._buckets[user]
+            # Entries share one lifetime, so the oldest expire first
+            while self._seen and next(iter(self._seen.values())) <= now:
+                self._seen.popitem(last=False)
+            while self._prefs and next(iter(self._prefs.values()))[0] <= now:
+                self._prefs.popitem(last=False)
+            return self._counts["written"] - written
+
+    def status(self) -> NotificationPipelineStatus:
+        """Pending state sizes and event counters"""
+        return NotificationPipelineStatus(
+            pending_groups=len(self._groups),
+            pending_events=sum(group.count for group in self._groups.values()),
+            dedupe_entries=len(self._seen),
+            digesting_users=sum(1 for b in self._buckets.values() if b.digest),
+            **self._counts,
+        )
+
+    async def run_forever(self) -> None:
+        """Flush once a second until cancelled"""
+        while True:
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Notification flush failed")
+            await asyncio.sleep(1.0)
+
+    def start(self) -> None:
+        """Start flushing in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """Stop flushing and write everything still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(force=True)
+
+
+# Global notification pipeline instance
+notification_pipeline = NotificationPipeline(
+    notification_store, notification_hub, mailer
+)
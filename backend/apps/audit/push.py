@@ -0,0 +1,166 @@
+"""Real-time notification push
+
+Sessions (an SSE stream or a long-poll request) wait on the hub instead of
+polling the API. A session registers an event for its user, reads what it
+has not seen yet - notifications with a larger id than the last one it got,
+and the unread count if it changed - then waits for the event.
+
+Writes in this process wake the user's sessions through ``publish``. Writes
+by other workers are noticed by a watcher that checks ``PRAGMA data_version``
+of the notification database every ``notification_watch_seconds`` while any
+session is waiting, reads the users whose change ``seq`` moved (see
+``apps.audit.notifications``) and wakes only their sessions.
+
+Notification events carry the notification id as their SSE ``id``, so a
+browser ``EventSource`` resumes after the last one it received by itself
+(``Last-Event-ID``); other clients pass ``last_id``.
+"""
+
+import asyncio
+import json
+import logging
+from collections.abc import AsyncIterator, Iterator
+from contextlib import contextmanager
+
+from apps.audit.notifications import NotificationStore, notification_store
+from apps.audit.schemas import NotificationUpdate
+from config.database import data_version
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Notifications sent per read while catching up
+_BATCH = 100
+
+
+class NotificationHub:
+    """Wakes the waiting sessions of users whose notifications changed"""
+
+    def __init__(self, store: NotificationStore) -> None:
+        self.store = store
+        self._waiters: dict[str, set[asyncio.Event]] = {}
+        self._version: int | None = None
+        self._seq = 0
+        self._task: asyncio.Task[None] | None = None
+
+    @contextmanager
+    def subscribe(self, user: str) -> Iterator[asyncio.Event]:
+        """Register an event that is set whenever ``user``'s notifications change"""
+        event = asyncio.Event()
+        self._waiters.setdefault(user, set()).add(event)
+        try:
+            yield event
+        finally:
+            waiters = self._waiters.get(user, set())
+            waiters.discard(event)
+            if not waiters:
+                self._waiters.pop(user, None)
+
+    def publish(self, user: str) -> None:
+        """Wake the sessions of ``user``"""
+        for event in self._waiters.get(user, ()):
+            event.set()
+
+    def sessions(self) -> int:
+        """Number of sessions currently waiting"""
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def check(self) -> None:
+        """Wake the sessions of users another worker wrote notifications for"""
+        version = data_version(self.store.conn)
+        if version == self._version:
+            return
+        if self._version is None:
+            # Nothing was missed before the first check
+            _, self._seq = self.store.changed_since(self._seq)
+        else:
+            users, self._seq = self.store.changed_since(self._seq)
+            for user in users:
+                self.publish(user)
+        self._version = version
+
+    async def run_forever(self) -> None:
+        """Watch for writes by other workers until cancelled"""
+        while True:
+            try:
+                if self._waiters or self._version is None:
+                    self.check()
+            except Exception:
+                logger.exception("Notification watch failed")
+            await asyncio.sleep(settings.notification_watch_seconds)
+
+    def start(self) -> None:
+        """Start the watcher in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """Stop the watcher"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def updates(
+        self,
+        user: str,
+        last_id: int | None = None,
+        unread: int | None = None,
+        count_only: bool = False,
+        keepalive: float | None = None,
+    ) -> AsyncIterator[NotificationUpdate | None]:
+        """Yield what changed for ``user`` for as long as the caller iterates
+
+        Starts after notification ``last_id`` (or after the newest one when
+        it is ``None``) and from the ``unread`` count the caller last saw.
+        Updates are yielded when there are new notifications or the unread
+        count differs, so without ``unread`` the first one is immediate.
+        ``None`` is yielded after ``keepalive`` seconds without updates.
+        """
+        if last_id is None:
+            last_id = await asyncio.to_thread(self.store.last_id, user)
+        first = unread is None
+        with self.subscribe(user) as event:
+            while True:
+                event.clear()
+                notifications, count = await asyncio.to_thread(
+                    self.store.updates_after, user, last_id, _BATCH, count_only
+                )
+                if notifications:
+                    last_id = int(notifications[-1].id)
+                if first or notifications or count != unread:
+                    first, unread = False, count
+                    yield NotificationUpdate(
+                        notifications=notifications, unread=count, last_id=last_id
+                    )
+                    if len(notifications) == _BATCH:
+                        continue
+                try:
+                    await asyncio.wait_for(event.wait(), keepalive)
+                except TimeoutError:
+                    yield None
+
+
+def format_events(update: NotificationUpdate | None) -> str:
+    """Render an update as Server-Sent Events
+
+    Each notification is an ``id``-carrying ``notification`` event; the
+    unread count follows as a ``count`` event. ``None`` is a keepalive
+    comment.
+    """
+    if update is None:
+        return ": keepalive\n\n"
+    events = [
+        f"id: {n.id}\nevent: notification\ndata: {n.model_dump_json()}\n\n"
+        for n in update.notifications
+    ]
+    count = json.dumps({"unread": update.unread, "last_id": update.last_id})
+    events.append(f"event: count\ndata: {count}\n\n")
+    return "".join(events)
+
+
+# Global notification hub instance
+notification_hub = NotificationHub(notification_store)
@@ -0,0 +1,169 @@
+"""Batched compliance remediation
+
+Remediation re-applies only what failed. Non-compliant minions are grouped by
+the set of SLS their failed states come from, and every group gets one
+``state.apply <sls,...>`` per ``remediation_batch_size`` minions, targeted
+as a list; minions whose highstate did not render get a full ``state.apply``
+instead. All remediations share one limit of ``remediation_concurrency``
+calls in flight, so remediating thousands of minions costs a handful of
+targeted jobs rather than a highstate per minion.
+
+Each batch runs as a tracked (cancellable) job given up to
+``remediation_job_timeout_seconds`` to return; the returns it got go straight
+back into the compliance engine, and the remediation's progress is persisted
+after every batch.
+"""
+
+import asyncio
+import logging
+from collections.abc import Iterable
+from datetime import UTC, datetime
+
+from apps.audit.compliance import (
+    RENDER_FAILURE,
+    ComplianceEngine,
+    ComplianceStore,
+    compliance_engine,
+    compliance_store,
+)
+from apps.audit.schemas import MinionCompliance, RemediationRun
+from apps.salt.job_engine import JobEngine, job_engine
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def plan_remediation(
+    records: Iterable[MinionCompliance],
+) -> dict[tuple[str, ...], list[str]]:
+    """Group non-compliant minions by the SLS that failed on them
+
+    The empty key collects minions that need a full highstate.
+    """
+    groups: dict[tuple[str, ...], list[str]] = {}
+    for record in records:
+        if record.is_compliant or not record.failed_states:
+            continue
+        failed = {(f.state_name, f.state_id) for f in record.failed_states}
+        mods: tuple[str, ...] = ()
+        if RENDER_FAILURE not in failed:
+            mods = tuple(sorted({state_name for state_name, _ in failed}))
+        groups.setdefault(mods, []).append(record.minion_id)
+    return groups
+
+
+class Remediator:
+    """Runs remediations through the job engine under one concurrency limit"""
+
+    def __init__(
+        self, store: ComplianceStore, engine: ComplianceEngine, jobs: JobEngine
+    ) -> None:
+        self.store = store
+        self.engine = engine
+        self.jobs = jobs
+        self._semaphore = asyncio.Semaphore(settings.remediation_concurrency)
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    def _records(self, minion_ids: list[str] | None) -> list[MinionCompliance]:
+        if minion_ids is not None:
+            found = (self.store.get(minion_id) for minion_id in minion_ids)
+            return [record for record in found if record is not None]
+        records: list[MinionCompliance] = []
+        cursor: str | None = None
+        while True:
+            page, cursor = self.store.list_page(
+                compliant=False, cursor=cursor, limit=1000
+            )
+            records.extend(page)
+            if cursor is None:
+                return records
+
+    async def start(
+        self, minion_ids: list[str] | None = None, submitted_by: str | None = None
+    ) -> RemediationRun:
+        """Plan a remediation and run it in the background
+
+        ``minion_ids`` defaults to every non-compliant minion. Returns the
+        remediation as it starts; poll it by id for progress.
+        """
+        records = await asyncio.to_thread(self._records, minion_ids)
+        groups = plan_remediation(records)
+        size = settings.remediation_batch_size
+        batches = [
+            (mods, minions[i : i + size])
+            for mods, minions in groups.items()
+            for i in range(0, len(minions), size)
+        ]
+        run = await asyncio.to_thread(self.store.create_remediation, submitted_by)
+        run.minions = sum(len(minions) for minions in groups.values())
+        run.groups = len(groups)
+        run.batches = len(batches)
+        if not batches:
+            run.status = "succeeded"
+            run.finished_at = datetime.now(tz=UTC).isoformat()
+        self.store.save_remediation(run)
+
+        if batches:
+            task = asyncio.create_task(self._run(run, batches))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return run.model_copy(deep=True)
+
+    async def _run(
+        self, run: RemediationRun, batches: list[tuple[tuple[str, ...], list[str]]]
+    ) -> None:
+        try:
+            await asyncio.gather(
+                *(self._run_batch(run, mods, minions) for mods, minions in batches)
+            )
+        except asyncio.CancelledError:
+            run.status = "cancelled"
+            raise
+        else:
+            if run.still_failing == 0:
+                run.status = "succeeded"
+            elif run.remediated:
+                run.status = "partial"
+            else:
+                run.status = "failed"
+        finally:
+            run.finished_at = datetime.now(tz=UTC).isoformat()
+            self.store.save_remediation(run)
+
+    async def _run_batch(
+        self, run: RemediationRun, mods: tuple[str, ...], minion_ids: list[str]
+    ) -> None:
+        async with self._semaphore:
+            result = await self.jobs.run_target(
+                target=",".join(minion_ids),
+                function="state.apply",
+                args=[",".join(mods)] if mods else None,
+                tgt_type="list",
+                submitted_by=f"remediation:{run.id}",
+                timeout=settings.remediation_job_timeout_seconds,
+            )
+        if result.job_id:
+            run.job_ids.append(result.job_id)
+        remediated = 0
+        if result.error or not result.jid:
+            run.errors.append(result.error or "No jid returned")
+        # Minions lost or still running when the batch timed out stay failing
+        returns = {m: r for m, r in result.minions.items() if m not in result.lost}
+        if result.jid and returns:
+            updated = await self.engine.ingest(returns, result.jid, partial=bool(mods))
+            remediated = sum(record.is_compliant for record in updated)
+        run.remediated += remediated
+        run.still_failing += len(minion_ids) - remediated
+        run.completed_batches += 1
+        self.store.save_remediation(run)
+
+    async def stop(self) -> None:
+        """Cancel remediations still in progress"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+# Global remediator instance
+remediator = Remediator(compliance_store, compliance_engine, job_engine)
@@ -0,0 +1,133 @@
+"""Audit log retention
+
+``audit_retention_policies`` is an ordered list of rules and every action
+belongs to the first rule whose ``actions`` glob matches it. A rule expires
+the entries of its class that are older than ``max_age_days`` or beyond the
+newest ``max_entries``; a rule with neither keeps its class forever, as do
+actions no rule matches. Every ``audit_retention_interval_seconds`` the
+worker holding the retention lease moves expired entries to the archive
+(see ``apps.audit.archive``), which keeps the hot log small while archived
+entries stay readable through the audit API, and drops minute and hour
+rollups past their own retention (see ``apps.audit.rollups``).
+"""
+
+import asyncio
+import logging
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from apps.audit.schemas import AuditRetentionPolicy, AuditRetentionStatus
+from apps.audit.store import AuditStore, audit_store, to_micros
+from config.database import WORKER_ID
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def load_policies() -> list[AuditRetentionPolicy]:
+    """Parse ``audit_retention_policies``"""
+    return [
+        AuditRetentionPolicy(**policy) for policy in settings.audit_retention_policies
+    ]
+
+
+def expiry_clauses(
+    store: AuditStore, policies: list[AuditRetentionPolicy], now: datetime
+) -> list[tuple[str, list[Any]]]:
+    """SQL conditions, with their parameters, selecting each class's expired rows"""
+    clauses: list[tuple[str, list[Any]]] = []
+    for index, policy in enumerate(policies):
+        # A class is the rule's glob minus every earlier rule's glob
+        earlier = [p.actions for p in policies[:index]]
+        members = " AND ".join(["action GLOB ?"] + ["NOT action GLOB ?"] * len(earlier))
+        member_params: list[Any] = [policy.actions, *earlier]
+
+        expired: list[str] = []
+        params: list[Any] = []
+        if policy.max_age_days is not None:
+            expired.append("ts < ?")
+            params.append(to_micros(now - timedelta(days=policy.max_age_days)))
+        if policy.max_entries is not None:
+            cutoff = store.retention_cutoff(members, member_params, policy.max_entries)
+            if cutoff is not None:
+                expired.append("(ts, seq) <= (?, ?)")
+                params.extend(cutoff)
+        if expired:
+            clauses.append(
+                (f"{members} AND ({' OR '.join(expired)})", member_params + params)
+            )
+    return clauses
+
+
+class AuditRetention:
+    """Periodically archives expired audit entries on one worker"""
+
+    def __init__(self, store: AuditStore) -> None:
+        self.store = store
+        self.owner = f"{WORKER_ID}:{id(self):x}"
+        self.last_run: datetime | None = None
+        self.last_archived = 0
+        self._task: asyncio.Task[None] | None = None
+
+    def run_once(self, now: datetime | None = None) -> int | None:
+        """Archive expired entries if this worker holds the retention lease
+
+        Returns the number of entries archived, or ``None`` when another
+        worker holds the lease.
+        """
+        now = now or datetime.now(tz=UTC)
+        lease = settings.audit_retention_interval_seconds * 2
+        if not self.store.acquire_lease(self.owner, lease, now):
+            return None
+
+        archived = 0
+        for where, params in expiry_clauses(self.store, load_policies(), now):
+            archived += self.store.archive(
+                where, params, settings.audit_archive_part_entries
+            )
+        pruned = self.store.prune_rollups(now)
+        self.last_run, self.last_archived = now, archived
+        if archived:
+            logger.info("Archived %d expired audit entries", archived)
+        if pruned:
+            logger.info("Dropped %d expired audit rollups", pruned)
+        return archived
+
+    def status(self) -> AuditRetentionStatus:
+        """Policies, storage sizes and the outcome of the last run"""
+        return AuditRetentionStatus(
+            enabled=settings.audit_retention_enabled,
+            policies=load_policies(),
+            last_run=self.last_run,
+            last_archived=self.last_archived,
+            **self.store.storage_summary(),
+        )
+
+    async def run_forever(self) -> None:
+        """Run retention until cancelled"""
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception:
+                logger.exception("Audit retention run failed")
+            await asyncio.sleep(settings.audit_retention_interval_seconds)
+
+    def start(self) -> None:
+        """Start the retention loop in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """Stop the loop and release the lease"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.store.release_lease(self.owner)
+
+
+# Global retention instance
+audit_retention = AuditRetention(audit_store)
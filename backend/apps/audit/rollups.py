@@ -0,0 +1,139 @@
+"""Pre-aggregated audit rollups
+
+Alongside the raw log the audit database keeps per-minute, per-hour and
+per-day counts keyed by (action, user, resource_type, result). The counts are
+updated in the same transaction that appends entries, one upsert per distinct
+key in the batch, so dashboards read O(buckets) rows instead of scanning the
+log. Rollups are not pruned with the raw log, so statistics keep working
+after retention; instead retention drops minute rollups after
+``audit_rollup_minute_days`` and hour rollups after ``audit_rollup_hour_days``
+(``prune_rollups``). Day rollups are kept forever.
+"""
+
+import sqlite3
+from collections import Counter
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from typing import Any
+
+from config.settings import settings
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit_rollup (
+    granularity TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    user TEXT NOT NULL,
+    resource_type TEXT NOT NULL,
+    result TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (granularity, bucket, action, user, resource_type, result)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_rollup_action ON audit_rollup (granularity, action);
+"""
+
+# Bucket width in seconds per granularity
+GRANULARITIES = {"minute": 60, "hour": 3600, "day": 86400}
+
+# Columns a stats query can group and filter by
+DIMENSIONS = ("action", "user", "resource_type", "result")
+
+
+def rollup_counts(
+    rows: Iterable[tuple[int, str, str, str, str]],
+) -> Counter[tuple[str, int, str, str, str, str]]:
+    """Count ``(ts_micros, action, user, resource_type, result)`` rows per bucket"""
+    counts: Counter[tuple[str, int, str, str, str, str]] = Counter()
+    for ts, action, user, resource_type, result in rows:
+        seconds = ts // 1_000_000
+        for granularity, width in GRANULARITIES.items():
+            bucket = seconds - seconds % width
+            counts[(granularity, bucket, action, user, resource_type, result)] += 1
+    return counts
+
+
+def apply_rollups(
+    conn: sqlite3.Connection, counts: Counter[tuple[str, int, str, str, str, str]]
+) -> None:
+    """Add counts to the rollup tables (call inside the append transaction)"""
+    conn.executemany(
+        "INSERT INTO audit_rollup "
+        "(granularity, bucket, action, user, resource_type, result, count) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT DO UPDATE SET count = count + excluded.count",
+        [(*key, count) for key, count in counts.items()],
+    )
+
+
+def rebuild_rollups(conn: sqlite3.Connection) -> None:
+    """Recompute all rollups from the raw log"""
+    conn.execute("DELETE FROM audit_rollup")
+    for granularity, width in GRANULARITIES.items():
+        conn.execute(
+            "INSERT INTO audit_rollup "
+            "(granularity, bucket, action, user, resource_type, result, count) "
+            "SELECT ?, (ts / 1000000) - (ts / 1000000) % ?, "
+            "action, user, resource_type, result, COUNT(*) FROM audit_log "
+            "GROUP BY 2, action, user, resource_type, result",
+            (granularity, width),
+        )
+
+
+def prune_rollups(conn: sqlite3.Connection, now: datetime) -> int:
+    """Drop minute and hour rollups past their retention, returning the count"""
+    deleted = 0
+    for granularity, days in (
+        ("minute", settings.audit_rollup_minute_days),
+        ("hour", settings.audit_rollup_hour_days),
+    ):
+        cursor = conn.execute(
+            "DELETE FROM audit_rollup WHERE granularity = ? AND bucket < ?",
+            (granularity, int((now - timedelta(days=days)).timestamp())),
+        )
+        deleted += cursor.rowcount
+    return deleted
+
+
+def query_rollups(
+    conn: sqlite3.Connection,
+    granularity: str,
+    since: datetime,
+    until: datetime,
+    group_by: list[str],
+    filters: dict[str, str | None],
+    limit: int,
+) -> list[dict[str, Any]]:
+    """Sum rollup counts per bucket and ``group_by`` dimensions
+
+    Raises ``ValueError`` for an unknown granularity or dimension.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    unknown = set(group_by) - set(DIMENSIONS)
+    if unknown:
+        raise ValueError(f"Unknown dimension: {', '.join(sorted(unknown))}")
+    width = GRANULARITIES[granularity]
+    start = int(since.timestamp())
+    where = ["granularity = ?", "bucket >= ?", "bucket < ?"]
+    params: list[Any] = [granularity, start - start % width, int(until.timestamp())]
+    for dimension in DIMENSIONS:
+        if filters.get(dimension):
+            where.append(f"{dimension} = ?")
+            params.append(filters[dimension])
+    columns = ", ".join(["bucket", *group_by])
+    rows = conn.execute(
+        f"SELECT {columns}, SUM(count) AS count FROM audit_rollup "  # noqa: S608
+        f"WHERE {' AND '.join(where)} GROUP BY {columns} ORDER BY {columns} "
+        "LIMIT ?",
+        (*params, limit),
+    )
+    return [dict(row) for row in rows]
+
+
+def distinct_actions(conn: sqlite3.Connection) -> list[str]:
+    """Every action ever recorded, read from the day rollups"""
+    rows = conn.execute(
+        "SELECT DISTINCT action FROM audit_rollup WHERE granularity = 'day' "
+        "ORDER BY action"
+    )
+    return [row["action"] for row in rows]
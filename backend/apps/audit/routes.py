@@ -1,97 +1,268 @@
 """Audit, compliance and notifications routes"""
 
-from datetime import UTC, datetime
+import asyncio
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime, timedelta
 from typing import Any
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+
+from apps.audit.compliance import compliance_store
+from apps.audit.drift import drift_scanner, drift_store
+from apps.audit.export import (
+    MEDIA_TYPES,
+    ExportUnavailableError,
+    check_export,
+    export_filename,
+    stream_export,
+)
+from apps.audit.history import percentage
+from apps.audit.mailer import mailer
+from apps.audit.notifications import notification_store
+from apps.audit.pipeline import notification_pipeline
+from apps.audit.push import format_events, notification_hub
+from apps.audit.remediation import plan_remediation, remediator
+from apps.audit.retention import audit_retention
 from apps.audit.schemas import *
+from apps.audit.store import audit_store
+from apps.audit.writer import audit_writer, generate_ulid
 from apps.auth.routes import get_current_active_user, require_role
 from apps.auth.schemas import User
+from config.pagination import set_next_cursor
+from config.settings import settings
 
 router = APIRouter(prefix="/api/v1")
 
 
 # ===== Audit Endpoints =====
-# Mock audit log storage (replace with database)
-audit_logs_db: list[AuditLog] = [
-    AuditLog(
-        id="1",
-        timestamp=datetime.now(tz=UTC),
-        user="admin",
-        action="job.execute",
-        resource_type="job",
-        resource_id="20240113001",
-        details={"function": "test.ping", "target": "*"},
-        result="success",
-        ip_address="192.168.1.100",
-    ),
-]
-
-
-@router.get("", response_model=list[AuditLog])
+@router.get("/audit", response_model=list[AuditLog])
 async def list_audit_logs(
+    response: Response,
     user: str | None = None,
     action: str | None = None,
     resource_type: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: str | None = None,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    archived: bool = False,
     current_user: User = Depends(require_role("admin", "auditor")),
 ) -> list[AuditLog]:
-    """List audit logs with filtering."""
-    logs = audit_logs_db.copy()
+    """List audit logs with filtering (newest first).
+
+    Pass the ``X-Next-Cursor`` response header back as ``cursor`` to fetch the
+    next page. ``archived=true`` lists entries moved to the archive by
+    retention instead (slower).
+    """
+    try:
+        logs, next_cursor = audit_store.list_page(
+            user=user,
+            action=action,
+            resource_type=resource_type,
+            cursor=cursor,
+            skip=skip,
+            limit=limit,
+            since=since,
+            until=until,
+            archived=archived,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    set_next_cursor(response, next_cursor)
+    return logs
 
-    # Filter by user
-    if user:
-        logs = [log for log in logs if log.user == user]
 
-    # Filter by action
-    if action:
-        logs = [log for log in logs if log.action == action]
+@router.get("/audit/export")
+async def export_audit_logs(
+    export_format: str = Query("ndjson", alias="format"),
+    compression: str = "none",
+    user: str | None = None,
+    action: str | None = None,
+    resource_type: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    archived: bool = False,
+    current_user: User = Depends(require_role("admin", "auditor")),
+) -> StreamingResponse:
+    """Stream matching audit logs as CSV, NDJSON or Parquet (newest first).
+
+    ``archived=true`` exports archived entries instead.
+    """
+    try:
+        check_export(export_format, compression)
+    except ExportUnavailableError as e:
+        raise HTTPException(status_code=501, detail=str(e)) from e
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    batches = audit_store.iter_batches(
+        user=user,
+        action=action,
+        resource_type=resource_type,
+        since=since,
+        until=until,
+        batch_size=settings.audit_export_batch_size,
+        archived=archived,
+    )
+    filename = export_filename(export_format, compression)
+    return StreamingResponse(
+        stream_export(batches, export_format, compression),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
-    # Filter by resource type
-    if resource_type:
-        logs = [log for log in logs if log.resource_type == resource_type]
 
-    # Sort by timestamp (newest first)
-    logs.sort(key=lambda x: x.timestamp, reverse=True)
+@router.get("/audit/search", response_model=list[AuditLog])
+async def search_audit_logs(
+    response: Response,
+    q: str = Query(..., min_length=1),
+    user: str | None = None,
+    action: str | None = None,
+    resource_type: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(require_role("admin", "auditor")),
+) -> list[AuditLog]:
+    """Full-text search over audit actions, resource ids and details.
+
+    ``q`` supports ``"exact phrases"``, ``prefix*`` and ``AND``/``OR``/``NOT``.
+    """
+    try:
+        logs, next_cursor = audit_store.search(
+            q,
+            user=user,
+            action=action,
+            resource_type=resource_type,
+            since=since,
+            until=until,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    set_next_cursor(response, next_cursor)
+    return logs
+
+
+@router.get("/audit/stats", response_model=AuditStats)
+async def get_audit_stats(
+    granularity: str = "hour",
+    since: datetime | None = None,
+    until: datetime | None = None,
+    group_by: list[str] = Query([]),
+    user: str | None = None,
+    action: str | None = None,
+    resource_type: str | None = None,
+    result: str | None = None,
+    limit: int = Query(10000, ge=1, le=100000),
+    current_user: User = Depends(require_role("admin", "auditor")),
+) -> AuditStats:
+    """Count audit entries per minute, hour or day from the rollup tables.
+
+    ``since`` defaults to 24 hours before ``until``, which defaults to now.
+    Minute counts are kept for ``audit_rollup_minute_days`` and hour counts
+    for ``audit_rollup_hour_days``; day counts are kept forever.
+    """
+    until = until or datetime.now(tz=UTC)
+    since = since or until - timedelta(days=1)
+    filters = {
+        "user": user,
+        "action": action,
+        "resource_type": resource_type,
+        "result": result,
+    }
+    try:
+        rows = audit_store.stats(granularity, since, until, group_by, filters, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    buckets = [
+        AuditStatsBucket(
+            **{**row, "bucket": datetime.fromtimestamp(row["bucket"], UTC)}
+        )
+        for row in rows
+    ]
+    return AuditStats(
+        granularity=granularity,
+        since=since,
+        until=until,
+        group_by=group_by,
+        total=sum(b.count for b in buckets),
+        buckets=buckets,
+    )
 
-    # Pagination
-    return logs[skip : skip + limit]
+
+@router.get("/audit/writer/stats", response_model=AuditWriterStats)
+async def get_audit_writer_stats(
+    current_user: User = Depends(require_role("admin", "auditor")),
+) -> AuditWriterStats:
+    """Get audit writer queue depth, throughput and backpressure metrics."""
+    return audit_writer.stats()
+
+
+@router.get("/audit/retention", response_model=AuditRetentionStatus)
+async def get_audit_retention(
+    current_user: User = Depends(require_role("admin", "auditor")),
+) -> AuditRetentionStatus:
+    """Get retention policies and the size of hot and archived audit storage."""
+    return await asyncio.to_thread(audit_retention.status)
+
+
+@router.post("/audit/retention/run", response_model=AuditRetentionRun)
+async def run_audit_retention(
+    current_user: User = Depends(require_role("admin")),
+) -> AuditRetentionRun:
+    """Archive expired audit entries now instead of waiting for the next run."""
+    try:
+        archived = await asyncio.to_thread(audit_retention.run_once)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+    return AuditRetentionRun(archived=archived or 0, ran=archived is not None)
 
 
-@router.get("/{log_id}", response_model=AuditLog)
+@router.get("/audit/{log_id}", response_model=AuditLog)
 async def get_audit_log(
     log_id: str,
     current_user: User = Depends(require_role("admin", "auditor")),
 ) -> AuditLog:
-    """Get a specific audit log."""
-    for log in audit_logs_db:
-        if log.id == log_id:
-            return log
-    raise HTTPException(status_code=404, detail="Audit log not found")
+    """Get a specific audit log, looking in the archive if it has expired."""
+    log = await asyncio.to_thread(audit_store.get, log_id)
+    if not log:
+        raise HTTPException(status_code=404, detail="Audit log not found")
+    return log
 
 
-@router.get("/users/{username}", response_model=list[AuditLog])
+@router.get("/audit/users/{username}", response_model=list[AuditLog])
 async def get_user_audit_logs(
     username: str,
+    response: Response,
+    cursor: str | None = None,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    archived: bool = False,
     current_user: User = Depends(require_role("admin", "auditor")),
 ) -> list[AuditLog]:
     """Get audit logs for a specific user."""
-    logs = [log for log in audit_logs_db if log.user == username]
-    logs.sort(key=lambda x: x.timestamp, reverse=True)
-    return logs[skip : skip + limit]
+    try:
+        logs, next_cursor = audit_store.list_page(
+            user=username, cursor=cursor, skip=skip, limit=limit, archived=archived
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    set_next_cursor(response, next_cursor)
+    return logs
 
 
-@router.get("/actions/list", response_model=list[str])
+@router.get("/audit/actions/list", response_model=list[str])
 async def list_action_types(
     current_user: User = Depends(require_role("admin", "auditor")),
 ) -> list[str]:
     """List all action types in audit logs."""
-    actions = set(log.action for log in audit_logs_db)
-    return sorted(actions)
+    return audit_store.list_actions()
 
 
 async def create_audit_log(
@@ -104,11 +275,9 @@ async def create_audit_log(
     ip_address: str | None = None,
 ) -> AuditLog:
     """Create a new audit log entry (internal function)."""
-    log_id = str(len(audit_logs_db) + 1)
-
     audit_log = AuditLog(
-        id=log_id,
-        timestamp=datetime.now(),
+        id=generate_ulid(),
+        timestamp=datetime.now(tz=UTC),
         user=user,
         action=action,
         resource_type=resource_type,
@@ -118,255 +287,349 @@ async def create_audit_log(
         ip_address=ip_address,
     )
 
-    audit_logs_db.append(audit_log)
+    await audit_writer.record(audit_log)
     return audit_log
 
 
 # ===== Compliance Endpoints =====
-# Mock compliance data (replace with real data from Salt)
-mock_compliance_data: dict[str, Any] = {
-    "overall": ComplianceStatus(
-        total_minions=3,
-        compliant_minions=2,
-        non_compliant_minions=1,
-        compliance_percentage=66.7,
-        last_check="2024-01-13T08:00:00",
-    ),
-    "minions": {
-        "minion-1": MinionCompliance(
-            minion_id="minion-1",
-            is_compliant=True,
-            failed_states=[],
-            last_highstate="2024-01-13T07:00:00",
-            compliance_score=100.0,
-        ),
-        "minion-2": MinionCompliance(
-            minion_id="minion-2",
-            is_compliant=True,
-            failed_states=[],
-            last_highstate="2024-01-13T06:30:00",
-            compliance_score=100.0,
-        ),
-        "minion-3": MinionCompliance(
-            minion_id="minion-3",
-            is_compliant=False,
-            failed_states=[
-                FailedState(
-                    state_name="webserver.nginx",
-                    state_id="nginx-install",
-                    reason="Package nginx not found",
-                    failed_at="2024-01-13T05:00:00",
-                )
-            ],
-            last_highstate="2024-01-13T05:00:00",
-            compliance_score=85.0,
-        ),
-    },
-}
-
-
-@router.get("/status", response_model=ComplianceStatus)
+@router.get("/compliance/status", response_model=ComplianceStatus)
 async def get_compliance_status(
     current_user: User = Depends(get_current_active_user),
 ) -> ComplianceStatus:
     """Get overall compliance status."""
-    return cast(ComplianceStatus, mock_compliance_data["overall"])
+    return compliance_store.status()
+
+
+@router.get("/compliance/nodegroups", response_model=list[NodegroupCompliance])
+async def get_nodegroup_compliance(
+    current_user: User = Depends(get_current_active_user),
+) -> list[NodegroupCompliance]:
+    """Get the compliance status of every nodegroup."""
+    return compliance_store.nodegroup_status()
+
+
+@router.get("/compliance/trend", response_model=ComplianceTrend)
+async def get_compliance_trend(
+    nodegroup: str | None = None,
+    granularity: str = "hour",
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = Query(10000, ge=1, le=100000),
+    current_user: User = Depends(get_current_active_user),
+) -> ComplianceTrend:
+    """Get the compliance history of the fleet or one nodegroup.
+
+    ``granularity`` is ``raw`` (kept 7 days), ``hour`` (kept 90 days) or
+    ``day`` (kept forever). ``since`` defaults to 30 days before ``until``,
+    which defaults to now.
+    """
+    until = until or datetime.now(tz=UTC)
+    since = since or until - timedelta(days=30)
+    try:
+        rows = compliance_store.history(nodegroup, granularity, since, until, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    points = [
+        ComplianceTrendPoint(
+            timestamp=datetime.fromtimestamp(row["bucket"], UTC),
+            total_minions=row["total"],
+            compliant_minions=row["compliant"],
+            compliance_percentage=percentage(row["total"], row["compliant"]),
+            low=row["low"],
+            high=row["high"],
+        )
+        for row in rows
+    ]
+    return ComplianceTrend(
+        nodegroup=nodegroup,
+        granularity=granularity,
+        since=since,
+        until=until,
+        points=points,
+    )
 
 
-@router.get("/minions/{minion_id}", response_model=MinionCompliance)
+@router.get("/compliance/minions", response_model=list[MinionCompliance])
+async def list_minion_compliance(
+    response: Response,
+    compliant: bool | None = None,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_active_user),
+) -> list[MinionCompliance]:
+    """List minion compliance records by minion id.
+
+    Pass the ``X-Next-Cursor`` response header back as ``cursor`` to fetch the
+    next page.
+    """
+    try:
+        records, next_cursor = compliance_store.list_page(
+            compliant=compliant, cursor=cursor, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    set_next_cursor(response, next_cursor)
+    return records
+
+
+@router.get("/compliance/minions/{minion_id}", response_model=MinionCompliance)
 async def get_minion_compliance(
     minion_id: str,
     current_user: User = Depends(get_current_active_user),
 ) -> MinionCompliance:
     """Get compliance status for a specific minion."""
-    minions_data = cast(
-        dict[str, MinionCompliance], mock_compliance_data.get("minions", {})
-    )
-    compliance = minions_data.get(minion_id)
+    compliance = compliance_store.get(minion_id)
     if not compliance:
         raise HTTPException(status_code=404, detail="Minion not found")
     return compliance
 
 
-@router.get("/failed-states", response_model=list[dict[str, Any]])
+@router.get("/compliance/failed-states", response_model=list[MinionFailedState])
 async def get_failed_states(
+    response: Response,
+    state_name: str | None = None,
+    state_id: str | None = None,
+    cluster: str | None = None,
+    since: datetime | None = None,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
     current_user: User = Depends(get_current_active_user),
-) -> list[dict[str, Any]]:
-    """Get all failed states across all minions."""
-    failed_states: list[dict[str, Any]] = []
-    minions_data = cast(
-        dict[str, MinionCompliance], mock_compliance_data.get("minions", {})
-    )
-    for minion_id, compliance in minions_data.items():
-        for failed_state in compliance.failed_states:
-            failed_states.append(
-                {
-                    "minion_id": minion_id,
-                    **failed_state.model_dump(),
-                }
-            )
-    return failed_states
-
-
-@router.get("/drift", response_model=list[DriftDetection])
+) -> list[MinionFailedState]:
+    """List failed states across the fleet, newest failures first.
+
+    Filter by SLS (``state_name``), ``state_id`` or failure reason
+    ``cluster``; ``since`` keeps states that started failing at or after it.
+    Pass the ``X-Next-Cursor`` header back as ``cursor`` for the next page.
+    """
+    try:
+        failures, next_cursor = compliance_store.list_failures(
+            state_name=state_name,
+            state_id=state_id,
+            cluster=cluster,
+            since=since,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    set_next_cursor(response, next_cursor)
+    return failures
+
+
+@router.get("/compliance/failed-states/top", response_model=list[FailingState])
+async def get_top_failing_states(
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(20, ge=1, le=1000),
+    current_user: User = Depends(get_current_active_user),
+) -> list[FailingState]:
+    """List the states failing on the most minions."""
+    try:
+        states, next_cursor = compliance_store.top_failing_states(cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    set_next_cursor(response, next_cursor)
+    return states
+
+
+@router.get(
+    "/compliance/failed-states/reasons", response_model=list[FailureCluster]
+)
+async def get_failure_reasons(
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(20, ge=1, le=1000),
+    current_user: User = Depends(get_current_active_user),
+) -> list[FailureCluster]:
+    """List failure reasons clustered by pattern, most frequent first.
+
+    Use a cluster's id as ``cluster`` on ``/compliance/failed-states`` to
+    list its failures.
+    """
+    try:
+        clusters, next_cursor = compliance_store.failure_clusters(cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    set_next_cursor(response, next_cursor)
+    return clusters
+
+
+@router.get("/compliance/drift", response_model=list[DriftDetection])
 async def get_configuration_drift(
+    response: Response,
+    minion_id: str | None = None,
+    resource_type: str | None = None,
+    since: datetime | None = None,
+    include_resolved: bool = False,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
     current_user: User = Depends(get_current_active_user),
 ) -> list[DriftDetection]:
-    """Detect configuration drift across minions."""
-    # Mock drift detection
-    return [
-        DriftDetection(
-            minion_id="minion-3",
-            resource_type="package",
-            resource_name="nginx",
-            expected_value="1.18.0",
-            actual_value="not installed",
-            drift_type="missing",
-            detected_at="2024-01-13T05:00:00",
+    """List configuration drift found by the scheduled drift scans.
+
+    Newest first; ``since`` keeps drift first seen at or after it. This never
+    starts a scan - use ``POST /compliance/drift/scan`` for that.
+    """
+    try:
+        drift, next_cursor = drift_store.list_page(
+            minion_id=minion_id,
+            resource_type=resource_type,
+            since=since,
+            include_resolved=include_resolved,
+            cursor=cursor,
+            limit=limit,
         )
-    ]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    set_next_cursor(response, next_cursor)
+    return drift
+
+
+@router.get("/compliance/drift/scan", response_model=DriftScanStatus)
+async def get_drift_scan_status(
+    current_user: User = Depends(get_current_active_user),
+) -> DriftScanStatus:
+    """Get whether a drift scan is running and the outcome of the last one."""
+    return drift_scanner.status()
+
+
+@router.post("/compliance/drift/scan", response_model=DriftScanStatus)
+async def start_drift_scan(
+    current_user: User = Depends(require_role("admin")),
+) -> DriftScanStatus:
+    """Start a fleet-wide drift scan in the background."""
+    if not drift_scanner.start_scan():
+        raise HTTPException(status_code=409, detail="A drift scan is already running")
+    return drift_scanner.status()
+
+
+@router.post("/compliance/remediate", response_model=RemediationRun)
+async def remediate_fleet(
+    request: RemediationRequest,
+    current_user: User = Depends(require_role("admin")),
+) -> RemediationRun:
+    """Re-apply the failed SLS of non-compliant minions in batched jobs.
+
+    Omit ``minion_ids`` to remediate every non-compliant minion. Poll
+    ``GET /compliance/remediations/{id}`` for progress.
+    """
+    try:
+        return await remediator.start(request.minion_ids, current_user.username)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+@router.get("/compliance/remediations", response_model=list[RemediationRun])
+async def list_remediations(
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_active_user),
+) -> list[RemediationRun]:
+    """List recent remediations, newest first."""
+    return compliance_store.list_remediations(limit)
+
+
+@router.get(
+    "/compliance/remediations/{remediation_id}", response_model=RemediationRun
+)
+async def get_remediation(
+    remediation_id: str,
+    current_user: User = Depends(get_current_active_user),
+) -> RemediationRun:
+    """Get the progress of a remediation."""
+    run = compliance_store.get_remediation(remediation_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Remediation not found")
+    return run
 
 
-@router.post("/remediate/{minion_id}")
+@router.post("/compliance/remediate/{minion_id}")
 async def remediate_compliance(
     minion_id: str,
-    current_user: User = Depends(get_current_active_user),
+    current_user: User = Depends(require_role("admin", "operator")),
 ) -> dict[str, Any]:
     """Auto-remediate compliance issues for a minion."""
-    compliance = mock_compliance_data["minions"].get(minion_id)
+    compliance = compliance_store.get(minion_id)
     if not compliance:
-        from fastapi import HTTPException
-
         raise HTTPException(status_code=404, detail="Minion not found")
 
     if compliance.is_compliant:
         return {"message": "Minion is already compliant", "minion_id": minion_id}
 
-    # In real implementation, this would trigger highstate or specific state fixes
+    try:
+        run = await remediator.start([minion_id], current_user.username)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+    mods = next(iter(plan_remediation([compliance])))
     return {
         "message": "Remediation initiated",
         "minion_id": minion_id,
+        "remediation_id": run.id,
         "failed_states": [fs.state_name for fs in compliance.failed_states],
-        "action": "Running highstate to restore compliance",
+        "action": f"state.apply {','.join(mods)}".strip(),
     }
 
 
 # ===== Notifications Endpoints =====
-# Mock notification storage
-notifications_db: list[Notification] = [
-    Notification(
-        id="1",
-        user="admin",
-        type="job_completed",
-        title="Job Completed",
-        message="Job test.ping on * completed successfully",
-        priority="info",
-        is_read=False,
-        created_at=datetime.now(),
-        data={"job_id": "20240113001", "function": "test.ping"},
-    ),
-    Notification(
-        id="2",
-        user="admin",
-        type="job_failed",
-        title="Job Failed",
-        message="Job state.apply on minion-3 failed",
-        priority="high",
-        is_read=False,
-        created_at=datetime.now(),
-        data={"job_id": "20240113002", "minion": "minion-3"},
-    ),
-]
-
-settings_db: dict[str, NotificationSettings] = {
-    "admin": NotificationSettings(
-        user="admin",
-        email_enabled=True,
-        email_address="admin@example.com",
-        notify_on_job_completion=True,
-        notify_on_job_failure=True,
-        notify_on_minion_down=True,
-        notify_on_compliance_failure=True,
-    )
-}
-
-
-@router.get("", response_model=list[Notification])
+@router.get("/notifications", response_model=list[Notification])
 async def list_notifications(
+    response: Response,
     unread_only: bool = False,
+    cursor: str | None = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
     current_user: User = Depends(get_current_active_user),
 ) -> list[Notification]:
-    """List notifications for current user."""
-    user_notifications = [
-        n for n in notifications_db if n.user == current_user.username
-    ]
-
-    if unread_only:
-        user_notifications = [n for n in user_notifications if not n.is_read]
-
-    # Sort by created_at (newest first)
-    user_notifications.sort(key=lambda x: x.created_at, reverse=True)
-
-    return user_notifications
+    """List notifications for current user (newest first)."""
+    try:
+        notifications, next_cursor = notification_store.list_page(
+            current_user.username, unread_only, cursor, skip, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+    set_next_cursor(response, next_cursor)
+    return notifications
 
 
-@router.post("/mark-read")
+@router.post("/notifications/mark-read")
 async def mark_notifications_read(
     notification_ids: list[str],
     current_user: User = Depends(get_current_active_user),
 ) -> dict[str, str]:
     """Mark notifications as read."""
-    count = 0
-    for notification in notifications_db:
-        if (
-            notification.id in notification_ids
-            and notification.user == current_user.username
-        ):
-            notification.is_read = True
-            count += 1
-
+    count = notification_store.mark_read(current_user.username, notification_ids)
+    notification_hub.publish(current_user.username)
     return {"message": f"Marked {count} notifications as read"}
 
 
-@router.post("/mark-all-read")
+@router.post("/notifications/mark-all-read")
 async def mark_all_notifications_read(
     current_user: User = Depends(get_current_active_user),
 ) -> dict[str, str]:
     """Mark all notifications as read for current user."""
-    count = 0
-    for notification in notifications_db:
-        if notification.user == current_user.username and not notification.is_read:
-            notification.is_read = True
-            count += 1
-
+    count = notification_store.mark_all_read(current_user.username)
+    notification_hub.publish(current_user.username)
     return {"message": f"Marked {count} notifications as read"}
 
 
-@router.delete("/{notification_id}")
+@router.delete("/notifications/{notification_id}")
 async def delete_notification(
     notification_id: str,
     current_user: User = Depends(get_current_active_user),
 ) -> dict[str, str]:
     """Delete a notification."""
-    for i, notification in enumerate(notifications_db):
-        if (
-            notification.id == notification_id
-            and notification.user == current_user.username
-        ):
-            notifications_db.pop(i)
-            return {"message": "Notification deleted"}
-
-    from fastapi import HTTPException
-
-    raise HTTPException(status_code=404, detail="Notification not found")
+    if not notification_store.delete(current_user.username, notification_id):
+        raise HTTPException(status_code=404, detail="Notification not found")
+    notification_hub.publish(current_user.username)
+    return {"message": "Notification deleted"}
 
 
-@router.get("/settings", response_model=NotificationSettings)
+@router.get("/notifications/settings", response_model=NotificationSettings)
 async def get_notification_settings(
     current_user: User = Depends(get_current_active_user),
 ) -> NotificationSettings:
     """Get notification settings for current user."""
-    settings = settings_db.get(current_user.username)
+    settings = notification_store.get_settings(current_user.username)
     if not settings:
         # Create default settings
         settings = NotificationSettings(
@@ -374,30 +637,112 @@ async def get_notification_settings(
             email_enabled=False,
             email_address=current_user.email,
         )
-        settings_db[current_user.username] = settings
+        notification_store.save_settings(settings)
     return settings
 
 
-@router.put("/settings", response_model=NotificationSettings)
+@router.put("/notifications/settings", response_model=NotificationSettings)
 async def update_notification_settings(
     settings_update: NotificationSettings,
     current_user: User = Depends(get_current_active_user),
 ) -> NotificationSettings:
     """Update notification settings for current user."""
     settings_update.user = current_user.username
-    settings_db[current_user.username] = settings_update
+    notification_store.save_settings(settings_update)
     return settings_update
 
 
-@router.get("/unread-count", response_model=dict[str, int])
+@router.get("/notifications/unread-count", response_model=dict[str, int])
 async def get_unread_count(
     current_user: User = Depends(get_current_active_user),
 ) -> dict[str, int]:
     """Get count of unread notifications."""
-    count = sum(
-        1 for n in notifications_db if n.user == current_user.username and not n.is_read
+    return {"count": notification_store.unread_count(current_user.username)}
+
+
+@router.get("/notifications/pipeline", response_model=NotificationPipelineStatus)
+async def get_notification_pipeline_status(
+    current_user: User = Depends(require_role("admin")),
+) -> NotificationPipelineStatus:
+    """Get pending groups, digests and event counters of the notification pipeline."""
+    return notification_pipeline.status()
+
+
+@router.get("/notifications/email/outbox", response_model=MailOutboxStatus)
+async def get_mail_outbox_status(
+    current_user: User = Depends(require_role("admin")),
+) -> MailOutboxStatus:
+    """Get the number of queued, sent and failed notification emails."""
+    return mailer.outbox.status()
+
+
+@router.get("/notifications/stream")
+async def stream_notifications(
+    last_id: int | None = Query(None, ge=0),
+    count_only: bool = False,
+    last_event_id: int | None = Header(None, ge=0),
+    current_user: User = Depends(get_current_active_user),
+) -> StreamingResponse:
+    """Push notifications and unread counts as Server-Sent Events.
+
+    Every new notification is a ``notification`` event whose SSE id is the
+    notification id, followed by a ``count`` event with the unread count; a
+    ``count`` event is also sent when only the count changes. Resumes after
+    ``last_id`` or the ``Last-Event-ID`` header, otherwise starts with the
+    current count. ``count_only`` sends ``count`` events alone.
+    """
+    updates = notification_hub.updates(
+        current_user.username,
+        last_id=last_id if last_id is not None else last_event_id,
+        count_only=count_only,
+        keepalive=settings.notification_keepalive_seconds,
+    )
+
+    async def events() -> AsyncIterator[str]:
+        async for update in updates:
+            yield format_events(update)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    return {"count": count}
+
+
+@router.get("/notifications/poll", response_model=NotificationUpdate)
+async def poll_notifications(
+    last_id: int | None = Query(None, ge=0),
+    unread: int | None = Query(None, ge=0),
+    count_only: bool = False,
+    timeout: float = Query(25.0, ge=0, le=60),
+    current_user: User = Depends(get_current_active_user),
+) -> NotificationUpdate:
+    """Long-poll for notifications newer than ``last_id``.
+
+    Returns as soon as there are newer notifications or the unread count
+    differs from ``unread``, or after ``timeout`` seconds with no
+    notifications. Pass the returned ``last_id`` and ``unread`` to the next
+    poll; the first poll, without them, returns the current state at once.
+    """
+    if last_id is None:
+        # Resolved once, so a timeout cannot skip what is written meanwhile
+        last_id = await asyncio.to_thread(
+            notification_store.last_id, current_user.username
+        )
+    updates = notification_hub.updates(
+        current_user.username,
+        last_id=last_id,
+        unread=unread,
+        count_only=count_only,
+        keepalive=timeout,
+    )
+    try:
+        update = await anext(updates)
+    finally:
+        await updates.aclose()
+    if update is None:
+        return NotificationUpdate(unread=unread or 0, last_id=last_id)
+    return update
 
 
 async def create_notification(
@@ -407,22 +752,13 @@ async def create_notification(
     message: str,
     priority: str = "info",
     data: dict[str, Any] | None = None,
-) -> Notification:
-    """Create a new notification (internal function)."""
-    notification_id = str(len(notifications_db) + 1)
-
-    notification = Notification(
-        id=notification_id,
-        user=user,
-        type=notification_type,
-        title=title,
-        message=message,
-        priority=priority,
-        is_read=False,
-        created_at=datetime.now(),
-        data=data or {},
+    key: str | None = None,
+) -> bool:
+    """Submit a notification through the notification pipeline (internal function).
+
+    ``key`` names what the notification is about (a minion id, a job id) and
+    is used to deduplicate and group it. Returns whether it was accepted.
+    """
+    return await notification_pipeline.notify(
+        user, notification_type, title, message, priority, data, key=key
     )
-
-    notifications_db.append(notification)
-    return notification
-
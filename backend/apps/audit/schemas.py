@@ -30,6 +30,8 @@ class AuditLogCreate(BaseModel):
     details: dict[str, Any] | None = None
     result: str = "success"
     ip_address: str | None = None
+
+
 """Compliance monitoring schemas."""
 
 from pydantic import BaseModel
@@ -42,7 +44,42 @@ class ComplianceStatus(BaseModel):
     compliant_minions: int
     non_compliant_minions: int
     compliance_percentage: float
-    last_check: str
+    last_check: str | None = None
+
+
+class NodegroupCompliance(BaseModel):
+    """Compliance status of one nodegroup."""
+
+    nodegroup: str
+    total_minions: int
+    compliant_minions: int
+    non_compliant_minions: int
+    compliance_percentage: float
+
+
+class ComplianceTrendPoint(BaseModel):
+    """Compliance at one point of the history.
+
+    Downsampled points carry the last counters of their bucket and the lowest
+    and highest percentage seen in it.
+    """
+
+    timestamp: datetime
+    total_minions: int
+    compliant_minions: int
+    compliance_percentage: float
+    low: float
+    high: float
+
+
+class ComplianceTrend(BaseModel):
+    """Compliance history of the fleet or one nodegroup."""
+
+    nodegroup: str | None = None
+    granularity: str  # raw, hour, day
+    since: datetime
+    until: datetime
+    points: list[ComplianceTrendPoint] = []
 
 
 class FailedState(BaseModel):
@@ -54,6 +91,30 @@ class FailedState(BaseModel):
     failed_at: str
 
 
+class MinionFailedState(FailedState):
+    """A failed state of one minion."""
+
+    minion_id: str
+    cluster: str | None = None
+
+
+class FailingState(BaseModel):
+    """A state and how many minions it currently fails on."""
+
+    state_name: str
+    state_id: str
+    minions: int
+
+
+class FailureCluster(BaseModel):
+    """Failures whose reasons differ only in values such as names or paths."""
+
+    cluster: str
+    pattern: str
+    sample: str
+    failures: int
+
+
 class MinionCompliance(BaseModel):
     """Minion compliance status."""
 
@@ -62,6 +123,8 @@ class MinionCompliance(BaseModel):
     failed_states: list[FailedState] = []
     last_highstate: str | None = None
     compliance_score: float = 100.0
+    total_states: int = 0
+    last_jid: str | None = None
 
 
 class DriftDetection(BaseModel):
@@ -74,6 +137,13 @@ class DriftDetection(BaseModel):
     actual_value: str
     drift_type: str  # missing, modified, unexpected
     detected_at: str
+    state_id: str | None = None
+    sls: str | None = None
+    first_seen: str | None = None
+    last_seen: str | None = None
+    resolved_at: str | None = None
+
+
 """Notification schemas."""
 
 from datetime import datetime
@@ -96,6 +166,39 @@ class Notification(BaseModel):
     data: dict[str, Any] = {}
 
 
+class NotificationUpdate(BaseModel):
+    """New notifications and the unread count, pushed to a session."""
+
+    notifications: list[Notification] = []
+    unread: int
+    last_id: int
+
+
+class NotificationPipelineStatus(BaseModel):
+    """Pending state and event counters of the notification pipeline."""
+
+    pending_groups: int
+    pending_events: int
+    dedupe_entries: int
+    digesting_users: int
+    received: int
+    filtered: int
+    deduplicated: int
+    grouped: int
+    written: int
+    digested: int
+
+
+class MailOutboxStatus(BaseModel):
+    """Queued notification emails by delivery status."""
+
+    enabled: bool
+    pending: int
+    sending: int = 0
+    sent: int
+    failed: int
+
+
 class NotificationSettings(BaseModel):
     """Notification settings for a user."""
 
@@ -106,3 +209,114 @@ class NotificationSettings(BaseModel):
     notify_on_job_failure: bool = True
     notify_on_minion_down: bool = True
     notify_on_compliance_failure: bool = True
+
+
+class AuditStatsBucket(BaseModel):
+    """Entry count for one time bucket and group."""
+
+    bucket: datetime
+    action: str | None = None
+    user: str | None = None
+    resource_type: str | None = None
+    result: str | None = None
+    count: int
+
+
+class AuditStats(BaseModel):
+    """Audit entry counts over time from the rollup tables."""
+
+    granularity: str  # minute, hour, day
+    since: datetime
+    until: datetime
+    group_by: list[str] = []
+    total: int
+    buckets: list[AuditStatsBucket] = []
+
+
+class AuditWriterStats(BaseModel):
+    """Audit writer queue and backpressure metrics."""
+
+    durability: str
+    overflow: str
+    queue_capacity: int
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    enqueued: int = 0
+    written: int = 0
+    batches: int = 0
+    last_batch_size: int = 0
+    last_commit_ms: float = 0.0
+    blocked: int = 0  # callers that waited for queue space
+    dropped: int = 0  # entries discarded because the queue was full
+    errors: int = 0
+
+
+class AuditRetentionPolicy(BaseModel):
+    """Retention rule for one class of audit actions."""
+
+    actions: str = "*"  # glob matched against the action
+    max_age_days: int | None = None
+    max_entries: int | None = None
+
+
+class AuditRetentionStatus(BaseModel):
+    """Retention policies and the size of hot and archived audit storage."""
+
+    enabled: bool
+    policies: list[AuditRetentionPolicy] = []
+    hot_entries: int = 0
+    archived_entries: int = 0
+    archive_partitions: int = 0
+    archive_bytes: int = 0
+    last_run: datetime | None = None
+    last_archived: int = 0
+
+
+class AuditRetentionRun(BaseModel):
+    """Result of one retention pass."""
+
+    archived: int
+    ran: bool = True  # False when another worker holds the retention lease
+
+
+class DriftScan(BaseModel):
+    """One fleet-wide drift scan."""
+
+    id: int
+    started_at: str
+    finished_at: str | None = None
+    minions: int = 0
+    batches: int = 0
+    drifted: int = 0  # minions with at least one drifted resource
+    failed_batches: int = 0
+
+
+class DriftScanStatus(BaseModel):
+    """Whether a drift scan is running and how the last one went."""
+
+    running: bool
+    last_scan: DriftScan | None = None
+
+
+class RemediationRequest(BaseModel):
+    """Minions to remediate; all non-compliant minions when omitted."""
+
+    minion_ids: list[str] | None = None
+
+
+class RemediationRun(BaseModel):
+    """Progress and outcome of a remediation."""
+
+    id: str
+    status: str  # running, succeeded, partial, failed, cancelled
+    submitted_by: str | None = None
+    created_at: str
+    finished_at: str | None = None
+    minions: int = 0
+    groups: int = 0  # distinct sets of failed SLS
+    batches: int = 0
+    completed_batches: int = 0
+    remediated: int = 0  # minions compliant after their run
+    still_failing: int = 0
+    job_ids: list[str] = []
+    errors: list[str] = []
@@ -0,0 +1,98 @@
+"""Full-text search over the audit log
+
+An FTS5 index covers each entry's ``action``, ``resource_id`` and flattened
+``details`` (keys and values of the nested JSON). The index is contentless:
+it stores only the inverted index, keyed by the log's ``seq``, and rows are
+read back from ``audit_log``. It is filled in the same transaction that
+appends entries, so search results are never behind the log.
+
+Queries use FTS5 syntax: bare words, ``"exact phrases"``, ``prefix*``,
+``AND``/``OR``/``NOT`` and column filters such as ``action:state``. Terms
+with punctuation, like ``state.apply`` or ``web-01*``, are quoted so they
+match as phrases instead of being a syntax error.
+"""
+
+import json
+import re
+import sqlite3
+from typing import Any
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS audit_fts USING fts5(
+    action, resource_id, details,
+    content='',
+    tokenize="unicode61 remove_diacritics 2"
+);
+"""
+
+
+_OPERATORS = frozenset({"AND", "OR", "NOT"})
+# Bare FTS5 terms, optionally column-qualified and/or prefixed
+_BAREWORD = re.compile(r"^(\w+:)?\(*\w+\*?\)*$")
+_TERM = re.compile(r'"(?:[^"]|"")*"\*?|\S+')
+
+
+def build_match(query: str) -> str:
+    """Quote punctuated terms so ``query`` is a valid FTS5 expression"""
+    terms = []
+    for term in _TERM.findall(query):
+        if term.startswith('"') or term in _OPERATORS or _BAREWORD.match(term):
+            terms.append(term)
+            continue
+        prefix = term.endswith("*")
+        quoted = '"' + term.rstrip("*").replace('"', '""') + '"'
+        terms.append(quoted + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def flatten_details(details: Any) -> str:
+    """Flatten a JSON document into the words it contains"""
+    if isinstance(details, str):
+        try:
+            details = json.loads(details)
+        except ValueError:
+            return details
+    words: list[str] = []
+    stack = [details]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            for key, item in value.items():
+                words.append(str(key))
+                stack.append(item)
+        elif isinstance(value, list):
+            stack.extend(value)
+        elif value is not None:
+            words.append(str(value))
+    return " ".join(words)
+
+
+def register_functions(conn: sqlite3.Connection) -> None:
+    """Make ``audit_flatten(details)`` available to SQL on ``conn``"""
+    conn.create_function("audit_flatten", 1, flatten_details, deterministic=True)
+
+
+def index_entries(conn: sqlite3.Connection, after_seq: int) -> None:
+    """Index every log row with ``seq > after_seq`` (inside the append transaction)"""
+    conn.execute(
+        "INSERT INTO audit_fts (rowid, action, resource_id, details) "
+        "SELECT seq, action, resource_id, audit_flatten(details) FROM audit_log "
+        "WHERE seq > ?",
+        (after_seq,),
+    )
+
+
+def unindex_entries(conn: sqlite3.Connection, where: str, params: Any) -> None:
+    """Remove log rows matching ``where`` from the index before deleting them"""
+    conn.execute(
+        "INSERT INTO audit_fts (audit_fts, rowid, action, resource_id, details) "  # noqa: S608
+        "SELECT 'delete', seq, action, resource_id, audit_flatten(details) "
+        f"FROM audit_log WHERE {where}",
+        params,
+    )
+
+
+def rebuild_index(conn: sqlite3.Connection) -> None:
+    """Rebuild the full-text index from the raw log"""
+    conn.execute("INSERT INTO audit_fts (audit_fts) VALUES ('delete-all')")
+    index_entries(conn, 0)
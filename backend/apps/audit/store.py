@@ -0,0 +1,591 @@
+"""Persistent append-only audit log store
+
+Audit entries live in SQLite (WAL) so they survive restarts and are shared
+by every uvicorn worker. Rows are only ever inserted; an UPDATE trigger
+rejects changes to recorded entries. Filtered newest-first listings are
+served from the (user, ts), (action, ts) and (resource_type, ts) indexes and
+lookups by id from a unique index, so a page costs O(log n + page) however
+large the log grows. Minute/hour/day rollups (see ``apps.audit.rollups``)
+and the full-text index (see ``apps.audit.search``) are maintained in the
+same transactions.
+
+Retention (see ``apps.audit.retention``) moves expired entries into
+compressed day partitions (see ``apps.audit.archive``). Reads pass
+``archived=True`` to page through the archive instead, which decompresses
+whole parts and is therefore slower; lookups by id fall back to the archive
+on their own.
+
+With ``audit_durability = "fsync"`` every commit is fsynced (``synchronous =
+FULL``); ``"normal"`` only syncs the WAL at checkpoints and may lose the last
+commits on power loss, never on a process crash.
+"""
+
+import itertools
+import json
+import sqlite3
+import threading
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from apps.audit.archive import (
+    ARCHIVE_SCHEMA,
+    MANIFEST_COLUMNS,
+    partition_day,
+    read_part,
+    ulid_millis,
+    write_part,
+)
+from apps.audit.rollups import (
+    ROLLUP_SCHEMA,
+    apply_rollups,
+    distinct_actions,
+    prune_rollups,
+    query_rollups,
+    rebuild_rollups,
+    rollup_counts,
+)
+from apps.audit.schemas import AuditLog
+from apps.audit.search import (
+    FTS_SCHEMA,
+    build_match,
+    index_entries,
+    rebuild_index,
+    register_functions,
+    unindex_entries,
+)
+from config.database import (
+    LEASE_SCHEMA,
+    acquire_lease,
+    connect,
+    database_path,
+    release_lease,
+    transaction,
+)
+from config.pagination import decode_cursor, encode_cursor
+from config.settings import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    action TEXT NOT NULL,
+    resource_type TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    details TEXT NOT NULL DEFAULT '{}',
+    result TEXT NOT NULL,
+    ip_address TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_audit_id ON audit_log (id);
+CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_log (ts);
+CREATE INDEX IF NOT EXISTS idx_audit_user_ts ON audit_log (user, ts);
+CREATE INDEX IF NOT EXISTS idx_audit_action_ts ON audit_log (action, ts);
+CREATE INDEX IF NOT EXISTS idx_audit_resource_ts ON audit_log (resource_type, ts);
+CREATE TRIGGER IF NOT EXISTS audit_log_append_only
+BEFORE UPDATE ON audit_log
+BEGIN
+    SELECT RAISE(ABORT, 'audit log entries are immutable');
+END;
+"""
+
+_INSERT_COLUMNS = (
+    "id, ts, user, action, resource_type, resource_id, details, result, ip_address"
+)
+_COLUMNS = f"seq, {_INSERT_COLUMNS}"
+
+# Filters that have a (column, ts) index
+_INDEXED_FILTERS = ("user", "action", "resource_type")
+
+_LEASE_NAME = "audit-retention"
+
+# How far an entry's timestamp may be from the time in its ULID
+_ULID_SKEW_MICROS = 60_000_000
+
+
+def to_micros(timestamp: datetime) -> int:
+    """Convert a datetime to integer microseconds since the epoch
+
+    Naive datetimes are taken to be local time, as ``datetime.now()`` returns.
+    """
+    delta = timestamp.astimezone(UTC) - datetime(1970, 1, 1, tzinfo=UTC)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def from_micros(value: int) -> datetime:
+    """Convert integer microseconds since the epoch to an aware UTC datetime"""
+    return datetime.fromtimestamp(value // 1_000_000, tz=UTC).replace(
+        microsecond=value % 1_000_000
+    )
+
+
+def _row_to_log(row: Mapping[str, Any]) -> AuditLog:
+    details = row["details"]
+    return AuditLog(
+        id=row["id"],
+        timestamp=from_micros(row["ts"]),
+        user=row["user"],
+        action=row["action"],
+        resource_type=row["resource_type"],
+        resource_id=row["resource_id"],
+        details=json.loads(details) if isinstance(details, str) else details,
+        result=row["result"],
+        ip_address=row["ip_address"],
+    )
+
+
+def _to_row(log: AuditLog) -> tuple[Any, ...]:
+    return (
+        log.id,
+        to_micros(log.timestamp),
+        log.user,
+        log.action,
+        log.resource_type,
+        log.resource_id,
+        json.dumps(log.details, default=str),
+        log.result,
+        log.ip_address,
+    )
+
+
+def _cursor_key(cursor: str) -> tuple[int, int]:
+    """Decode a listing cursor into its ``(ts, seq)`` key"""
+    try:
+        ts, seq = (int(part) for part in decode_cursor(cursor, 2))
+    except TypeError as e:
+        raise ValueError("Invalid cursor") from e
+    return ts, seq
+
+
+class AuditStore:
+    """SQLite-backed append-only audit log"""
+
+    def __init__(
+        self, path: Path | str | None = None, archive_dir: Path | str | None = None
+    ) -> None:
+        self._path = path
+        self._archive_dir = archive_dir
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def archive_dir(self) -> Path:
+        """Directory holding the archive parts, next to the database by default"""
+        if self._archive_dir is None:
+            base = Path(self._path).parent if self._path else Path(settings.data_dir)
+            self._archive_dir = settings.audit_archive_dir or base / "audit-archive"
+        return Path(self._archive_dir)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            conn = connect(self._path or database_path("audit"))
+            if settings.audit_durability == "fsync":
+                conn.execute("PRAGMA synchronous=FULL")
+            register_functions(conn)
+            conn.executescript(
+                _SCHEMA + ROLLUP_SCHEMA + FTS_SCHEMA + ARCHIVE_SCHEMA + LEASE_SCHEMA
+            )
+            with transaction(conn):
+                # Backfill rollups and the search index for a log written
+                # before they existed
+                if conn.execute("SELECT 1 FROM audit_log LIMIT 1").fetchone():
+                    if not conn.execute(
+                        "SELECT 1 FROM audit_rollup LIMIT 1"
+                    ).fetchone():
+                        rebuild_rollups(conn)
+                    if not conn.execute("SELECT 1 FROM audit_fts LIMIT 1").fetchone():
+                        rebuild_index(conn)
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        """Close the underlying connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def append(self, log: AuditLog) -> None:
+        """Record one audit entry"""
+        self.append_many([log])
+
+    def append_many(self, logs: Iterable[AuditLog]) -> int:
+        """Record several audit entries in one transaction
+
+        Entries whose id is already stored are skipped, so retrying a batch
+        after an error never duplicates it or double-counts its rollups.
+        Returns the number of entries written.
+        """
+        rows = {log.id: _to_row(log) for log in logs}
+        with self._lock, transaction(self.conn) as conn:
+            ids = list(rows)
+            for start in range(0, len(ids), 500):
+                chunk = ids[start : start + 500]
+                existing = conn.execute(
+                    "SELECT id FROM audit_log WHERE id IN "  # noqa: S608
+                    f"({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for row in existing:
+                    del rows[row["id"]]
+            last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM audit_log")
+            after_seq = last_seq.fetchone()[0]
+            conn.executemany(
+                f"INSERT INTO audit_log ({_INSERT_COLUMNS}) "  # noqa: S608
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows.values(),
+            )
+            apply_rollups(
+                conn,
+                rollup_counts((r[1], r[3], r[2], r[4], r[7]) for r in rows.values()),
+            )
+            index_entries(conn, after_seq)
+        return len(rows)
+
+    def get(self, log_id: str) -> AuditLog | None:
+        """Get an audit entry by id, from the archive if it has been archived
+
+        Only ULID ids can be found in the archive: the time in the id picks
+        the parts to scan.
+        """
+        row = self.conn.execute(
+            f"SELECT {_COLUMNS} FROM audit_log WHERE id = ?",  # noqa: S608
+            (log_id,),
+        ).fetchone()
+        if row:
+            return _row_to_log(row)
+        millis = ulid_millis(log_id)
+        if millis is None:
+            return None
+        parts = self.conn.execute(
+            "SELECT * FROM audit_archive WHERE min_ts <= ? AND max_ts >= ?",
+            (millis * 1000 + _ULID_SKEW_MICROS, millis * 1000 - _ULID_SKEW_MICROS),
+        ).fetchall()
+        for part in parts:
+            for record in read_part(self.archive_dir, part):
+                if record["id"] == log_id:
+                    return _row_to_log(record)
+        return None
+
+    def list_page(
+        self,
+        user: str | None = None,
+        action: str | None = None,
+        resource_type: str | None = None,
+        cursor: str | None = None,
+        skip: int = 0,
+        limit: int = 100,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        archived: bool = False,
+    ) -> tuple[list[AuditLog], str | None]:
+        """List audit entries newest first, returning the next page's cursor
+
+        With a ``cursor`` the page starts right after the entry it points to
+        (keyset pagination on ``(ts, seq)``), so deep pages cost the same as
+        the first one; ``skip`` is applied on top of it as a fallback.
+        ``since`` is inclusive and ``until`` exclusive. ``archived`` lists
+        archived entries instead of the hot log.
+        Raises ``ValueError`` for a malformed cursor.
+        """
+        filters = {"user": user, "action": action, "resource_type": resource_type}
+        if archived:
+            return self._list_archived(filters, cursor, skip, limit, since, until)
+        where = [f"{column} = ?" for column in _INDEXED_FILTERS if filters[column]]
+        params: list[Any] = [filters[c] for c in _INDEXED_FILTERS if filters[c]]
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(to_micros(since))
+        if until is not None:
+            where.append("ts < ?")
+            params.append(to_micros(until))
+        if cursor:
+            where.append("(ts, seq) < (?, ?)")
+            params.extend(_cursor_key(cursor))
+        sql = f"SELECT {_COLUMNS} FROM audit_log"  # noqa: S608
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        # seq breaks ties between entries recorded in the same microsecond
+        sql += " ORDER BY ts DESC, seq DESC LIMIT ? OFFSET ?"
+        rows = self.conn.execute(sql, (*params, limit, skip)).fetchall()
+        next_cursor = (
+            encode_cursor(rows[-1]["ts"], rows[-1]["seq"])
+            if len(rows) == limit
+            else None
+        )
+        return [_row_to_log(row) for row in rows], next_cursor
+
+    def list_logs(
+        self,
+        user: str | None = None,
+        action: str | None = None,
+        resource_type: str | None = None,
+        skip: int = 0,
+        limit: int = 100,
+    ) -> list[AuditLog]:
+        """List audit entries newest first, optionally filtered"""
+        logs, _ = self.list_page(
+            user=user,
+            action=action,
+            resource_type=resource_type,
+            skip=skip,
+            limit=limit,
+        )
+        return logs
+
+    def iter_batches(
+        self,
+        user: str | None = None,
+        action: str | None = None,
+        resource_type: str | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        batch_size: int = 1000,
+        archived: bool = False,
+    ) -> Iterator[list[AuditLog]]:
+        """Yield every matching entry, newest first, one page at a time
+
+        Each page is a keyset query, so memory stays bounded by
+        ``batch_size`` however many entries match.
+        """
+        cursor: str | None = None
+        while True:
+            logs, cursor = self.list_page(
+                user=user,
+                action=action,
+                resource_type=resource_type,
+                cursor=cursor,
+                limit=batch_size,
+                since=since,
+                until=until,
+                archived=archived,
+            )
+            if logs:
+                yield logs
+            if cursor is None:
+                return
+
+    def search(
+        self,
+        query: str,
+        user: str | None = None,
+        action: str | None = None,
+        resource_type: str | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        cursor: str | None = None,
+        limit: int = 100,
+    ) -> tuple[list[AuditLog], str | None]:
+        """Full-text search, newest first, returning the next page's cursor
+
+        ``query`` uses FTS5 syntax (phrases, ``prefix*``, boolean operators).
+        Raises ``ValueError`` for a malformed query or cursor.
+        """
+        filters = {"user": user, "action": action, "resource_type": resource_type}
+        where = ["audit_fts MATCH ?"]
+        params: list[Any] = [build_match(query)]
+        for column in _INDEXED_FILTERS:
+            if filters[column]:
+                where.append(f"l.{column} = ?")
+                params.append(filters[column])
+        if since is not None:
+            where.append("l.ts >= ?")
+            params.append(to_micros(since))
+        if until is not None:
+            where.append("l.ts < ?")
+            params.append(to_micros(until))
+        if cursor:
+            try:
+                before = int(decode_cursor(cursor, 1)[0])
+            except TypeError as e:
+                raise ValueError("Invalid cursor") from e
+            where.append("audit_fts.rowid < ?")
+            params.append(before)
+        columns = ", ".join(f"l.{c.strip()}" for c in _COLUMNS.split(","))
+        sql = (
+            f"SELECT {columns} FROM audit_fts "  # noqa: S608
+            "JOIN audit_log l ON l.seq = audit_fts.rowid "
+            f"WHERE {' AND '.join(where)} ORDER BY audit_fts.rowid DESC LIMIT ?"
+        )
+        try:
+            rows = self.conn.execute(sql, (*params, limit)).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search query: {e}") from e
+        next_cursor = encode_cursor(rows[-1]["seq"]) if len(rows) == limit else None
+        return [_row_to_log(row) for row in rows], next_cursor
+
+    def list_actions(self) -> list[str]:
+        """List the distinct action types, read from the day rollups"""
+        return distinct_actions(self.conn)
+
+    def stats(
+        self,
+        granularity: str,
+        since: datetime,
+        until: datetime,
+        group_by: list[str],
+        filters: dict[str, str | None],
+        limit: int = 10000,
+    ) -> list[dict[str, Any]]:
+        """Entry counts per time bucket from the rollup tables
+
+        Raises ``ValueError`` for an unknown granularity or dimension.
+        """
+        return query_rollups(
+            self.conn, granularity, since, until, group_by, filters, limit
+        )
+
+    def _list_archived(
+        self,
+        filters: dict[str, str | None],
+        cursor: str | None,
+        skip: int,
+        limit: int,
+        since: datetime | None,
+        until: datetime | None,
+    ) -> tuple[list[AuditLog], str | None]:
+        """Page through archived entries, newest first
+
+        Parts are read one day at a time, newest day first, and reading stops
+        once the page is full, so a page costs a few parts however large the
+        archive is. Cursors have the same ``(ts, seq)`` form as the hot log.
+        """
+        before = _cursor_key(cursor) if cursor else None
+        low = to_micros(since) if since is not None else None
+        high = to_micros(until) if until is not None else None
+        where: list[str] = []
+        params: list[Any] = []
+        if low is not None:
+            where.append("max_ts >= ?")
+            params.append(low)
+        if high is not None:
+            where.append("min_ts < ?")
+            params.append(high)
+        if before is not None:
+            where.append("min_ts <= ?")
+            params.append(before[0])
+        sql = "SELECT * FROM audit_archive"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        parts = self.conn.execute(sql + " ORDER BY day DESC", params).fetchall()
+
+        def matches(record: dict[str, Any]) -> bool:
+            if any(value and record[k] != value for k, value in filters.items()):
+                return False
+            if low is not None and record["ts"] < low:
+                return False
+            if high is not None and record["ts"] >= high:
+                return False
+            return before is None or (record["ts"], record["seq"]) < before
+
+        wanted = skip + limit
+        matched: list[dict[str, Any]] = []
+        for _, day_parts in itertools.groupby(parts, key=lambda part: part["day"]):
+            records = [
+                record
+                for part in day_parts
+                for record in read_part(self.archive_dir, part)
+                if matches(record)
+            ]
+            records.sort(key=lambda record: (record["ts"], record["seq"]), reverse=True)
+            matched.extend(records[: wanted - len(matched)])
+            if len(matched) >= wanted:
+                break
+        page = matched[skip:]
+        next_cursor = (
+            encode_cursor(page[-1]["ts"], page[-1]["seq"])
+            if len(page) == limit
+            else None
+        )
+        return [_row_to_log(record) for record in page], next_cursor
+
+    # ----- Retention -----
+    def retention_cutoff(
+        self, where: str, params: Sequence[Any], keep: int
+    ) -> tuple[int, int] | None:
+        """Key of the newest row matching ``where`` that is not among the ``keep``
+        newest, as ``(ts, seq)``
+        """
+        row = self.conn.execute(
+            f"SELECT ts, seq FROM audit_log WHERE {where} "  # noqa: S608
+            "ORDER BY ts DESC, seq DESC LIMIT 1 OFFSET ?",
+            (*params, keep),
+        ).fetchone()
+        return (row["ts"], row["seq"]) if row else None
+
+    def archive(self, where: str, params: Sequence[Any], part_entries: int) -> int:
+        """Move rows matching ``where`` to the archive, oldest first
+
+        Rows are archived ``part_entries`` at a time, one part per UTC day in
+        each chunk; rollups are kept. Returns the number of entries archived.
+        """
+        archived = 0
+        while True:
+            rows = self.conn.execute(
+                f"SELECT {_COLUMNS} FROM audit_log WHERE {where} "  # noqa: S608
+                "ORDER BY ts, seq LIMIT ?",
+                (*params, part_entries),
+            ).fetchall()
+            if rows:
+                self._archive_rows(rows)
+                archived += len(rows)
+            if len(rows) < part_entries:
+                break
+        if archived:
+            # Hand the WAL's pages back so the hot files shrink, not just free up
+            with self._lock:
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return archived
+
+    def _archive_rows(self, rows: list[sqlite3.Row]) -> None:
+        days: dict[str, list[sqlite3.Row]] = {}
+        for row in rows:
+            days.setdefault(partition_day(row["ts"]), []).append(row)
+        manifests = [write_part(self.archive_dir, part) for part in days.values()]
+        seqs = json.dumps([row["seq"] for row in rows])
+        selected = "seq IN (SELECT value FROM json_each(?))"
+        with self._lock, transaction(self.conn) as conn:
+            conn.executemany(
+                f"INSERT INTO audit_archive ({', '.join(MANIFEST_COLUMNS)}) "  # noqa: S608
+                f"VALUES ({', '.join('?' * len(MANIFEST_COLUMNS))})",
+                [tuple(m[c] for c in MANIFEST_COLUMNS) for m in manifests],
+            )
+            unindex_entries(conn, selected, (seqs,))
+            conn.execute(f"DELETE FROM audit_log WHERE {selected}", (seqs,))  # noqa: S608
+
+    def prune_rollups(self, now: datetime) -> int:
+        """Drop minute and hour rollups past their retention"""
+        with self._lock, transaction(self.conn) as conn:
+            return prune_rollups(conn, now)
+
+    def storage_summary(self) -> dict[str, int]:
+        """Entry counts and archive size for the retention status"""
+        archive = self.conn.execute(
+            "SELECT COUNT(*) AS parts, COALESCE(SUM(entries), 0) AS entries, "
+            "COALESCE(SUM(size), 0) AS size FROM audit_archive"
+        ).fetchone()
+        hot = self.conn.execute("SELECT COUNT(*) FROM audit_log").fetchone()[0]
+        return {
+            "hot_entries": hot,
+            "archived_entries": archive["entries"],
+            "archive_partitions": archive["parts"],
+            "archive_bytes": archive["size"],
+        }
+
+    # ----- Retention lease -----
+    def acquire_lease(self, owner: str, ttl: float, now: datetime) -> bool:
+        """Take or renew the retention lease, returning whether we hold it"""
+        with self._lock:
+            return acquire_lease(self.conn, _LEASE_NAME, owner, ttl, now.timestamp())
+
+    def release_lease(self, owner: str) -> None:
+        """Give up the retention lease"""
+        with self._lock:
+            release_lease(self.conn, _LEASE_NAME, owner)
+
+
+# Global store instance
+audit_store = AuditStore()
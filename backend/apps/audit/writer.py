@@ -0,0 +1,182 @@
+"""Non-blocking batched audit writer
+
+Request handlers hand audit entries to ``audit_writer.record``, which only
+puts them on a bounded in-memory queue. A background task drains the queue
+and group-commits whole batches to the audit store, so the request path never
+waits for the disk. When the queue is full, ``audit_overflow`` decides whether
+callers wait for room (``block``) or the entry is dropped and counted
+(``drop``). If the writer is not running (scripts, tests) entries are written
+synchronously instead.
+
+Entry ids are ULIDs: unique across workers and sortable by creation time.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from apps.audit.schemas import AuditLog, AuditWriterStats
+from apps.audit.store import AuditStore, audit_store
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# How long shutdown waits for queued entries to be committed
+_STOP_TIMEOUT_SECONDS = 30.0
+
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_ulid_lock = threading.Lock()
+_last_ulid = (0, 0)
+
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(_CROCKFORD[index])
+    return "".join(reversed(chars))
+
+
+def generate_ulid() -> str:
+    """Return a monotonic ULID
+
+    Ids generated in the same millisecond increment the random part, so ids
+    from one process always sort in creation order.
+    """
+    global _last_ulid
+    with _ulid_lock:
+        millis = time.time_ns() // 1_000_000
+        last_millis, last_random = _last_ulid
+        if millis <= last_millis:
+            millis, randomness = last_millis, last_random + 1
+        else:
+            randomness = int.from_bytes(os.urandom(10))
+        _last_ulid = (millis, randomness)
+    return _encode(millis, 10) + _encode(randomness, 16)
+
+
+class AuditWriter:
+    """Queue audit entries and group-commit them in the background"""
+
+    def __init__(self, store: AuditStore) -> None:
+        self.store = store
+        self._queue: asyncio.Queue[AuditLog] | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._stats = AuditWriterStats(
+            durability=settings.audit_durability,
+            overflow=settings.audit_overflow,
+            queue_capacity=settings.audit_queue_size,
+        )
+
+    @property
+    def running(self) -> bool:
+        """Whether the background writer is accepting entries"""
+        return self._task is not None and not self._task.done()
+
+    def stats(self) -> AuditWriterStats:
+        """Snapshot of queue depth, throughput and backpressure counters"""
+        depth = self._queue.qsize() if self._queue is not None else 0
+        return self._stats.model_copy(update={"queue_depth": depth})
+
+    async def record(self, log: AuditLog) -> None:
+        """Hand an entry to the writer; only waits when the queue is full"""
+        if not self.running or self._queue is None:
+            self.store.append(log)
+            self._stats.written += 1
+            return
+
+        self._stats.enqueued += 1
+        try:
+            self._queue.put_nowait(log)
+        except asyncio.QueueFull:
+            if settings.audit_overflow == "drop":
+                self._stats.dropped += 1
+                logger.warning("Audit queue full, dropped entry %s", log.id)
+                return
+            self._stats.blocked += 1
+            await self._queue.put(log)
+        self._stats.max_queue_depth = max(
+            self._stats.max_queue_depth, self._queue.qsize()
+        )
+
+    async def _next_batch(self, queue: asyncio.Queue[AuditLog]) -> list[AuditLog]:
+        """Wait for one entry, then gather whatever arrives within the interval"""
+        batch = [await queue.get()]
+        deadline = time.monotonic() + settings.audit_flush_interval_ms / 1000
+        while len(batch) < settings.audit_batch_size:
+            try:
+                batch.append(queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: list[AuditLog]) -> None:
+        """Commit a batch, retrying until it is stored"""
+        delay = 0.1
+        while True:
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.store.append_many, batch)
+            except Exception:
+                self._stats.errors += 1
+                logger.exception("Audit batch of %d entries failed", len(batch))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+                continue
+            self._stats.batches += 1
+            self._stats.written += len(batch)
+            self._stats.last_batch_size = len(batch)
+            self._stats.last_commit_ms = (time.perf_counter() - started) * 1000
+            return
+
+    async def _run(self, queue: asyncio.Queue[AuditLog]) -> None:
+        while True:
+            batch = await self._next_batch(queue)
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    def start(self) -> None:
+        """Start the background writer"""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=settings.audit_queue_size)
+            self._task = asyncio.create_task(self._run(self._queue))
+
+    async def flush(self) -> None:
+        """Wait until every queued entry has been committed"""
+        if self.running and self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self) -> None:
+        """Flush queued entries and stop the background writer"""
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self.flush(), _STOP_TIMEOUT_SECONDS)
+            except TimeoutError:
+                logger.error(
+                    "Audit writer stopped with %d entries unwritten",
+                    self._queue.qsize() if self._queue is not None else 0,
+                )
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._queue = None
+
+
+# Global writer instance
+audit_writer = AuditWriter(audit_store)
@@ -0,0 +1,21 @@
+"""Auth app lifecycle - keeps the token revocation filter pruned"""
+
+from faster_app.apps.base import AppLifecycle
+
+from apps.auth.revocation import revocation_list
+
+
+class AuthAppLifecycle(AppLifecycle):
+    """Runs the revocation list's prune loop"""
+
+    @property
+    def app_name(self) -> str:
+        return "auth"
+
+    async def on_startup(self) -> None:
+        """Start pruning expired revocations"""
+        revocation_list.start()
+
+    async def on_shutdown(self) -> None:
+        """Stop the prune loop"""
+        await revocation_list.stop()
@@ -0,0 +1,227 @@
+"""Access token revocation
+
+Every access token carries a random ``jti`` claim. Revoking a token (on
+logout) records its ``jti`` in a persistent denylist (``revocations.db``)
+until the token's own ``exp``; after that the token is rejected anyway, so
+the row is pruned.
+
+Authenticated requests must not pay a database read to learn that their
+token is fine, so each worker keeps a Bloom filter of the revoked ``jti``
+values. A miss - the common case - proves the token is not revoked; a hit is
+confirmed with an exact lookup, so a false positive costs one indexed read
+and never rejects a valid token. A filter only grows, so every
+``token_revocation_prune_seconds`` a background task deletes the expired
+rows and rebuilds the filter from the rest in a worker thread, then swaps
+it in; the request path only ever reads, and builds a filter itself only
+before the first rebuild.
+
+Revocations by other workers reach the filter through ``sync``: at most
+every ``token_revocation_sync_seconds`` it checks ``PRAGMA data_version``
+and, if another connection wrote, adds the rows with a larger id than the
+last one seen. A revoked token may therefore stay usable on other workers
+for up to that interval.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+from config.database import connect, data_version, database_path, transaction
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jti TEXT NOT NULL UNIQUE,
+    expires_at REAL NOT NULL,
+    revoked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expiry ON revoked_tokens (expires_at);
+"""
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, bits: int, hashes: int) -> None:
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+
+    def _positions(self, value: str) -> Iterator[int]:
+        # Double hashing over the halves of the built-in string hash, which
+        # strings cache. It differs between processes, but filters are built
+        # and used within one.
+        h = hash(value) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, value: str) -> None:
+        """Set the bits of ``value``"""
+        for position in self._positions(value):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: str) -> bool:
+        # Inlined _positions: this runs on every authenticated request
+        h = hash(value) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        array, bits = self._array, self.bits
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % bits
+            if not array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class RevocationList:
+    """Persistent denylist of token ids with an in-memory Bloom filter"""
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        # Guards the filter and what it has seen
+        self._filter_lock = threading.Lock()
+        self._filter: BloomFilter | None = None
+        self._last_id = 0
+        self._version: int | None = None
+        self._next_sync = 0.0
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            conn = connect(self._path or database_path("revocations"))
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        """Close the underlying connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _catch_up(self, bloom: BloomFilter, last_id: int) -> int:
+        """Add rows with an id above ``last_id``, returning the last id seen"""
+        rows = self.conn.execute(
+            "SELECT id, jti FROM revoked_tokens WHERE id > ? ORDER BY id", (last_id,)
+        ).fetchall()
+        for row in rows:
+            bloom.add(row["jti"])
+            last_id = row["id"]
+        return last_id
+
+    def _rebuild(self, now: float) -> None:
+        """Load the live rows into a fresh filter and swap it in"""
+        last = self.conn.execute("SELECT MAX(id) AS id FROM revoked_tokens").fetchone()
+        last_id = last["id"] or 0
+        bloom = BloomFilter(
+            settings.token_revocation_filter_bits, settings.token_revocation_hashes
+        )
+        rows = self.conn.execute(
+            "SELECT jti FROM revoked_tokens WHERE expires_at > ? AND id <= ?",
+            (now, last_id),
+        )
+        for row in rows:
+            bloom.add(row["jti"])
+        with self._filter_lock:
+            # Rows revoked while the filter was built
+            self._version = data_version(self.conn)
+            self._last_id = self._catch_up(bloom, last_id)
+            self._filter = bloom
+
+    def sync(self, now: float | None = None, force: bool = False) -> None:
+        """Pick up revocations by other workers
+
+        Does nothing until ``token_revocation_sync_seconds`` have passed since
+        the last sync, unless ``force`` is set.
+        """
+        monotonic = time.monotonic()
+        if not force and monotonic < self._next_sync:
+            return
+        self._next_sync = monotonic + settings.token_revocation_sync_seconds
+        if self._filter is None:
+            self._rebuild(time.time() if now is None else now)
+            return
+        version = data_version(self.conn)
+        if version == self._version:
+            return
+        with self._filter_lock:
+            self._version = version
+            self._last_id = self._catch_up(self._filter, self._last_id)
+
+    def revoke(self, jti: str, expires_at: float, now: float | None = None) -> None:
+        """Deny the token ``jti`` until ``expires_at``"""
+        now = time.time() if now is None else now
+        if expires_at <= now:
+            return
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO revoked_tokens (jti, expires_at, revoked_at) "
+                "VALUES (?, ?, ?)",
+                (jti, expires_at, now),
+            )
+        if self._filter is None:
+            self._rebuild(now)
+            return
+        with self._filter_lock:
+            self._filter.add(jti)
+
+    def is_revoked(self, jti: str, now: float | None = None) -> bool:
+        """Whether the token ``jti`` was revoked and has not expired yet"""
+        self.sync(now)
+        if self._filter is None or jti not in self._filter:
+            return False
+        now = time.time() if now is None else now
+        row = self.conn.execute(
+            "SELECT 1 FROM revoked_tokens WHERE jti = ? AND expires_at > ?",
+            (jti, now),
+        ).fetchone()
+        return row is not None
+
+    def prune(self, now: float | None = None) -> int:
+        """Delete rows of expired tokens and rebuild the filter without them"""
+        now = time.time() if now is None else now
+        with self._lock, transaction(self.conn) as conn:
+            deleted = conn.execute(
+                "DELETE FROM revoked_tokens WHERE expires_at <= ?", (now,)
+            ).rowcount
+        self._rebuild(now)
+        return deleted
+
+    async def run_forever(self) -> None:
+        """Prune and rebuild off the event loop until cancelled"""
+        while True:
+            try:
+                await asyncio.to_thread(self.prune)
+            except Exception:
+                logger.exception("Token revocation prune failed")
+            await asyncio.sleep(settings.token_revocation_prune_seconds)
+
+    def start(self) -> None:
+        """Start pruning in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """Stop pruning"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Global revocation list instance
+revocation_list = RevocationList()
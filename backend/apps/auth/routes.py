@@ -1,4 +1,11 @@
 """Authentication routes for SaltShark"""
+import asyncio
+import functools
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Any
 
@@ -7,6 +14,7 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
+from apps.auth.revocation import revocation_list
 from apps.auth.schemas import Token, User, UserCreate, UserInDB, UserUpdate
 from config.settings import settings
 
@@ -20,6 +28,20 @@ ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# bcrypt takes a few hundred milliseconds per call and releases the GIL, so
+# request handlers hash and verify in this pool instead of on the event loop.
+# Its size caps how many run at once; further logins queue for a thread.
+password_pool = ThreadPoolExecutor(
+    max_workers=settings.password_hash_workers, thread_name_prefix="password"
+)
+
+# Principals resolved from tokens, by SHA-256 of the token: (exp, users
+# version, jti, user). An entry is used until the token expires or any user
+# changes, and the least recently used is dropped past auth_cache_size.
+# Revocation is checked on every use, cached or not.
+_principals: OrderedDict[bytes, tuple[float, int, str | None, User]] = OrderedDict()
+_users_version = 0
+
 # Mock user database (replace with real database)
 fake_users_db: dict[str, UserInDB] = {
     "admin": UserInDB(
@@ -47,6 +69,26 @@ def get_password_hash(password: str) -> str:
     return str(result)
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify password against hash in the password pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        password_pool, verify_password, plain_password, hashed_password
+    )
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash password in the password pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_pool, get_password_hash, password)
+
+
+def users_changed() -> None:
+    """Invalidate cached principals after a user was added, changed or removed."""
+    global _users_version
+    _users_version += 1
+
+
 def get_user(username: str) -> UserInDB | None:
     """Get user from database."""
     return fake_users_db.get(username)
@@ -60,6 +102,14 @@ def authenticate_user(username: str, password: str) -> UserInDB | None:
     return user
 
 
+async def authenticate_user_async(username: str, password: str) -> UserInDB | None:
+    """Authenticate user without blocking the event loop."""
+    user = get_user(username)
+    if not user or not await verify_password_async(password, user.hashed_password):
+        return None
+    return user
+
+
 def create_access_token(data: dict[str, Any], expires_delta: timedelta | None = None) -> str:
     """Create JWT access token."""
     to_encode = data.copy()
@@ -68,17 +118,34 @@ def create_access_token(data: dict[str, Any], expires_delta: timedelta | None =
     else:
         expire = datetime.now(tz=timezone.utc) + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    to_encode.setdefault("jti", uuid.uuid4().hex)
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return str(encoded_jwt)
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
-    """Get current authenticated user."""
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    """Get current authenticated user, from the principal cache when possible."""
+    key = hashlib.sha256(token.encode()).digest()
+    cached = _principals.get(key)
+    if cached is not None:
+        expires, version, jti, principal = cached
+        if version == _users_version and time.time() < expires:
+            if jti is not None and revocation_list.is_revoked(jti):
+                del _principals[key]
+                raise _credentials_exception()
+            _principals.move_to_end(key)
+            return principal
+        del _principals[key]
+
+    credentials_exception = _credentials_exception()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get("sub")
@@ -86,11 +153,23 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
+    jti = payload.get("jti")
+    if not isinstance(jti, str):
+        # Tokens issued before jti was added cannot be revoked
+        jti = None
+    elif revocation_list.is_revoked(jti):
+        raise credentials_exception
+
     user = get_user(username)
     if user is None:
         raise credentials_exception
-    return User.model_validate(user)
+    principal = User.model_validate(user)
+    expires = payload.get("exp")
+    if settings.auth_cache_size > 0 and isinstance(expires, int | float):
+        _principals[key] = (float(expires), _users_version, jti, principal)
+        if len(_principals) > settings.auth_cache_size:
+            _principals.popitem(last=False)
+    return principal
 
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
@@ -100,8 +179,9 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     return current_user
 
 
+@functools.cache
 def require_role(*roles: str):  # type: ignore[no-untyped-def]
-    """Dependency to check user has required role."""
+    """Dependency to check user has required role (one per set of roles)."""
     async def role_checker(current_user: User = Depends(get_current_active_user)) -> User:
         if current_user.role not in roles:
             raise HTTPException(
@@ -115,7 +195,7 @@ def require_role(*roles: str):  # type: ignore[no-untyped-def]
 @router.post("/token", response_model=Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()) -> dict[str, str]:
     """Login endpoint - returns JWT token."""
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user_async(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -132,7 +212,9 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()) -> dict[str, s
 @router.post("/login", response_model=Token)
 async def login_json(credentials: dict[str, str]) -> dict[str, str]:
     """Login with JSON payload."""
-    user = authenticate_user(credentials["username"], credentials["password"])
+    user = await authenticate_user_async(
+        credentials["username"], credentials["password"]
+    )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -169,7 +251,7 @@ async def create_user(
         raise HTTPException(status_code=400, detail="Username already exists")
     
     user_id = str(len(fake_users_db) + 1)
-    hashed_password = get_password_hash(user_create.password)
+    hashed_password = await get_password_hash_async(user_create.password)
     
     user_db = UserInDB(
         id=user_id,
@@ -182,6 +264,7 @@ async def create_user(
         created_at=datetime.now(tz=timezone.utc),
     )
     fake_users_db[user_create.username] = user_db
+    users_changed()
     return User.model_validate(user_db)
 
 
@@ -214,9 +297,10 @@ async def update_user(
     if user_update.is_active is not None:
         user.is_active = user_update.is_active
     if user_update.password:
-        user.hashed_password = get_password_hash(user_update.password)
+        user.hashed_password = await get_password_hash_async(user_update.password)
     
     fake_users_db[username_key] = user
+    users_changed()
     return User.model_validate(user)
 
 
@@ -232,22 +316,32 @@ async def delete_user(
             if user.username == current_user.username:
                 raise HTTPException(status_code=400, detail="Cannot delete yourself")
             del fake_users_db[key]
+            users_changed()
             return {"message": "User deleted successfully"}
     
     raise HTTPException(status_code=404, detail="User not found")
 
 
 @router.post("/logout")
-async def logout(current_user: User = Depends(get_current_active_user)) -> dict[str, str]:
+async def logout(
+    token: str = Depends(oauth2_scheme),
+    current_user: User = Depends(get_current_active_user),
+) -> dict[str, str]:
     """
     Logout endpoint (for compatibility with rest_cherrypy).
-    
-    Note: JWT tokens are stateless, so this endpoint only returns a success message.
-    The client should discard the token. For real token revocation, implement a
-    token blacklist with database.
+
+    Revokes the presented token on every worker until it expires.
     """
+    claims = jwt.get_unverified_claims(token)
+    note = "Token revoked"
+    if isinstance(claims.get("jti"), str) and "exp" in claims:
+        await asyncio.to_thread(
+            revocation_list.revoke, claims["jti"], float(claims["exp"])
+        )
+    else:
+        note = "Token has no jti and cannot be revoked - please discard it"
     return {
         "message": "Logged out successfully",
         "user": current_user.username,
-        "note": "JWT token is stateless - please discard the token on client side"
+        "note": note,
     }
@@ -0,0 +1,100 @@
+"""Minimal cron expression support for the SaltShark scheduler
+
+Supports the classic five fields (minute hour day-of-month month day-of-week)
+with ``*``, lists, ranges and steps, plus the ``@hourly`` style shortcuts.
+All times are handled in UTC.
+"""
+
+from datetime import datetime, timedelta
+
+_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+# (minimum, maximum) for minute, hour, day, month, weekday (7 is Sunday too)
+_BOUNDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+# Never search further ahead than this for a matching time
+_MAX_SEARCH = timedelta(days=366 * 5)
+
+
+def _parse_field(field: str, low: int, high: int) -> set[int]:
+    values: set[int] = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"Invalid step in cron field '{field}'")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_text, end_text = part.split("-", 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"Cron field '{field}' out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """Parsed cron expression that can compute its next fire time"""
+
+    def __init__(self, expression: str) -> None:
+        self.expression = expression
+        text = _ALIASES.get(expression.strip().lower(), expression)
+        fields = text.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: '{expression}'")
+        parsed = [
+            _parse_field(field, low, high)
+            for field, (low, high) in zip(fields, _BOUNDS, strict=True)
+        ]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {day % 7 for day in weekdays}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        # Cron weekday 0 is Sunday, Python's is Monday
+        weekday = (moment.weekday() + 1) % 7
+        day_ok = moment.day in self.days
+        weekday_ok = weekday in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_ok and weekday_ok
+        # When both are restricted cron fires if either matches
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Return the first matching time strictly after ``moment``"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + _MAX_SEARCH
+        while candidate <= limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (candidate.month == 12)
+                month = candidate.month % 12 + 1
+                candidate = candidate.replace(
+                    year=year, month=month, day=1, hour=0, minute=0
+                )
+                continue
+            if not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"Cron expression never fires: '{self.expression}'")
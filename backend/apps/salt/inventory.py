@@ -0,0 +1,381 @@
+"""Fleet-wide schedule and beacon inventory
+
+Minion schedules (``schedule.list``) and beacons (``beacons.list``) are
+collected periodically in batches and normalised into SQLite. Each definition
+is stored once, keyed by a hash of its canonical JSON, and every minion only
+references the hashes it has. Questions like "which minions have schedule X",
+"which minions are missing beacon Y" or "how many variants of schedule Z
+exist" are then index lookups instead of a diff over thousands of dicts.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from collections.abc import Iterable
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from apps.salt.job_engine import run_job
+from apps.salt.salt_api_client import SaltAPIClient, salt_client
+from apps.salt.schemas import InventoryItemSummary, InventoryVariant
+from config.database import (
+    LEASE_SCHEMA,
+    WORKER_ID,
+    acquire_lease,
+    connect,
+    database_path,
+    transaction,
+)
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Inventory kind -> Salt function returning the per-minion definitions
+INVENTORY_FUNCTIONS = {
+    "schedule": "schedule.list",
+    "beacon": "beacons.list",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS definitions (
+    kind TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    definition TEXT NOT NULL,
+    PRIMARY KEY (kind, hash)
+);
+
+CREATE TABLE IF NOT EXISTS minion_items (
+    kind TEXT NOT NULL,
+    minion_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (kind, minion_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_items_name ON minion_items (kind, name, hash);
+
+CREATE TABLE IF NOT EXISTS collections (
+    kind TEXT NOT NULL,
+    minion_id TEXT NOT NULL,
+    collected_at REAL NOT NULL,
+    PRIMARY KEY (kind, minion_id)
+);
+"""
+
+_LEASE_NAME = "inventory"
+
+
+def normalize_definitions(raw: Any) -> dict[str, Any]:
+    """Drop Salt's bookkeeping from a ``schedule.list``/``beacons.list`` return
+
+    Top-level flags such as ``enabled`` and runtime keys starting with ``_``
+    (``_next_fire_time``, ``_seconds``...) would make identical definitions
+    hash differently, so they are removed.
+    """
+    if not isinstance(raw, dict):
+        return {}
+    definitions = raw
+    if len(raw) == 1 and isinstance(raw.get("schedule", raw.get("beacons")), dict):
+        # Some Salt versions wrap the return in {"schedule": ...}/{"beacons": ...}
+        definitions = next(iter(raw.values()))
+    normalized: dict[str, Any] = {}
+    for name, definition in definitions.items():
+        if name.startswith("_") or not isinstance(definition, dict | list):
+            continue
+        if isinstance(definition, dict):
+            definition = {
+                key: value
+                for key, value in definition.items()
+                if not key.startswith("_") and key != "name"
+            }
+        normalized[name] = definition
+    return normalized
+
+
+def definition_hash(definition: Any) -> str:
+    """Stable hash of a definition's canonical JSON"""
+    canonical = json.dumps(definition, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+class InventoryStore:
+    """SQLite store of normalised per-minion schedule and beacon definitions"""
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            conn = connect(self._path or database_path("inventory"))
+            conn.executescript(_SCHEMA + LEASE_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        """Close the underlying connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def record(
+        self,
+        kind: str,
+        snapshots: dict[str, dict[str, Any]],
+        collected_at: datetime,
+    ) -> None:
+        """Replace the stored definitions of every minion in ``snapshots``"""
+        timestamp = collected_at.timestamp()
+        with self._lock, transaction(self.conn) as conn:
+            for minion_id, definitions in snapshots.items():
+                conn.execute(
+                    "DELETE FROM minion_items WHERE kind = ? AND minion_id = ?",
+                    (kind, minion_id),
+                )
+                for name, definition in definitions.items():
+                    digest = definition_hash(definition)
+                    conn.execute(
+                        "INSERT OR IGNORE INTO definitions "
+                        "(kind, hash, name, definition) VALUES (?, ?, ?, ?)",
+                        (kind, digest, name, json.dumps(definition, sort_keys=True)),
+                    )
+                    conn.execute(
+                        "INSERT INTO minion_items (kind, minion_id, name, hash) "
+                        "VALUES (?, ?, ?, ?)",
+                        (kind, minion_id, name, digest),
+                    )
+                conn.execute(
+                    "INSERT INTO collections (kind, minion_id, collected_at) "
+                    "VALUES (?, ?, ?) ON CONFLICT (kind, minion_id) "
+                    "DO UPDATE SET collected_at = excluded.collected_at",
+                    (kind, minion_id, timestamp),
+                )
+
+    def forget_minions(self, kind: str, keep: Iterable[str]) -> int:
+        """Drop minions that are no longer part of the fleet"""
+        keep_ids = list(keep)
+        with self._lock, transaction(self.conn) as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_minions (id TEXT)")
+            conn.execute("DELETE FROM keep_minions")
+            conn.executemany(
+                "INSERT INTO keep_minions (id) VALUES (?)", ((m,) for m in keep_ids)
+            )
+            cursor = conn.execute(
+                "DELETE FROM collections WHERE kind = ? "
+                "AND minion_id NOT IN (SELECT id FROM keep_minions)",
+                (kind,),
+            )
+            conn.execute(
+                "DELETE FROM minion_items WHERE kind = ? "
+                "AND minion_id NOT IN (SELECT id FROM keep_minions)",
+                (kind,),
+            )
+        return cursor.rowcount
+
+    def summary(self, kind: str) -> list[InventoryItemSummary]:
+        """List every definition name with its minion and variant counts"""
+        rows = self.conn.execute(
+            "SELECT name, COUNT(*) AS minions, COUNT(DISTINCT hash) AS variants "
+            "FROM minion_items WHERE kind = ? GROUP BY name ORDER BY name",
+            (kind,),
+        )
+        total = self.minion_count(kind)
+        return [
+            InventoryItemSummary(
+                name=row["name"],
+                minions=row["minions"],
+                missing=total - row["minions"],
+                variants=row["variants"],
+            )
+            for row in rows
+        ]
+
+    def minion_count(self, kind: str) -> int:
+        """Number of minions with a collected inventory"""
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM collections WHERE kind = ?", (kind,)
+        ).fetchone()
+        return int(row[0])
+
+    def minions_with(
+        self,
+        kind: str,
+        name: str,
+        variant: str | None = None,
+        skip: int = 0,
+        limit: int = 100,
+    ) -> list[str]:
+        """Minions that have ``name`` (optionally a specific variant hash)"""
+        if variant is None:
+            rows = self.conn.execute(
+                "SELECT minion_id FROM minion_items WHERE kind = ? AND name = ? "
+                "ORDER BY minion_id LIMIT ? OFFSET ?",
+                (kind, name, limit, skip),
+            )
+        else:
+            rows = self.conn.execute(
+                "SELECT minion_id FROM minion_items "
+                "WHERE kind = ? AND name = ? AND hash = ? "
+                "ORDER BY minion_id LIMIT ? OFFSET ?",
+                (kind, name, variant, limit, skip),
+            )
+        return [row[0] for row in rows]
+
+    def minions_missing(
+        self, kind: str, name: str, skip: int = 0, limit: int = 100
+    ) -> list[str]:
+        """Collected minions that do not have ``name`` at all"""
+        rows = self.conn.execute(
+            "SELECT c.minion_id FROM collections c WHERE c.kind = ? "
+            "AND NOT EXISTS (SELECT 1 FROM minion_items i WHERE i.kind = c.kind "
+            "AND i.minion_id = c.minion_id AND i.name = ?) "
+            "ORDER BY c.minion_id LIMIT ? OFFSET ?",
+            (kind, name, limit, skip),
+        )
+        return [row[0] for row in rows]
+
+    def variants(self, kind: str, name: str) -> list[InventoryVariant]:
+        """Distinct definitions of ``name``, most common first"""
+        rows = self.conn.execute(
+            "SELECT i.hash, COUNT(*) AS minions, d.definition "
+            "FROM minion_items i JOIN definitions d "
+            "ON d.kind = i.kind AND d.hash = i.hash "
+            "WHERE i.kind = ? AND i.name = ? "
+            "GROUP BY i.hash ORDER BY minions DESC, i.hash",
+            (kind, name),
+        )
+        return [
+            InventoryVariant(
+                hash=row["hash"],
+                minions=row["minions"],
+                definition=json.loads(row["definition"]),
+            )
+            for row in rows
+        ]
+
+    def acquire_lease(self, owner: str, ttl: float, now: datetime) -> bool:
+        """Take or renew the collector lease"""
+        with self._lock:
+            return acquire_lease(self.conn, _LEASE_NAME, owner, ttl, now.timestamp())
+
+
+def parse_minion_ids(response: dict[str, Any]) -> list[str]:
+    """Extract accepted minion ids from a wheel ``key.list_all`` return"""
+    for chunk in response.get("return", []):
+        if not isinstance(chunk, dict):
+            continue
+        data = chunk.get("data", {}).get("return", chunk)
+        minions = data.get("minions")
+        if isinstance(minions, list):
+            return sorted(minions)
+    return []
+
+
+class InventoryCollector:
+    """Collects schedules and beacons from the fleet in batches"""
+
+    def __init__(self, store: InventoryStore, client: SaltAPIClient) -> None:
+        self.store = store
+        self.client = client
+        self.owner = f"{WORKER_ID}:{id(self):x}"
+        self._task: asyncio.Task[None] | None = None
+
+    async def _collect_batch(
+        self, kind: str, minion_ids: list[str]
+    ) -> dict[str, dict[str, Any]]:
+        outcome = await run_job(
+            self.client,
+            ",".join(minion_ids),
+            INVENTORY_FUNCTIONS[kind],
+            kwargs={"return_yaml": False},
+            tgt_type="list",
+            timeout=settings.inventory_job_timeout_seconds,
+        )
+        if outcome.running or outcome.lost:
+            logger.warning(
+                "Inventory job %s got no return from %d of %d minions",
+                outcome.jid,
+                len(outcome.running) + len(outcome.lost),
+                len(outcome.minions),
+            )
+        return {
+            minion_id: normalize_definitions(raw)
+            for minion_id, raw in outcome.returns.items()
+        }
+
+    async def collect(
+        self, kinds: Iterable[str] | None = None, minion_ids: list[str] | None = None
+    ) -> dict[str, int]:
+        """Collect inventories, returning the number of minions stored per kind
+
+        Minions that do not answer keep their previous inventory.
+        """
+        if minion_ids is None:
+            minion_ids = parse_minion_ids(await self.client.list_keys())
+        batch_size = settings.inventory_batch_size
+        batches = [
+            minion_ids[i : i + batch_size]
+            for i in range(0, len(minion_ids), batch_size)
+        ]
+        semaphore = asyncio.Semaphore(settings.inventory_concurrency)
+
+        async def collect_batch(kind: str, batch: list[str]) -> int:
+            async with semaphore:
+                try:
+                    snapshots = await self._collect_batch(kind, batch)
+                except Exception:
+                    logger.exception("Inventory batch for %s failed", kind)
+                    return 0
+            await asyncio.to_thread(
+                self.store.record, kind, snapshots, datetime.now(tz=UTC)
+            )
+            return len(snapshots)
+
+        collected: dict[str, int] = {}
+        for kind in kinds or INVENTORY_FUNCTIONS:
+            counts = await asyncio.gather(
+                *(collect_batch(kind, batch) for batch in batches)
+            )
+            collected[kind] = sum(counts)
+            if minion_ids:
+                await asyncio.to_thread(self.store.forget_minions, kind, minion_ids)
+        return collected
+
+    async def run_forever(self) -> None:
+        """Collect on a fixed interval while holding the collector lease"""
+        interval = settings.inventory_interval_seconds
+        while True:
+            try:
+                now = datetime.now(tz=UTC)
+                if self.store.acquire_lease(self.owner, interval * 2, now):
+                    await self.collect()
+            except Exception:
+                logger.exception("Inventory collection failed")
+            await asyncio.sleep(interval)
+
+    def start(self) -> None:
+        """Start periodic collection in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """Stop periodic collection"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Global inventory instances
+inventory_store = InventoryStore()
+inventory_collector = InventoryCollector(inventory_store, salt_client)
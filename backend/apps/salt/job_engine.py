@@ -0,0 +1,455 @@
+"""Job execution engine
+
+Runs Salt jobs through the shared, pooled ``salt_client`` and fans a single
+job out over several targets concurrently, bounded by a concurrency limit.
+Runs are recorded in a ``JobStore`` so they can be listed and cancelled:
+runs waiting on the concurrency limit are ``queued`` and never reach the
+master once cancelled, and published runs get a pre-assigned jid that
+``saltutil.term_job``/``saltutil.kill_job`` can target.
+
+Jobs are published with ``local_async`` and their returns read from the
+master's job cache (``run_job``), so a job outlives the Salt API's HTTP
+timeout. Minions that stop answering ``saltutil.find_job`` without having
+returned are counted as lost, the way the ``salt`` CLI does; a job still
+running after ``job_timeout_seconds`` is left running, not failed.
+
+Settled runs submitted by a user notify them (``job_completed`` or
+``job_failed``) through the notification pipeline, keyed by job, so a batch
+over many targets becomes one grouped notification. Runs started on behalf
+of a schedule or a remediation (``schedule:<name>``, ``remediation:<id>``)
+have no user to notify.
+"""
+
+import asyncio
+import logging
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from typing import Any
+
+from apps.audit.pipeline import NotificationPipeline, notification_pipeline
+from apps.salt.job_store import (
+    CANCELLED,
+    CANCELLING,
+    QUEUED,
+    RUNNING,
+    JobStore,
+    job_store,
+)
+from apps.salt.salt_api_client import SaltAPIClient, salt_client
+from apps.salt.schemas import JobCancelResult, TargetExecutionResult
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_JID_FORMAT = "%Y%m%d%H%M%S%f"
+_jid_lock = threading.Lock()
+_last_jid = ""
+
+
+def generate_jid() -> str:
+    """Return a unique jid in Salt's ``YYYYMMDDhhmmssffffff`` format
+
+    Like the master's, jids are in local time unless ``salt_utc_jid`` is set.
+    """
+    global _last_jid
+    now = datetime.now(tz=UTC)
+    if not settings.salt_utc_jid:
+        now = now.astimezone()
+    with _jid_lock:
+        jid = now.strftime(_JID_FORMAT)
+        if jid <= _last_jid:
+            jid = str(int(_last_jid) + 1)
+        _last_jid = jid
+        return jid
+
+
+def jid_time(jid: str) -> datetime:
+    """Time a Salt jid (``YYYYMMDDhhmmssffffff``) was issued, or now"""
+    try:
+        if settings.salt_utc_jid:
+            return datetime.strptime(jid[:20], _JID_FORMAT).replace(tzinfo=UTC)
+        # A naive datetime is taken as local time
+        return datetime.strptime(jid[:20], _JID_FORMAT).astimezone(UTC)
+    except ValueError:
+        return datetime.now(tz=UTC)
+
+
+def _minion_returns(response: dict[str, Any]) -> dict[str, Any]:
+    """Merge the per-minion return chunks of a ``local`` client response"""
+    returns: dict[str, Any] = {}
+    for chunk in response.get("return", []):
+        if isinstance(chunk, dict):
+            returns.update(chunk)
+    return returns
+
+
+def _job_target(response: dict[str, Any]) -> tuple[str, str]:
+    """Best target to reach the minions of a job looked up on the master"""
+    info = (response.get("info") or [{}])[0]
+    minions = info.get("Minions") or []
+    if minions:
+        return ",".join(sorted(minions)), "list"
+    if info.get("Target"):
+        return str(info["Target"]), info.get("Target-type") or "glob"
+    return "*", "glob"
+
+
+def _state_retcode(ret: Any) -> int:
+    """Retcode of a return the job cache kept without one (2 if a state failed)"""
+    if isinstance(ret, dict) and any(
+        isinstance(entry, dict) and entry.get("result") is False
+        for entry in ret.values()
+    ):
+        return 2
+    return 0
+
+
+def _read_job_cache(
+    response: dict[str, Any], returns: dict[str, Any], retcodes: dict[str, int]
+) -> None:
+    """Add the minion returns of a ``get_job`` response"""
+    info = (response.get("info") or [{}])[0]
+    result = info.get("Result") or _minion_returns(response)
+    for minion_id, data in result.items():
+        if isinstance(data, dict) and "return" in data:
+            ret, retcode = data["return"], data.get("retcode")
+        else:
+            ret, retcode = data, None
+        returns[minion_id] = ret
+        retcodes[minion_id] = (
+            retcode if isinstance(retcode, int) else _state_retcode(ret)
+        )
+
+
+@dataclass
+class JobOutcome:
+    """What a published job returned by the time ``run_job`` stopped waiting"""
+
+    jid: str
+    minions: list[str]
+    returns: dict[str, Any] = field(default_factory=dict)
+    retcodes: dict[str, int] = field(default_factory=dict)
+    # Targeted minions still running the job
+    running: list[str] = field(default_factory=list)
+    # Targeted minions neither running the job nor returning from it
+    lost: list[str] = field(default_factory=list)
+
+
+async def run_job(
+    client: SaltAPIClient,
+    target: str,
+    function: str,
+    args: list[Any] | None = None,
+    kwargs: dict[str, Any] | None = None,
+    tgt_type: str = "glob",
+    jid: str | None = None,
+    timeout: float | None = None,
+    stop: Callable[[], bool] | None = None,
+) -> JobOutcome:
+    """Publish a job and wait for its minions to return
+
+    Polls the job cache, at first quickly and then every
+    ``job_poll_seconds``, and every ``job_find_seconds`` asks the minions
+    still owing a return whether they are running the job. Stops after
+    ``timeout`` (``job_timeout_seconds`` by default) or once ``stop``
+    returns true, with the minions still running in ``running``.
+    """
+    jid = jid or generate_jid()
+    response = await client.publish_job(target, function, args, kwargs, tgt_type, jid)
+    published = next((c for c in response.get("return", []) if isinstance(c, dict)), {})
+    outcome = JobOutcome(
+        jid=str(published.get("jid") or jid),
+        minions=sorted(published.get("minions") or []),
+    )
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (timeout or settings.job_timeout_seconds)
+    next_find = loop.time() + settings.job_find_seconds
+    delay = min(0.25, settings.job_poll_seconds)
+    waiting = set(outcome.minions)
+    while waiting:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, settings.job_poll_seconds)
+        cache = await client.get_job(outcome.jid)
+        _read_job_cache(cache, outcome.returns, outcome.retcodes)
+        waiting -= outcome.returns.keys()
+        now = loop.time()
+        if not waiting or now >= deadline or (stop is not None and stop()):
+            break
+        if now < next_find:
+            continue
+        next_find = now + settings.job_find_seconds
+        found = _minion_returns(
+            await client.find_job(
+                ",".join(sorted(waiting)), outcome.jid, tgt_type="list"
+            )
+        )
+        idle = {m for m in waiting if not found.get(m)}
+        if idle:
+            # They may have returned since the cache was read
+            cache = await client.get_job(outcome.jid)
+            _read_job_cache(cache, outcome.returns, outcome.retcodes)
+            outcome.lost = sorted(set(outcome.lost) | (idle - outcome.returns.keys()))
+            waiting -= idle | outcome.returns.keys()
+    outcome.running = sorted(waiting)
+    return outcome
+
+
+class JobNotFoundError(LookupError):
+    """Raised when a tracked job does not exist"""
+
+
+class JobNotCancellableError(ValueError):
+    """Raised when a job has already finished"""
+
+
+class JobEngine:
+    """Fan jobs out over targets using one shared Salt API client"""
+
+    def __init__(
+        self,
+        client: SaltAPIClient,
+        max_concurrency: int | None = None,
+        store: JobStore | None = None,
+        notifier: NotificationPipeline | None = None,
+    ) -> None:
+        self.client = client
+        self.max_concurrency = max_concurrency or settings.template_max_concurrency
+        self.store = store
+        self.notifier = notifier
+
+    async def _notify(
+        self, result: TargetExecutionResult, function: str, submitted_by: str | None
+    ) -> None:
+        """Tell the user who submitted a run how it ended"""
+        if self.notifier is None or not submitted_by or ":" in submitted_by:
+            return
+        if result.success:
+            notification_type, priority = "job_completed", "info"
+            title = f"{function} completed on {result.target}"
+            message = f"Succeeded on {len(result.minions)} minions"
+        else:
+            notification_type, priority = "job_failed", "high"
+            title = f"{function} failed on {result.target}"
+            failed = sum(1 for retcode in result.retcodes.values() if retcode)
+            message = result.error or (
+                f"Failed on {failed} of {len(result.minions)} minions"
+            )
+        try:
+            await self.notifier.notify(
+                submitted_by,
+                notification_type,
+                title,
+                message,
+                priority,
+                {"job_id": result.job_id, "jid": result.jid, "target": result.target},
+                key=result.job_id or result.jid or result.target,
+            )
+        except Exception:
+            logger.exception("Could not notify %s about %s", submitted_by, title)
+
+    async def run_target(
+        self,
+        target: str,
+        function: str,
+        args: list[Any] | None = None,
+        kwargs: dict[str, Any] | None = None,
+        tgt_type: str = "glob",
+        submitted_by: str | None = None,
+        job_id: str | None = None,
+        timeout: float | None = None,
+    ) -> TargetExecutionResult:
+        """Run a job on one target and summarise its return
+
+        Waits up to ``timeout`` (``job_timeout_seconds`` by default) for the
+        minions to return.
+        """
+        jid = generate_jid()
+        if self.store is not None:
+            if job_id is None:
+                job_id = self.store.enqueue(function, target, tgt_type, submitted_by)
+            if not self.store.start(job_id, jid):
+                return TargetExecutionResult(
+                    target=target,
+                    tgt_type=tgt_type,
+                    job_id=job_id,
+                    success=False,
+                    error="Job was cancelled before it started",
+                )
+
+        def cancelled() -> bool:
+            job = self.store.get(job_id) if self.store and job_id else None
+            return job is not None and job.status == CANCELLED
+
+        try:
+            outcome = await run_job(
+                self.client,
+                target,
+                function,
+                args,
+                kwargs,
+                tgt_type,
+                jid=jid,
+                timeout=timeout,
+                stop=cancelled,
+            )
+        except Exception as e:
+            if self.store is not None and job_id is not None:
+                self.store.finish(job_id, success=False, error=str(e))
+            result = TargetExecutionResult(
+                target=target,
+                tgt_type=tgt_type,
+                job_id=job_id,
+                success=False,
+                error=str(e),
+            )
+            await self._notify(result, function, submitted_by)
+            return result
+
+        minions = dict(outcome.returns)
+        retcodes = dict(outcome.retcodes)
+        for minion_id in outcome.lost:
+            minions[minion_id] = "Minion did not return. [Not running]"
+            retcodes[minion_id] = 1
+        success = bool(minions) and not any(retcodes.values())
+        result = TargetExecutionResult(
+            target=target,
+            tgt_type=tgt_type,
+            job_id=job_id,
+            jid=outcome.jid,
+            success=success and not outcome.running,
+            minions=minions,
+            retcodes=retcodes,
+            running=outcome.running,
+            lost=outcome.lost,
+        )
+        if not outcome.minions:
+            result.error = "No minions matched the target"
+        elif cancelled():
+            result.success, result.error = False, "Job was cancelled"
+            return result
+        elif outcome.running:
+            # Left running in the store, so it can still be cancelled
+            result.error = f"Still running on {len(outcome.running)} minions"
+            return result
+        if self.store is not None and job_id is not None:
+            self.store.finish(job_id, success=result.success, error=result.error)
+        await self._notify(result, function, submitted_by)
+        return result
+
+    async def run_targets(
+        self,
+        targets: list[str],
+        function: str,
+        args: list[Any] | None = None,
+        kwargs: dict[str, Any] | None = None,
+        tgt_type: str = "glob",
+        concurrency: int | None = None,
+        submitted_by: str | None = None,
+    ) -> list[TargetExecutionResult]:
+        """Run a job on every target, at most ``concurrency`` at a time
+
+        Every target is recorded as queued up front, so runs still waiting
+        for a slot can be cancelled. Results are returned in the same order
+        as ``targets``.
+        """
+        limit = min(concurrency or self.max_concurrency, self.max_concurrency)
+        semaphore = asyncio.Semaphore(max(limit, 1))
+        job_ids: list[str | None] = [
+            self.store.enqueue(function, t, tgt_type, submitted_by)
+            if self.store is not None
+            else None
+            for t in targets
+        ]
+
+        async def run_one(target: str, job_id: str | None) -> TargetExecutionResult:
+            async with semaphore:
+                return await self.run_target(
+                    target,
+                    function,
+                    args,
+                    kwargs,
+                    tgt_type,
+                    submitted_by=submitted_by,
+                    job_id=job_id,
+                )
+
+        return list(
+            await asyncio.gather(
+                *(run_one(t, j) for t, j in zip(targets, job_ids, strict=True))
+            )
+        )
+
+    async def cancel(
+        self, job_id: str, signal: str = "term", cancelled_by: str = ""
+    ) -> JobCancelResult:
+        """Cancel a queued job or signal the minions still running it"""
+        if self.store is None:
+            raise JobNotFoundError(job_id)
+        job = self.store.get(job_id)
+        if job is None:
+            raise JobNotFoundError(job_id)
+
+        if job.status == QUEUED and self.store.cancel_queued(job_id, cancelled_by):
+            return JobCancelResult(job=self.store.get(job_id))
+
+        # The job may have been published since we read it
+        job = self.store.get(job_id)
+        if job is None or job.status not in (RUNNING, CANCELLING) or not job.jid:
+            status = job.status if job else "missing"
+            raise JobNotCancellableError(f"Job {job_id} is already {status}")
+
+        self.store.mark_cancelling(job_id, signal, cancelled_by)
+        found = _minion_returns(
+            await self.client.find_job(job.target, job.jid, tgt_type=job.tgt_type)
+        )
+        running = sorted(m for m, data in found.items() if data)
+
+        batch_size = max(settings.job_cancel_batch_size, 1)
+        batches = [
+            running[start : start + batch_size]
+            for start in range(0, len(running), batch_size)
+        ]
+        responses = await asyncio.gather(
+            *(
+                self.client.signal_job(
+                    ",".join(batch), job.jid, signal, tgt_type="list"
+                )
+                for batch in batches
+            )
+        )
+        signalled: list[str] = []
+        for batch, response in zip(batches, responses, strict=True):
+            acked = _minion_returns(response)
+            signalled.extend(m for m in batch if acked.get(m))
+
+        if signalled:
+            self.store.mark_cancelled(job_id, signalled)
+        else:
+            self.store.resume(job_id)
+            if not running:
+                raise JobNotCancellableError(
+                    f"Job {job_id} is not running on any minion"
+                )
+        return JobCancelResult(
+            job=self.store.get(job_id),
+            signalled=signalled,
+            still_running=sorted(set(running) - set(signalled)),
+        )
+
+    async def cancel_jid(
+        self, jid: str, signal: str = "term", cancelled_by: str = ""
+    ) -> JobCancelResult:
+        """Cancel a job by jid, including jobs started outside SaltShark"""
+        if self.store is None:
+            raise JobNotFoundError(jid)
+        job = self.store.get_by_jid(jid)
+        if job is None:
+            target, tgt_type = _job_target(await self.client.get_job(jid))
+            job = self.store.track_external(jid, target, tgt_type)
+        return await self.cancel(job.id, signal, cancelled_by)
+
+
+# Global engine instance
+job_engine = JobEngine(salt_client, store=job_store, notifier=notification_pipeline)
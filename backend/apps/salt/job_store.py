@@ -0,0 +1,252 @@
+"""Persistent store of jobs submitted through SaltShark
+
+Every job the engine runs gets a row here before it is published, so queued
+jobs can be cancelled before they ever reach the master, and running jobs
+carry the jid needed to kill them. State changes are compare-and-set updates,
+which keeps cancellation race-free across uvicorn workers.
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from apps.salt.schemas import TrackedJob
+from config.database import connect, database_path, transaction
+from config.pagination import decode_cursor, encode_cursor
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jid TEXT UNIQUE,
+    function TEXT NOT NULL,
+    target TEXT NOT NULL,
+    tgt_type TEXT NOT NULL DEFAULT 'glob',
+    status TEXT NOT NULL,
+    submitted_by TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    cancel_signal TEXT,
+    cancelled_by TEXT,
+    cancelled_at REAL,
+    cancelled_minions TEXT NOT NULL DEFAULT '[]',
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at, id);
+"""
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLING = "cancelling"
+CANCELLED = "cancelled"
+
+ACTIVE_STATES = (QUEUED, RUNNING, CANCELLING)
+
+
+def _to_datetime(value: float | None) -> datetime | None:
+    return datetime.fromtimestamp(value, tz=UTC) if value is not None else None
+
+
+def _row_to_job(row: sqlite3.Row) -> TrackedJob:
+    return TrackedJob(
+        id=str(row["id"]),
+        jid=row["jid"],
+        function=row["function"],
+        target=row["target"],
+        tgt_type=row["tgt_type"],
+        status=row["status"],
+        submitted_by=row["submitted_by"],
+        created_at=_to_datetime(row["created_at"]),
+        updated_at=_to_datetime(row["updated_at"]),
+        cancel_signal=row["cancel_signal"],
+        cancelled_by=row["cancelled_by"],
+        cancelled_at=_to_datetime(row["cancelled_at"]),
+        cancelled_minions=json.loads(row["cancelled_minions"]),
+        error=row["error"],
+    )
+
+
+def _now() -> float:
+    return datetime.now(tz=UTC).timestamp()
+
+
+class JobStore:
+    """SQLite-backed record of SaltShark-submitted jobs"""
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            conn = connect(self._path or database_path("jobs"))
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        """Close the underlying connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _execute(self, sql: str, params: tuple[Any, ...]) -> sqlite3.Cursor:
+        with self._lock, transaction(self.conn) as conn:
+            return conn.execute(sql, params)
+
+    def enqueue(
+        self,
+        function: str,
+        target: str,
+        tgt_type: str = "glob",
+        submitted_by: str | None = None,
+    ) -> str:
+        """Record a job that is waiting to be published"""
+        now = _now()
+        cursor = self._execute(
+            "INSERT INTO jobs (function, target, tgt_type, status, submitted_by, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (function, target, tgt_type, QUEUED, submitted_by, now, now),
+        )
+        return str(cursor.lastrowid)
+
+    def start(self, job_id: str, jid: str) -> bool:
+        """Move a queued job to running; False if it was cancelled meanwhile"""
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, jid = ?, updated_at = ? "
+            "WHERE id = ? AND status = ?",
+            (RUNNING, jid, _now(), int(job_id), QUEUED),
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, success: bool, error: str | None = None) -> None:
+        """Record the outcome of a job unless it was cancelled
+
+        A job that finishes while a cancellation is being sent counts as
+        finished.
+        """
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+            "WHERE id = ? AND status IN (?, ?)",
+            (
+                SUCCEEDED if success else FAILED,
+                error,
+                _now(),
+                int(job_id),
+                RUNNING,
+                CANCELLING,
+            ),
+        )
+
+    def get(self, job_id: str) -> TrackedJob | None:
+        """Get a job by its SaltShark id"""
+        if not job_id.isdigit():
+            return None
+        row = self.conn.execute(
+            "SELECT * FROM jobs WHERE id = ?", (int(job_id),)
+        ).fetchone()
+        return _row_to_job(row) if row else None
+
+    def get_by_jid(self, jid: str) -> TrackedJob | None:
+        """Get a job by its Salt jid"""
+        row = self.conn.execute("SELECT * FROM jobs WHERE jid = ?", (jid,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def track_external(self, jid: str, target: str, tgt_type: str) -> TrackedJob:
+        """Ensure a row exists for a jid that was not started by SaltShark"""
+        now = _now()
+        self._execute(
+            "INSERT OR IGNORE INTO jobs (jid, function, target, tgt_type, status, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (jid, "unknown", target, tgt_type, RUNNING, now, now),
+        )
+        job = self.get_by_jid(jid)
+        assert job is not None
+        return job
+
+    def cancel_queued(self, job_id: str, cancelled_by: str) -> bool:
+        """Cancel a job that has not been published yet"""
+        now = _now()
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, cancelled_by = ?, cancelled_at = ?, "
+            "updated_at = ? WHERE id = ? AND status = ?",
+            (CANCELLED, cancelled_by, now, now, int(job_id), QUEUED),
+        )
+        return cursor.rowcount == 1
+
+    def mark_cancelling(self, job_id: str, signal: str, cancelled_by: str) -> None:
+        """Record that a kill/term signal is being sent for a running job"""
+        now = _now()
+        self._execute(
+            "UPDATE jobs SET status = ?, cancel_signal = ?, cancelled_by = ?, "
+            "updated_at = ? WHERE id = ? AND status IN (?, ?)",
+            (CANCELLING, signal, cancelled_by, now, int(job_id), RUNNING, CANCELLING),
+        )
+
+    def mark_cancelled(self, job_id: str, minions: list[str]) -> None:
+        """Record the minions a running job was stopped on"""
+        now = _now()
+        self._execute(
+            "UPDATE jobs SET status = ?, cancelled_minions = ?, cancelled_at = ?, "
+            "updated_at = ? WHERE id = ? AND status = ?",
+            (CANCELLED, json.dumps(sorted(minions)), now, now, int(job_id), CANCELLING),
+        )
+
+    def resume(self, job_id: str) -> None:
+        """Undo ``mark_cancelling`` when no minion could be signalled"""
+        self._execute(
+            "UPDATE jobs SET status = ?, cancel_signal = NULL, cancelled_by = NULL, "
+            "updated_at = ? WHERE id = ? AND status = ?",
+            (RUNNING, _now(), int(job_id), CANCELLING),
+        )
+
+    def list_page(
+        self,
+        status: str | None = None,
+        cursor: str | None = None,
+        skip: int = 0,
+        limit: int = 100,
+    ) -> tuple[list[TrackedJob], str | None]:
+        """List jobs newest first, returning the next page's cursor
+
+        Raises ``ValueError`` for a malformed cursor.
+        """
+        where: list[str] = []
+        params: list[Any] = []
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+        if cursor:
+            try:
+                before = int(decode_cursor(cursor, 1)[0])
+            except TypeError as e:
+                raise ValueError("Invalid cursor") from e
+            where.append("id < ?")
+            params.append(before)
+        sql = "SELECT * FROM jobs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ? OFFSET ?"
+        rows = self.conn.execute(sql, (*params, limit, skip)).fetchall()
+        next_cursor = encode_cursor(rows[-1]["id"]) if len(rows) == limit else None
+        return [_row_to_job(row) for row in rows], next_cursor
+
+    def list_jobs(
+        self, status: str | None = None, skip: int = 0, limit: int = 100
+    ) -> list[TrackedJob]:
+        """List jobs newest first"""
+        jobs, _ = self.list_page(status=status, skip=skip, limit=limit)
+        return jobs
+
+
+# Global store instance
+job_store = JobStore()
@@ -0,0 +1,29 @@
+"""Salt app lifecycle - starts and stops background services"""
+
+from faster_app.apps.base import AppLifecycle
+
+from apps.salt.inventory import inventory_collector
+from apps.salt.salt_api_client import salt_client
+from apps.salt.scheduler import scheduler
+from config.settings import settings
+
+
+class SaltAppLifecycle(AppLifecycle):
+    """Runs the scheduler and inventory collector, closes the Salt API client"""
+
+    @property
+    def app_name(self) -> str:
+        return "salt"
+
+    async def on_startup(self) -> None:
+        """Start the central scheduler and inventory collection loops"""
+        if settings.scheduler_enabled:
+            scheduler.start()
+        if settings.inventory_enabled:
+            inventory_collector.start()
+
+    async def on_shutdown(self) -> None:
+        """Stop background services and release the Salt API connection pool"""
+        await inventory_collector.stop()
+        await scheduler.stop()
+        await salt_client.close()
@@ -1,27 +1,60 @@
 """Salt management routes - all endpoints consolidated"""
 
+import heapq
 from datetime import UTC, datetime
 from typing import Any
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 
 from apps.auth.routes import get_current_active_user, require_role
 from apps.auth.schemas import User
+from apps.salt.inventory import inventory_collector, inventory_store
+from apps.salt.job_engine import (
+    JobNotCancellableError,
+    JobNotFoundError,
+    job_engine,
+)
+from apps.salt.job_store import job_store
 from apps.salt.salt_api_client import salt_client
+from apps.salt.scheduler import schedule_store, scheduler, validate_timing
 from apps.salt.schemas import (
+    BeaconConfig,
+    CentralSchedule,
+    CentralScheduleCreate,
+    CentralScheduleUpdate,
+    CloudInstanceRequest,
     GrainsData,
     HighstateRequest,
+    InventoryItemSummary,
+    InventoryMinions,
+    InventoryVariant,
+    JobCancelRequest,
+    JobCancelResult,
     JobExecuteRequest,
     JobList,
     JobResult,
     JobStatus,
+    JobTemplate,
+    JobTemplateCreate,
+    JobTemplateUpdate,
+    MineGetRequest,
+    MineSendRequest,
     MinionDetail,
     MinionList,
     MinionStatus,
+    OrchestrationRequest,
     PillarsData,
+    RunnerRequest,
     ScheduleRequest,
+    ScheduleRun,
+    SSHExecuteRequest,
     StateApplyRequest,
+    TemplateBatchExecuteRequest,
+    TemplateBatchExecuteResponse,
+    TrackedJob,
 )
+from apps.salt.template_store import template_store
+from config.pagination import decode_cursor, encode_cursor, set_next_cursor
 
 router = APIRouter(prefix="/api/v1", tags=["salt"])
 
@@ -75,24 +108,39 @@ async def get_minion(minion_id: str) -> MinionDetail:
 
 # ===== Jobs Endpoints =====
 @router.get("/jobs", response_model=JobList)
-async def list_jobs() -> JobList:
-    """List all jobs"""
+async def list_jobs(
+    cursor: str | None = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+) -> JobList:
+    """List jobs, newest first
+
+    Jids sort by start time, so the page after ``cursor`` holds the newest
+    jids older than it. Only the jobs on the page are materialised.
+    """
+    try:
+        after = decode_cursor(cursor, 1)[0] if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
     try:
         response = await salt_client.list_jobs()
         jobs_data = response.get("return", [{}])[0]
 
+        candidates = (jid for jid in jobs_data if after is None or jid < after)
+        page = heapq.nlargest(skip + limit, candidates)[skip:]
         jobs = [
             JobStatus(
                 jid=jid,
-                function=data.get("function", ""),
-                minions=data.get("minions", []),
-                start_time=data.get("start_time"),
-                status=data.get("status", "unknown"),
+                function=jobs_data[jid].get("function", ""),
+                minions=jobs_data[jid].get("minions", []),
+                start_time=jobs_data[jid].get("start_time"),
+                status=jobs_data[jid].get("status", "unknown"),
             )
-            for jid, data in jobs_data.items()
+            for jid in page
         ]
 
-        return JobList(jobs=jobs, total=len(jobs))
+        next_cursor = encode_cursor(page[-1]) if len(page) == limit else None
+        return JobList(jobs=jobs, total=len(jobs_data), next_cursor=next_cursor)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -141,6 +189,73 @@ async def execute_job(job_request: JobExecuteRequest) -> dict[str, Any]:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/jobs/{jid}/cancel", response_model=JobCancelResult)
+async def cancel_job(
+    jid: str,
+    request: JobCancelRequest | None = None,
+    current_user: User = Depends(require_role("admin", "operator")),
+) -> JobCancelResult:
+    """Terminate or kill a running job by jid."""
+    signal = request.signal if request else "term"
+    try:
+        return await job_engine.cancel_jid(jid, signal, current_user.username)
+    except JobNotCancellableError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+# ===== Tracked Jobs Endpoints =====
+@router.get("/tracked-jobs", response_model=list[TrackedJob])
+async def list_tracked_jobs(
+    response: Response,
+    status: str | None = None,
+    cursor: str | None = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_active_user),
+) -> list[TrackedJob]:
+    """List jobs submitted through SaltShark (newest first)."""
+    try:
+        jobs, next_cursor = job_store.list_page(
+            status=status, cursor=cursor, skip=skip, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    set_next_cursor(response, next_cursor)
+    return jobs
+
+
+@router.get("/tracked-jobs/{job_id}", response_model=TrackedJob)
+async def get_tracked_job(
+    job_id: str,
+    current_user: User = Depends(get_current_active_user),
+) -> TrackedJob:
+    """Get the state of a tracked job."""
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/tracked-jobs/{job_id}/cancel", response_model=JobCancelResult)
+async def cancel_tracked_job(
+    job_id: str,
+    request: JobCancelRequest | None = None,
+    current_user: User = Depends(require_role("admin", "operator")),
+) -> JobCancelResult:
+    """Cancel a queued job, or terminate/kill it if it is already running."""
+    signal = request.signal if request else "term"
+    try:
+        return await job_engine.cancel(job_id, signal, current_user.username)
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail="Job not found") from e
+    except JobNotCancellableError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
 # ===== Grains Endpoints =====
 @router.get("/minions/{minion_id}/grains", response_model=GrainsData)
 async def get_grains(minion_id: str) -> GrainsData:
@@ -714,58 +829,31 @@ async def list_returners() -> dict[str, Any]:
 
 
 # ===== Templates Endpoints =====
-@router.get("", response_model=list[JobTemplate])
+@router.get("/templates", response_model=list[JobTemplate])
 async def list_templates(
     category: str | None = None,
     current_user: User = Depends(get_current_active_user),
 ) -> list[JobTemplate]:
-    """List all job templates."""
-    templates = list(templates_db.values())
-
-    # Filter by category
-    if category:
-        templates = [t for t in templates if t.category == category]
+    """List all job templates visible to the current user."""
+    return template_store.list_visible(current_user.username, category)
 
-    # Filter by visibility (show public + own templates)
-    templates = [
-        t for t in templates if t.is_public or t.created_by == current_user.username
-    ]
-
-    return templates
 
-
-@router.post("", response_model=JobTemplate)
+@router.post("/templates", response_model=JobTemplate)
 async def create_template(
     template: JobTemplateCreate,
     current_user: User = Depends(require_role("admin", "operator")),
 ) -> JobTemplate:
     """Create a new job template."""
-    template_id = str(len(templates_db) + 1)
+    return template_store.create(template, created_by=current_user.username)
 
-    new_template = JobTemplate(
-        id=template_id,
-        name=template.name,
-        description=template.description,
-        target=template.target,
-        function=template.function,
-        args=template.args or [],
-        kwargs=template.kwargs or {},
-        category=template.category,
-        is_public=template.is_public,
-        created_by=current_user.username,
-    )
-
-    templates_db[template_id] = new_template
-    return new_template
 
-
-@router.get("/{template_id}", response_model=JobTemplate)
+@router.get("/templates/{template_id}", response_model=JobTemplate)
 async def get_template(
     template_id: str,
     current_user: User = Depends(get_current_active_user),
 ) -> JobTemplate:
     """Get a specific job template."""
-    template = templates_db.get(template_id)
+    template = template_store.get(template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
 
@@ -776,14 +864,14 @@ async def get_template(
     return template
 
 
-@router.put("/{template_id}", response_model=JobTemplate)
+@router.put("/templates/{template_id}", response_model=JobTemplate)
 async def update_template(
     template_id: str,
     template_update: JobTemplateUpdate,
     current_user: User = Depends(require_role("admin", "operator")),
 ) -> JobTemplate:
     """Update a job template."""
-    template = templates_db.get(template_id)
+    template = template_store.get(template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
 
@@ -791,35 +879,19 @@ async def update_template(
     if template.created_by != current_user.username and current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Access denied")
 
-    # Update fields
-    if template_update.name is not None:
-        template.name = template_update.name
-    if template_update.description is not None:
-        template.description = template_update.description
-    if template_update.target is not None:
-        template.target = template_update.target
-    if template_update.function is not None:
-        template.function = template_update.function
-    if template_update.args is not None:
-        template.args = template_update.args
-    if template_update.kwargs is not None:
-        template.kwargs = template_update.kwargs
-    if template_update.category is not None:
-        template.category = template_update.category
-    if template_update.is_public is not None:
-        template.is_public = template_update.is_public
-
-    templates_db[template_id] = template
-    return template
+    updated = template_store.update(template_id, template_update)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return updated
 
 
-@router.delete("/{template_id}")
+@router.delete("/templates/{template_id}")
 async def delete_template(
     template_id: str,
     current_user: User = Depends(require_role("admin", "operator")),
 ) -> dict[str, str]:
     """Delete a job template."""
-    template = templates_db.get(template_id)
+    template = template_store.get(template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
 
@@ -827,18 +899,13 @@ async def delete_template(
     if template.created_by != current_user.username and current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Access denied")
 
-    del templates_db[template_id]
+    template_store.delete(template_id)
     return {"message": "Template deleted successfully"}
 
 
-@router.post("/{template_id}/execute")
-async def execute_template(
-    template_id: str,
-    overrides: dict[str, Any] | None = None,
-    current_user: User = Depends(require_role("admin", "operator")),
-) -> dict[str, Any]:
-    """Execute a job from template."""
-    template = templates_db.get(template_id)
+def _get_executable_template(template_id: str, current_user: User) -> JobTemplate:
+    """Look up a template the current user is allowed to execute."""
+    template = template_store.get(template_id)
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
 
@@ -846,6 +913,18 @@ async def execute_template(
     if not template.is_public and template.created_by != current_user.username:
         raise HTTPException(status_code=403, detail="Access denied")
 
+    return template
+
+
+@router.post("/templates/{template_id}/execute")
+async def execute_template(
+    template_id: str,
+    overrides: dict[str, Any] | None = None,
+    current_user: User = Depends(require_role("admin", "operator")),
+) -> dict[str, Any]:
+    """Execute a job from template."""
+    template = _get_executable_template(template_id, current_user)
+
     # Prepare job parameters
     target = overrides.get("target", template.target) if overrides else template.target
     function = (
@@ -854,14 +933,16 @@ async def execute_template(
     args = overrides.get("args", template.args) if overrides else template.args
     kwargs = overrides.get("kwargs", template.kwargs) if overrides else template.kwargs
 
-    # Execute via Salt API
-    salt_client = SaltAPIClient()
-    result = await salt_client.execute_job(
-        target=target,
-        function=function,
-        args=args,
-        kwargs=kwargs,
-    )
+    # Execute via the shared Salt API client
+    try:
+        result = await salt_client.execute_job(
+            target=target,
+            function=function,
+            args=args,
+            kwargs=kwargs,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
 
     return {
         "template_id": template_id,
@@ -870,13 +951,251 @@ async def execute_template(
     }
 
 
-@router.get("/categories/list")
+@router.post(
+    "/templates/{template_id}/execute/batch",
+    response_model=TemplateBatchExecuteResponse,
+)
+async def execute_template_batch(
+    template_id: str,
+    request: TemplateBatchExecuteRequest,
+    current_user: User = Depends(require_role("admin", "operator")),
+) -> TemplateBatchExecuteResponse:
+    """Execute a template on several targets or nodegroups concurrently."""
+    template = _get_executable_template(template_id, current_user)
+
+    results = await job_engine.run_targets(
+        targets=request.targets,
+        function=template.function,
+        args=request.args if request.args is not None else template.args,
+        kwargs=request.kwargs if request.kwargs is not None else template.kwargs,
+        tgt_type=request.tgt_type,
+        concurrency=request.concurrency,
+        submitted_by=current_user.username,
+    )
+
+    succeeded = sum(1 for r in results if r.success)
+    return TemplateBatchExecuteResponse(
+        template_id=template_id,
+        template_name=template.name,
+        function=template.function,
+        total_targets=len(results),
+        succeeded=succeeded,
+        failed=len(results) - succeeded,
+        jids={r.target: r.jid for r in results},
+        results=results,
+    )
+
+
+@router.get("/templates/categories/list")
 async def list_categories(
     current_user: User = Depends(get_current_active_user),
 ) -> list[str]:
     """List all template categories."""
-    categories = set()
-    for template in templates_db.values():
-        if template.is_public or template.created_by == current_user.username:
-            categories.add(template.category)
-    return sorted(categories)
+    return template_store.list_categories(current_user.username)
+
+
+# ===== Central Scheduler Endpoints =====
+@router.get("/scheduler/schedules", response_model=list[CentralSchedule])
+async def list_central_schedules(
+    template_id: str | None = None,
+    target: str | None = None,
+    enabled: bool | None = None,
+    current_user: User = Depends(get_current_active_user),
+) -> list[CentralSchedule]:
+    """List central schedules across the whole fleet."""
+    return schedule_store.list_schedules(
+        template_id=template_id, target=target, enabled=enabled
+    )
+
+
+@router.post("/scheduler/schedules", response_model=CentralSchedule)
+async def create_central_schedule(
+    schedule: CentralScheduleCreate,
+    current_user: User = Depends(require_role("admin", "operator")),
+) -> CentralSchedule:
+    """Schedule a job template to run on a cron or interval expression."""
+    try:
+        validate_timing(schedule.cron, schedule.interval_seconds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    _get_executable_template(schedule.template_id, current_user)
+
+    return schedule_store.create(
+        schedule, created_by=current_user.username, now=datetime.now(tz=UTC)
+    )
+
+
+@router.get("/scheduler/schedules/{schedule_id}", response_model=CentralSchedule)
+async def get_central_schedule(
+    schedule_id: str,
+    current_user: User = Depends(get_current_active_user),
+) -> CentralSchedule:
+    """Get a central schedule."""
+    schedule = schedule_store.get(schedule_id)
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    return schedule
+
+
+def _get_owned_schedule(schedule_id: str, current_user: User) -> CentralSchedule:
+    """Look up a schedule the current user is allowed to change."""
+    schedule = schedule_store.get(schedule_id)
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+
+    # Check permissions
+    if schedule.created_by != current_user.username and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    return schedule
+
+
+@router.put("/scheduler/schedules/{schedule_id}", response_model=CentralSchedule)
+async def update_central_schedule(
+    schedule_id: str,
+    schedule_update: CentralScheduleUpdate,
+    current_user: User = Depends(require_role("admin", "operator")),
+) -> CentralSchedule:
+    """Update a central schedule and recompute its next run."""
+    schedule = _get_owned_schedule(schedule_id, current_user)
+    _get_executable_template(schedule.template_id, current_user)
+    if schedule_update.cron is not None and schedule_update.interval_seconds:
+        raise HTTPException(
+            status_code=400,
+            detail="Exactly one of 'cron' or 'interval_seconds' is required",
+        )
+    if schedule_update.cron is not None:
+        try:
+            validate_timing(schedule_update.cron, None)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+
+    updated = schedule_store.update(
+        schedule_id, schedule_update, now=datetime.now(tz=UTC)
+    )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    return updated
+
+
+@router.delete("/scheduler/schedules/{schedule_id}")
+async def delete_central_schedule(
+    schedule_id: str,
+    current_user: User = Depends(require_role("admin", "operator")),
+) -> dict[str, str]:
+    """Delete a central schedule and its run history."""
+    _get_owned_schedule(schedule_id, current_user)
+    if not schedule_store.delete(schedule_id):
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    return {"message": "Schedule deleted successfully"}
+
+
+@router.post("/scheduler/schedules/{schedule_id}/run")
+async def run_central_schedule(
+    schedule_id: str,
+    current_user: User = Depends(require_role("admin", "operator")),
+) -> dict[str, str]:
+    """Run a central schedule immediately, outside its normal timing."""
+    schedule = _get_owned_schedule(schedule_id, current_user)
+    _get_executable_template(schedule.template_id, current_user)
+
+    now = datetime.now(tz=UTC)
+    run_id = scheduler.fire(schedule, now, now)
+    return {"message": "Schedule run started", "run_id": run_id}
+
+
+@router.get("/scheduler/schedules/{schedule_id}/runs", response_model=list[ScheduleRun])
+async def list_central_schedule_runs(
+    schedule_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_active_user),
+) -> list[ScheduleRun]:
+    """List the run history of a central schedule (newest first)."""
+    return schedule_store.list_runs(schedule_id, limit=limit)
+
+
+@router.get("/scheduler/runs", response_model=list[ScheduleRun])
+async def list_scheduler_runs(
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_active_user),
+) -> list[ScheduleRun]:
+    """List recent runs of all central schedules (newest first)."""
+    return schedule_store.list_runs(limit=limit)
+
+
+# ===== Inventory Endpoints =====
+# URL kind -> stored inventory kind
+INVENTORY_KINDS = {"schedules": "schedule", "beacons": "beacon"}
+
+
+def _inventory_kind(kind: str) -> str:
+    """Map ``schedules``/``beacons`` from the URL to the stored kind."""
+    if kind not in INVENTORY_KINDS:
+        raise HTTPException(status_code=404, detail="Unknown inventory kind")
+    return INVENTORY_KINDS[kind]
+
+
+@router.post("/inventory/collect")
+async def collect_inventory(
+    current_user: User = Depends(require_role("admin", "operator")),
+) -> dict[str, Any]:
+    """Collect schedules and beacons from the whole fleet now."""
+    try:
+        collected = await inventory_collector.collect()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+    return {"success": True, "collected": collected}
+
+
+@router.get("/inventory/{kind}", response_model=list[InventoryItemSummary])
+async def list_inventory(
+    kind: str,
+    current_user: User = Depends(get_current_active_user),
+) -> list[InventoryItemSummary]:
+    """Summarise every schedule or beacon name across the fleet."""
+    return inventory_store.summary(_inventory_kind(kind))
+
+
+@router.get("/inventory/{kind}/{name}/minions", response_model=InventoryMinions)
+async def list_inventory_minions(
+    kind: str,
+    name: str,
+    variant: str | None = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_active_user),
+) -> InventoryMinions:
+    """Minions that have a schedule or beacon, optionally one variant of it."""
+    minions = inventory_store.minions_with(
+        _inventory_kind(kind), name, variant=variant, skip=skip, limit=limit
+    )
+    return InventoryMinions(
+        kind=kind, name=name, minions=minions, skip=skip, limit=limit
+    )
+
+
+@router.get("/inventory/{kind}/{name}/missing", response_model=InventoryMinions)
+async def list_inventory_missing(
+    kind: str,
+    name: str,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_active_user),
+) -> InventoryMinions:
+    """Minions that do not have a schedule or beacon at all."""
+    minions = inventory_store.minions_missing(
+        _inventory_kind(kind), name, skip=skip, limit=limit
+    )
+    return InventoryMinions(
+        kind=kind, name=name, minions=minions, skip=skip, limit=limit
+    )
+
+
+@router.get("/inventory/{kind}/{name}/variants", response_model=list[InventoryVariant])
+async def list_inventory_variants(
+    kind: str,
+    name: str,
+    current_user: User = Depends(get_current_active_user),
+) -> list[InventoryVariant]:
+    """Distinct definitions of a schedule or beacon, most common first."""
+    return inventory_store.variants(_inventory_kind(kind), name)
@@ -3,6 +3,7 @@
 This module provides a client for interacting with the SaltStack API.
 """
 
+import asyncio
 from typing import Any
 
 import httpx
@@ -18,7 +19,24 @@ class SaltAPIClient:
         self.username = settings.SALT_API_USER
         self.password = settings.SALT_API_PASSWORD
         self.token: str | None = None
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self.client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(
+                max_connections=settings.salt_api_max_connections,
+                max_keepalive_connections=settings.salt_api_max_connections,
+            ),
+        )
+        self._login_lock = asyncio.Lock()
+
+    async def _ensure_token(self, stale: str | None = None) -> None:
+        """Log in once for all concurrent callers that need a (fresh) token
+
+        ``stale`` is the token that was rejected; if another caller already
+        replaced it while we waited for the lock, no second login is made.
+        """
+        async with self._login_lock:
+            if self.token is None or self.token == stale:
+                await self.login()
 
     async def login(self) -> str:
         """Authenticate with Salt API and get token"""
@@ -40,10 +58,11 @@ class SaltAPIClient:
     ) -> dict[str, Any]:
         """Make authenticated request to Salt API"""
         if not self.token:
-            await self.login()
+            await self._ensure_token()
 
+        token = self.token
         headers: dict[str, Any] = kwargs.pop("headers", {})
-        headers["X-Auth-Token"] = self.token
+        headers["X-Auth-Token"] = token
 
         response = await self.client.request(
             method, f"{self.base_url}{endpoint}", headers=headers, **kwargs
@@ -51,12 +70,12 @@ class SaltAPIClient:
 
         if response.status_code == 401:
             # Token might be expired, retry once
-            await self.login()
+            await self._ensure_token(stale=token)
             headers["X-Auth-Token"] = self.token
             response = await self.client.request(
                 method, f"{self.base_url}{endpoint}", headers=headers, **kwargs
             )
-        
+
         response.raise_for_status()
         return response.json()
         response.raise_for_status()
@@ -91,13 +110,57 @@ class SaltAPIClient:
         function: str,
         args: list[str] | None = None,
         kwargs: dict[str, Any] | None = None,
+        tgt_type: str = "glob",
+        full_return: bool = False,
+        jid: str | None = None,
     ) -> dict[str, Any]:
-        """Execute a job on minions with optional keyword arguments"""
+        """Execute a job on minions with optional keyword arguments
+
+        With ``full_return`` each minion's return is wrapped as
+        ``{"ret": ..., "retcode": ..., "jid": ...}`` so callers get the jid.
+        A pre-generated ``jid`` lets callers reference the job while it runs.
+        """
         payload: dict[str, Any] = {
             "client": "local",
             "tgt": target,
             "fun": function,
         }
+        if tgt_type != "glob":
+            payload["tgt_type"] = tgt_type
+        if full_return:
+            payload["full_return"] = True
+        if jid:
+            payload["jid"] = jid
+        if args:
+            payload["arg"] = args
+        if kwargs:
+            payload["kwarg"] = kwargs
+
+        return await self._request("POST", "/", json=payload)
+
+    async def publish_job(
+        self,
+        target: str,
+        function: str,
+        args: list[Any] | None = None,
+        kwargs: dict[str, Any] | None = None,
+        tgt_type: str = "glob",
+        jid: str | None = None,
+    ) -> dict[str, Any]:
+        """Publish a job without waiting for it (``local_async``)
+
+        Returns ``{"return": [{"jid": ..., "minions": [...]}]}``; results are
+        read from the job cache with ``get_job``.
+        """
+        payload: dict[str, Any] = {
+            "client": "local_async",
+            "tgt": target,
+            "fun": function,
+        }
+        if tgt_type != "glob":
+            payload["tgt_type"] = tgt_type
+        if jid:
+            payload["jid"] = jid
         if args:
             payload["arg"] = args
         if kwargs:
@@ -113,6 +176,22 @@ class SaltAPIClient:
         """Get job details"""
         return await self._request("GET", f"/jobs/{jid}")
 
+    async def signal_job(
+        self, target: str, jid: str, signal: str, tgt_type: str = "glob"
+    ) -> dict[str, Any]:
+        """Send ``saltutil.term_job`` or ``saltutil.kill_job`` for a jid"""
+        return await self.execute_job(
+            target, f"saltutil.{signal}_job", [jid], tgt_type=tgt_type
+        )
+
+    async def find_job(
+        self, target: str, jid: str, tgt_type: str = "glob"
+    ) -> dict[str, Any]:
+        """Ask minions whether they are still running a jid"""
+        return await self.execute_job(
+            target, "saltutil.find_job", [jid], tgt_type=tgt_type
+        )
+
     async def get_grains(self, minion_id: str) -> dict[str, Any]:
         """Get grains for a minion"""
         return await self.execute_command(minion_id, "grains.items")
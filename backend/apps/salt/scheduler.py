@@ -0,0 +1,575 @@
+"""SaltShark-side scheduler for recurring job templates
+
+Schedules are stored centrally in SQLite instead of being pushed to every
+minion with ``schedule.add``, so a fleet-wide view is a local query. Each
+uvicorn worker runs a scheduler loop, but only the holder of a short lease
+fires jobs, and every firing is claimed with a compare-and-set on the
+schedule row so a lease handover can never fire the same run twice.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+from apps.salt.cron import CronExpression
+from apps.salt.job_engine import JobEngine, job_engine
+from apps.salt.schemas import (
+    CentralSchedule,
+    CentralScheduleCreate,
+    CentralScheduleUpdate,
+    ScheduleRun,
+)
+from apps.salt.template_store import TemplateStore, template_store
+from config.database import (
+    LEASE_SCHEMA,
+    WORKER_ID,
+    acquire_lease,
+    connect,
+    database_path,
+    release_lease,
+    transaction,
+)
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS central_schedules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    template_id TEXT NOT NULL,
+    cron TEXT,
+    interval_seconds INTEGER,
+    targets TEXT,
+    tgt_type TEXT NOT NULL DEFAULT 'glob',
+    jitter_seconds INTEGER NOT NULL DEFAULT 0,
+    missed_run_policy TEXT NOT NULL DEFAULT 'run_once',
+    enabled INTEGER NOT NULL DEFAULT 1,
+    created_by TEXT NOT NULL,
+    next_run_at REAL,
+    due_at REAL,
+    last_run_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_schedules_due ON central_schedules (enabled, due_at);
+CREATE INDEX IF NOT EXISTS idx_schedules_template
+    ON central_schedules (template_id);
+
+CREATE TABLE IF NOT EXISTS schedule_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    schedule_id INTEGER NOT NULL,
+    scheduled_for REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    status TEXT NOT NULL,
+    jids TEXT NOT NULL DEFAULT '{}',
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_schedule ON schedule_runs (schedule_id, id);
+"""
+
+_LEASE_NAME = "scheduler"
+
+_UPDATABLE = (
+    "name",
+    "cron",
+    "interval_seconds",
+    "targets",
+    "tgt_type",
+    "jitter_seconds",
+    "missed_run_policy",
+    "enabled",
+)
+
+
+def _to_datetime(value: float | None) -> datetime | None:
+    return datetime.fromtimestamp(value, tz=UTC) if value is not None else None
+
+
+def _row_to_schedule(row: sqlite3.Row) -> CentralSchedule:
+    return CentralSchedule(
+        id=str(row["id"]),
+        name=row["name"],
+        template_id=row["template_id"],
+        cron=row["cron"],
+        interval_seconds=row["interval_seconds"],
+        targets=json.loads(row["targets"]) if row["targets"] else None,
+        tgt_type=row["tgt_type"],
+        jitter_seconds=row["jitter_seconds"],
+        missed_run_policy=row["missed_run_policy"],
+        enabled=bool(row["enabled"]),
+        created_by=row["created_by"],
+        next_run_at=_to_datetime(row["next_run_at"]),
+        last_run_at=_to_datetime(row["last_run_at"]),
+    )
+
+
+def _row_to_run(row: sqlite3.Row) -> ScheduleRun:
+    return ScheduleRun(
+        id=str(row["id"]),
+        schedule_id=str(row["schedule_id"]),
+        scheduled_for=_to_datetime(row["scheduled_for"]),
+        started_at=_to_datetime(row["started_at"]),
+        finished_at=_to_datetime(row["finished_at"]),
+        status=row["status"],
+        jids=json.loads(row["jids"]),
+        error=row["error"],
+    )
+
+
+def validate_timing(cron: str | None, interval_seconds: int | None) -> None:
+    """Check exactly one of ``cron`` and ``interval_seconds`` is usable
+
+    Raises:
+        ValueError: If neither or both are given, or the cron is invalid
+    """
+    if (cron is None) == (interval_seconds is None):
+        raise ValueError("Exactly one of 'cron' or 'interval_seconds' is required")
+    if cron is not None:
+        CronExpression(cron)
+
+
+def next_fire_time(schedule: CentralSchedule, after: datetime) -> datetime:
+    """Return the first fire time of ``schedule`` strictly after ``after``
+
+    Fire times are whole seconds so they compare exactly once stored.
+    """
+    if schedule.cron:
+        return CronExpression(schedule.cron).next_after(after)
+    assert schedule.interval_seconds is not None
+    fire_time = after + timedelta(seconds=schedule.interval_seconds)
+    return fire_time.replace(microsecond=0)
+
+
+def _jittered(schedule: CentralSchedule, fire_time: datetime) -> float:
+    jitter = random.uniform(0, schedule.jitter_seconds)  # noqa: S311
+    return fire_time.timestamp() + jitter
+
+
+class ScheduleStore:
+    """SQLite persistence for central schedules, run history and the lease"""
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            conn = connect(self._path or database_path("scheduler"))
+            conn.executescript(_SCHEMA + LEASE_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        """Close the underlying connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ----- Schedules -----
+    def create(
+        self, schedule: CentralScheduleCreate, created_by: str, now: datetime
+    ) -> CentralSchedule:
+        """Insert a schedule and compute its first fire time"""
+        with self._lock, transaction(self.conn) as conn:
+            cursor = conn.execute(
+                "INSERT INTO central_schedules (name, template_id, cron, "
+                "interval_seconds, targets, tgt_type, jitter_seconds, "
+                "missed_run_policy, enabled, created_by) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    schedule.name,
+                    schedule.template_id,
+                    schedule.cron,
+                    schedule.interval_seconds,
+                    json.dumps(schedule.targets) if schedule.targets else None,
+                    schedule.tgt_type,
+                    schedule.jitter_seconds,
+                    schedule.missed_run_policy,
+                    int(schedule.enabled),
+                    created_by,
+                ),
+            )
+        schedule_id = str(cursor.lastrowid)
+        self.reschedule(schedule_id, now)
+        created = self.get(schedule_id)
+        assert created is not None
+        return created
+
+    def get(self, schedule_id: str) -> CentralSchedule | None:
+        """Get a schedule by id"""
+        if not schedule_id.isdigit():
+            return None
+        row = self.conn.execute(
+            "SELECT * FROM central_schedules WHERE id = ?", (int(schedule_id),)
+        ).fetchone()
+        return _row_to_schedule(row) if row else None
+
+    def list_schedules(
+        self,
+        template_id: str | None = None,
+        target: str | None = None,
+        enabled: bool | None = None,
+    ) -> list[CentralSchedule]:
+        """List schedules, optionally filtered"""
+        clauses: list[str] = []
+        params: list[Any] = []
+        if template_id is not None:
+            clauses.append("template_id = ?")
+            params.append(template_id)
+        if enabled is not None:
+            clauses.append("enabled = ?")
+            params.append(int(enabled))
+        if target is not None:
+            clauses.append("EXISTS (SELECT 1 FROM json_each(targets) WHERE value = ?)")
+            params.append(target)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.conn.execute(
+            f"SELECT * FROM central_schedules {where} ORDER BY id",  # noqa: S608
+            params,
+        )
+        return [_row_to_schedule(row) for row in rows]
+
+    def update(
+        self, schedule_id: str, update: CentralScheduleUpdate, now: datetime
+    ) -> CentralSchedule | None:
+        """Apply the non-null fields of ``update`` and recompute the next run"""
+        changes: dict[str, Any] = {}
+        for field, value in update.model_dump().items():
+            if field not in _UPDATABLE or value is None:
+                continue
+            if field == "targets":
+                value = json.dumps(value)
+            elif field == "enabled":
+                value = int(value)
+            changes[field] = value
+        # Switching between cron and interval clears the other one
+        if "cron" in changes:
+            changes["interval_seconds"] = None
+        elif "interval_seconds" in changes:
+            changes["cron"] = None
+
+        if changes and schedule_id.isdigit():
+            assignments = ", ".join(f"{field} = ?" for field in changes)
+            with self._lock, transaction(self.conn) as conn:
+                conn.execute(
+                    f"UPDATE central_schedules SET {assignments} "  # noqa: S608
+                    "WHERE id = ?",
+                    (*changes.values(), int(schedule_id)),
+                )
+            self.reschedule(schedule_id, now)
+        return self.get(schedule_id)
+
+    def delete(self, schedule_id: str) -> bool:
+        """Delete a schedule and its run history"""
+        if not schedule_id.isdigit():
+            return False
+        with self._lock, transaction(self.conn) as conn:
+            cursor = conn.execute(
+                "DELETE FROM central_schedules WHERE id = ?", (int(schedule_id),)
+            )
+            conn.execute(
+                "DELETE FROM schedule_runs WHERE schedule_id = ?", (int(schedule_id),)
+            )
+        return cursor.rowcount > 0
+
+    def reschedule(self, schedule_id: str, now: datetime) -> None:
+        """Set the next fire time of a schedule from ``now``"""
+        schedule = self.get(schedule_id)
+        if schedule is None:
+            return
+        fire_time = next_fire_time(schedule, now)
+        with self._lock, transaction(self.conn) as conn:
+            conn.execute(
+                "UPDATE central_schedules SET next_run_at = ?, due_at = ? WHERE id = ?",
+                (fire_time.timestamp(), _jittered(schedule, fire_time), schedule_id),
+            )
+
+    def due(self, now: datetime, limit: int = 100) -> list[CentralSchedule]:
+        """Return enabled schedules whose (jittered) fire time has passed"""
+        rows = self.conn.execute(
+            "SELECT * FROM central_schedules WHERE enabled = 1 AND due_at <= ? "
+            "ORDER BY due_at LIMIT ?",
+            (now.timestamp(), limit),
+        )
+        return [_row_to_schedule(row) for row in rows]
+
+    def claim(
+        self, schedule: CentralSchedule, next_run_at: datetime, fired_at: datetime
+    ) -> bool:
+        """Advance a due schedule unless another worker already did
+
+        The update only applies if ``next_run_at`` still holds the value this
+        worker read, so each fire time is claimed exactly once.
+        """
+        assert schedule.next_run_at is not None
+        with self._lock, transaction(self.conn) as conn:
+            cursor = conn.execute(
+                "UPDATE central_schedules "
+                "SET next_run_at = ?, due_at = ?, last_run_at = ? "
+                "WHERE id = ? AND next_run_at = ?",
+                (
+                    next_run_at.timestamp(),
+                    _jittered(schedule, next_run_at),
+                    fired_at.timestamp(),
+                    int(schedule.id),
+                    schedule.next_run_at.timestamp(),
+                ),
+            )
+        return cursor.rowcount == 1
+
+    # ----- Run history -----
+    def add_run(
+        self,
+        schedule_id: str,
+        scheduled_for: datetime,
+        status: str,
+        started_at: datetime | None = None,
+        error: str | None = None,
+    ) -> str:
+        """Record a run and return its id"""
+        finished = None if status == "running" else started_at
+        with self._lock, transaction(self.conn) as conn:
+            cursor = conn.execute(
+                "INSERT INTO schedule_runs (schedule_id, scheduled_for, started_at, "
+                "finished_at, status, error) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    int(schedule_id),
+                    scheduled_for.timestamp(),
+                    started_at.timestamp() if started_at else None,
+                    finished.timestamp() if finished else None,
+                    status,
+                    error,
+                ),
+            )
+        return str(cursor.lastrowid)
+
+    def finish_run(
+        self,
+        run_id: str,
+        status: str,
+        jids: dict[str, str | None],
+        error: str | None = None,
+    ) -> None:
+        """Mark a run as finished"""
+        with self._lock, transaction(self.conn) as conn:
+            conn.execute(
+                "UPDATE schedule_runs SET status = ?, jids = ?, error = ?, "
+                "finished_at = ? WHERE id = ?",
+                (
+                    status,
+                    json.dumps(jids),
+                    error,
+                    datetime.now(tz=UTC).timestamp(),
+                    int(run_id),
+                ),
+            )
+
+    def list_runs(
+        self, schedule_id: str | None = None, limit: int = 100
+    ) -> list[ScheduleRun]:
+        """List runs newest first"""
+        if schedule_id is None:
+            rows = self.conn.execute(
+                "SELECT * FROM schedule_runs ORDER BY id DESC LIMIT ?", (limit,)
+            )
+        else:
+            rows = self.conn.execute(
+                "SELECT * FROM schedule_runs WHERE schedule_id = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (int(schedule_id) if schedule_id.isdigit() else -1, limit),
+            )
+        return [_row_to_run(row) for row in rows]
+
+    # ----- Leader lease -----
+    def acquire_lease(self, owner: str, ttl: float, now: datetime) -> bool:
+        """Take or renew the scheduler lease, returning whether we hold it"""
+        with self._lock:
+            return acquire_lease(self.conn, _LEASE_NAME, owner, ttl, now.timestamp())
+
+    def release_lease(self, owner: str) -> None:
+        """Give up the lease so another worker can take over immediately"""
+        with self._lock:
+            release_lease(self.conn, _LEASE_NAME, owner)
+
+
+class Scheduler:
+    """Fires due central schedules through the job engine"""
+
+    def __init__(
+        self,
+        store: ScheduleStore,
+        templates: TemplateStore,
+        engine: JobEngine,
+    ) -> None:
+        self.store = store
+        self.templates = templates
+        self.engine = engine
+        self.owner = f"{WORKER_ID}:{id(self):x}"
+        self._task: asyncio.Task[None] | None = None
+        self._running: set[asyncio.Task[None]] = set()
+
+    def _fire_times(
+        self, schedule: CentralSchedule, now: datetime
+    ) -> tuple[list[datetime], datetime]:
+        """Return the occurrences due at ``now`` and the next future one
+
+        At most ``scheduler_max_catchup_runs`` occurrences are produced, so a
+        long outage costs the event loop a bounded amount of work.
+        """
+        assert schedule.next_run_at is not None
+        first = schedule.next_run_at
+        limit = settings.scheduler_max_catchup_runs
+        if schedule.interval_seconds:
+            interval = timedelta(seconds=schedule.interval_seconds)
+            missed = (now - first) // interval
+            occurrences = [first + i * interval for i in range(min(missed, limit - 1))]
+            occurrences.append(first + missed * interval)
+            following = first + (missed + 1) * interval
+        else:
+            occurrences = [first]
+            following = next_fire_time(schedule, first)
+            while following <= now:
+                if len(occurrences) == limit:
+                    # Skip the rest of the backlog without walking it
+                    following = next_fire_time(schedule, now)
+                    break
+                occurrences.append(following)
+                following = next_fire_time(schedule, following)
+
+        grace = timedelta(seconds=settings.scheduler_misfire_grace_seconds)
+        if now - occurrences[0] <= grace:
+            # On time: fire the latest occurrence only
+            return occurrences[-1:], following
+        if schedule.missed_run_policy == "skip":
+            return [], following
+        if schedule.missed_run_policy == "run_once":
+            return occurrences[-1:], following
+        return occurrences, following
+
+    async def tick(self, now: datetime | None = None) -> int:
+        """Fire every due schedule if this worker is the leader
+
+        Returns:
+            Number of runs started
+        """
+        now = now or datetime.now(tz=UTC)
+        lease = settings.scheduler_lease_seconds
+        if not self.store.acquire_lease(self.owner, lease, now):
+            return 0
+
+        started = 0
+        for schedule in self.store.due(now):
+            fire_times, following = self._fire_times(schedule, now)
+            if not self.store.claim(schedule, following, now):
+                continue
+            if not fire_times:
+                assert schedule.next_run_at is not None
+                self.store.add_run(
+                    schedule.id,
+                    schedule.next_run_at,
+                    "skipped",
+                    started_at=now,
+                    error="Missed run skipped by policy",
+                )
+                continue
+            for fire_time in fire_times:
+                self.fire(schedule, fire_time, now)
+                started += 1
+        return started
+
+    def fire(
+        self, schedule: CentralSchedule, scheduled_for: datetime, now: datetime
+    ) -> str:
+        """Record a run and execute it in the background"""
+        run_id = self.store.add_run(schedule.id, scheduled_for, "running", now)
+        task = asyncio.create_task(self._execute(schedule, run_id))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        return run_id
+
+    async def _execute(self, schedule: CentralSchedule, run_id: str) -> None:
+        template = self.templates.get(schedule.template_id)
+        if template is None:
+            self.store.finish_run(run_id, "failed", {}, "Template not found")
+            return
+        # The template may have been made private since the schedule was created
+        if not template.is_public and template.created_by != schedule.created_by:
+            self.store.finish_run(run_id, "failed", {}, "Access denied")
+            return
+        try:
+            results = await self.engine.run_targets(
+                targets=schedule.targets or [template.target],
+                function=template.function,
+                args=template.args,
+                kwargs=template.kwargs,
+                tgt_type=schedule.tgt_type,
+                submitted_by=f"schedule:{schedule.name}",
+            )
+        except asyncio.CancelledError:
+            self.store.finish_run(
+                run_id, "interrupted", {}, "Scheduler stopped before the run finished"
+            )
+            raise
+        except Exception as e:
+            logger.exception("Scheduled run %s failed", run_id)
+            self.store.finish_run(run_id, "failed", {}, str(e))
+            return
+
+        errors = [f"{r.target}: {r.error}" for r in results if r.error]
+        status = "succeeded" if all(r.success for r in results) else "failed"
+        self.store.finish_run(
+            run_id,
+            status,
+            {r.target: r.jid for r in results},
+            "; ".join(errors) or None,
+        )
+
+    async def wait_idle(self) -> None:
+        """Wait for all in-flight runs to finish"""
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def run_forever(self) -> None:
+        """Tick until cancelled"""
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Scheduler tick failed")
+            await asyncio.sleep(settings.scheduler_tick_seconds)
+
+    def start(self) -> None:
+        """Start the scheduler loop in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        """Stop the loop, interrupt in-flight runs and release the lease
+
+        Runs are cancelled rather than awaited, as a job can poll for hours.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in self._running:
+            task.cancel()
+        await self.wait_idle()
+        self.store.release_lease(self.owner)
+
+
+# Global scheduler instances
+schedule_store = ScheduleStore()
+scheduler = Scheduler(schedule_store, template_store, job_engine)
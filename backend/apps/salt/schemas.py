@@ -1,6 +1,7 @@
 """All Salt-related schemas consolidated"""
 
-from typing import Any
+from datetime import datetime
+from typing import Any, Literal
 from pydantic import BaseModel, Field
 
 # ===== Minion Schemas =====
@@ -66,6 +67,7 @@ class JobList(BaseModel):
     """List of jobs"""
     jobs: list[JobStatus] = Field(default_factory=list)
     total: int = Field(0)
+    next_cursor: str | None = Field(None, description="Cursor of the next page")
 
 
 class JobExecuteRequest(BaseModel):
@@ -430,3 +432,159 @@ class JobTemplateUpdate(BaseModel):
     kwargs: dict[str, Any] | None = None
     category: str | None = None
     is_public: bool | None = None
+
+
+class TemplateBatchExecuteRequest(BaseModel):
+    """Multi-target template execution request."""
+
+    targets: list[str] = Field(..., min_length=1)
+    tgt_type: str = "glob"  # glob, list, nodegroup, compound, etc.
+    args: list[Any] | None = None
+    kwargs: dict[str, Any] | None = None
+    concurrency: int | None = Field(default=None, ge=1)
+
+
+class TargetExecutionResult(BaseModel):
+    """Result of running a job on one target."""
+
+    target: str
+    tgt_type: str = "glob"
+    job_id: str | None = None
+    jid: str | None = None
+    success: bool
+    minions: dict[str, Any] = {}
+    retcodes: dict[str, int] = {}
+    # Minions still running the job when the engine stopped waiting for it
+    running: list[str] = []
+    # Minions that stopped running the job without returning from it
+    lost: list[str] = []
+    error: str | None = None
+
+
+class TemplateBatchExecuteResponse(BaseModel):
+    """Aggregated result of a multi-target template execution."""
+
+    template_id: str
+    template_name: str
+    function: str
+    total_targets: int
+    succeeded: int
+    failed: int
+    jids: dict[str, str | None]
+    results: list[TargetExecutionResult]
+
+
+# ===== Central Scheduler Schemas =====
+class CentralScheduleCreate(BaseModel):
+    """Recurring job template schedule run by SaltShark itself."""
+
+    name: str
+    template_id: str
+    cron: str | None = None  # five-field cron expression or @hourly style alias
+    interval_seconds: int | None = Field(default=None, ge=1)
+    targets: list[str] | None = None  # defaults to the template target
+    tgt_type: str = "glob"
+    jitter_seconds: int = Field(default=0, ge=0)
+    missed_run_policy: str = Field(
+        default="run_once", pattern="^(skip|run_once|run_all)$"
+    )
+    enabled: bool = True
+
+
+class CentralScheduleUpdate(BaseModel):
+    """Central schedule update request."""
+
+    name: str | None = None
+    cron: str | None = None
+    interval_seconds: int | None = Field(default=None, ge=1)
+    targets: list[str] | None = None
+    tgt_type: str | None = None
+    jitter_seconds: int | None = Field(default=None, ge=0)
+    missed_run_policy: str | None = Field(
+        default=None, pattern="^(skip|run_once|run_all)$"
+    )
+    enabled: bool | None = None
+
+
+class CentralSchedule(CentralScheduleCreate):
+    """Central schedule with its next and last fire times."""
+
+    id: str
+    created_by: str
+    next_run_at: datetime | None = None
+    last_run_at: datetime | None = None
+
+
+class ScheduleRun(BaseModel):
+    """One firing of a central schedule."""
+
+    id: str
+    schedule_id: str
+    scheduled_for: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    status: str  # running, succeeded, failed, skipped, interrupted
+    jids: dict[str, str | None] = {}
+    error: str | None = None
+
+
+# ===== Inventory Schemas =====
+class InventoryItemSummary(BaseModel):
+    """Fleet-wide summary of one schedule or beacon name."""
+
+    name: str
+    minions: int
+    missing: int
+    variants: int
+
+
+class InventoryVariant(BaseModel):
+    """One distinct definition of a schedule or beacon."""
+
+    hash: str
+    minions: int
+    definition: Any
+
+
+class InventoryMinions(BaseModel):
+    """Page of minion ids answering an inventory query."""
+
+    kind: str
+    name: str
+    minions: list[str]
+    skip: int
+    limit: int
+
+
+# ===== Job Tracking Schemas =====
+class TrackedJob(BaseModel):
+    """A job submitted through SaltShark and its lifecycle state."""
+
+    id: str
+    jid: str | None = None
+    function: str
+    target: str
+    tgt_type: str = "glob"
+    status: str  # queued, running, succeeded, failed, cancelling, cancelled
+    submitted_by: str | None = None
+    created_at: datetime
+    updated_at: datetime
+    cancel_signal: str | None = None
+    cancelled_by: str | None = None
+    cancelled_at: datetime | None = None
+    cancelled_minions: list[str] = []
+    error: str | None = None
+
+
+class JobCancelRequest(BaseModel):
+    """How to stop a running job."""
+
+    signal: Literal["term", "kill"] = "term"
+
+
+class JobCancelResult(BaseModel):
+    """Outcome of a cancellation request."""
+
+    job: TrackedJob
+    signalled: list[str] = []
+    still_running: list[str] = []
@@ -0,0 +1,206 @@
+"""Persistent job template store
+
+Templates live in SQLite so they survive restarts and are shared by every
+uvicorn worker on the host. Ids come from an AUTOINCREMENT rowid and are never
+reused after a delete. Lookups by category, owner and visibility are served
+from indexes, and the per-user category lists are cached until any worker
+changes the table.
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from apps.salt.schemas import JobTemplate, JobTemplateCreate, JobTemplateUpdate
+from config.database import connect, data_version, database_path, transaction
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    description TEXT,
+    target TEXT NOT NULL,
+    function TEXT NOT NULL,
+    args TEXT NOT NULL DEFAULT '[]',
+    kwargs TEXT NOT NULL DEFAULT '{}',
+    category TEXT NOT NULL DEFAULT 'general',
+    is_public INTEGER NOT NULL DEFAULT 1,
+    created_by TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_templates_category ON templates (category);
+CREATE INDEX IF NOT EXISTS idx_templates_owner ON templates (created_by, category);
+CREATE INDEX IF NOT EXISTS idx_templates_public ON templates (is_public, category);
+"""
+
+_UPDATABLE = (
+    "name",
+    "description",
+    "target",
+    "function",
+    "args",
+    "kwargs",
+    "category",
+    "is_public",
+)
+
+
+def _row_to_template(row: sqlite3.Row) -> JobTemplate:
+    return JobTemplate(
+        id=str(row["id"]),
+        name=row["name"],
+        description=row["description"],
+        target=row["target"],
+        function=row["function"],
+        args=json.loads(row["args"]),
+        kwargs=json.loads(row["kwargs"]),
+        category=row["category"],
+        is_public=bool(row["is_public"]),
+        created_by=row["created_by"],
+    )
+
+
+def _to_column(field: str, value: Any) -> Any:
+    if field in ("args", "kwargs"):
+        return json.dumps(value)
+    if field == "is_public":
+        return int(value)
+    return value
+
+
+class TemplateStore:
+    """SQLite-backed job template repository"""
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._categories: dict[str, list[str]] = {}
+        self._categories_version: int | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the database on first use"""
+        if self._conn is None:
+            conn = connect(self._path or database_path("templates"))
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        """Close the underlying connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._categories.clear()
+
+    def get(self, template_id: str) -> JobTemplate | None:
+        """Get a template by id"""
+        if not template_id.isdigit():
+            return None
+        row = self.conn.execute(
+            "SELECT * FROM templates WHERE id = ?", (int(template_id),)
+        ).fetchone()
+        return _row_to_template(row) if row else None
+
+    def list_visible(
+        self, username: str, category: str | None = None
+    ) -> list[JobTemplate]:
+        """List public templates plus those owned by ``username``"""
+        if category is None:
+            sql = (
+                "SELECT * FROM templates WHERE is_public = 1 "
+                "UNION SELECT * FROM templates WHERE created_by = ? ORDER BY id"
+            )
+            params: tuple[Any, ...] = (username,)
+        else:
+            sql = (
+                "SELECT * FROM templates WHERE is_public = 1 AND category = ? "
+                "UNION SELECT * FROM templates WHERE created_by = ? AND category = ? "
+                "ORDER BY id"
+            )
+            params = (category, username, category)
+        return [_row_to_template(row) for row in self.conn.execute(sql, params)]
+
+    def list_categories(self, username: str) -> list[str]:
+        """List categories visible to ``username``, cached between writes"""
+        with self._lock:
+            version = data_version(self.conn)
+            if version != self._categories_version:
+                self._categories.clear()
+                self._categories_version = version
+            cached = self._categories.get(username)
+            if cached is not None:
+                return cached
+
+            rows = self.conn.execute(
+                "SELECT DISTINCT category FROM templates WHERE is_public = 1 "
+                "UNION SELECT DISTINCT category FROM templates WHERE created_by = ? "
+                "ORDER BY 1",
+                (username,),
+            )
+            categories = [row[0] for row in rows]
+            self._categories[username] = categories
+            return categories
+
+    def create(self, template: JobTemplateCreate, created_by: str) -> JobTemplate:
+        """Insert a template and return it with its new id"""
+        with self._lock, transaction(self.conn) as conn:
+            cursor = conn.execute(
+                "INSERT INTO templates (name, description, target, function, args, "
+                "kwargs, category, is_public, created_by, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    template.name,
+                    template.description,
+                    template.target,
+                    template.function,
+                    json.dumps(template.args or []),
+                    json.dumps(template.kwargs or {}),
+                    template.category,
+                    int(template.is_public),
+                    created_by,
+                    datetime.now(tz=UTC).isoformat(),
+                ),
+            )
+            self._categories.clear()
+        created = self.get(str(cursor.lastrowid))
+        assert created is not None
+        return created
+
+    def update(
+        self, template_id: str, template_update: JobTemplateUpdate
+    ) -> JobTemplate | None:
+        """Apply the non-null fields of ``template_update``"""
+        changes = {
+            field: _to_column(field, value)
+            for field, value in template_update.model_dump().items()
+            if field in _UPDATABLE and value is not None
+        }
+        if changes and template_id.isdigit():
+            assignments = ", ".join(f"{field} = ?" for field in changes)
+            with self._lock, transaction(self.conn) as conn:
+                conn.execute(
+                    f"UPDATE templates SET {assignments} WHERE id = ?",  # noqa: S608
+                    (*changes.values(), int(template_id)),
+                )
+                self._categories.clear()
+        return self.get(template_id)
+
+    def delete(self, template_id: str) -> bool:
+        """Delete a template, returning whether it existed"""
+        if not template_id.isdigit():
+            return False
+        with self._lock, transaction(self.conn) as conn:
+            cursor = conn.execute(
+                "DELETE FROM templates WHERE id = ?", (int(template_id),)
+            )
+            self._categories.clear()
+        return cursor.rowcount > 0
+
+
+# Global store instance
+template_store = TemplateStore()
@@ -0,0 +1,71 @@
+"""Authenticated requests per second with and without the principal cache
+
+Resolves one bearer token with ``get_current_user`` directly, then runs the
+auth routes in-process and sends ``/me`` and admin-only ``/users`` requests
+with it from concurrent clients. ``--no-cache`` sets ``auth_cache_size`` to 0 so every
+request decodes the token and resolves the user again::
+
+    python -m benchmarks.auth_requests --requests 5000
+    python -m benchmarks.auth_requests --requests 5000 --no-cache
+"""
+
+import argparse
+import asyncio
+import time
+from unittest.mock import patch
+
+import httpx
+from fastapi import FastAPI
+
+from apps.auth.routes import create_access_token, get_current_user, router
+
+app = FastAPI()
+app.include_router(router, prefix="/api/v1/auth")
+
+
+async def run(requests: int, concurrency: int) -> None:
+    token = create_access_token({"sub": "admin"})
+    started = time.perf_counter()
+    for _ in range(requests):
+        await get_current_user(token)
+    elapsed = time.perf_counter() - started
+    print(f"{'get_current_user':<20} {requests / elapsed:8.0f} calls/s")
+
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", headers=headers
+    ) as client:
+
+        async def worker(path: str, count: int) -> None:
+            for _ in range(count):
+                response = await client.get(path)
+                assert response.status_code == 200
+
+        for path in ("/api/v1/auth/me", "/api/v1/auth/users"):
+            started = time.perf_counter()
+            await asyncio.gather(
+                *(worker(path, requests // concurrency) for _ in range(concurrency))
+            )
+            elapsed = time.perf_counter() - started
+            total = requests // concurrency * concurrency
+            print(f"{path:<20} {total / elapsed:8.0f} requests/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--no-cache", action="store_true", help="resolve the token every time"
+    )
+    args = parser.parse_args()
+    if args.no_cache:
+        with patch("apps.auth.routes.settings.auth_cache_size", 0):
+            asyncio.run(run(args.requests, args.concurrency))
+    else:
+        asyncio.run(run(args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
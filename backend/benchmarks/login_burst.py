@@ -0,0 +1,105 @@
+"""Latency of other requests during a login burst
+
+Runs the auth routes in-process and measures ``/health`` round trips, first
+on an idle server and then while a burst of concurrent logins is verified.
+With bcrypt in the password pool the health latency stays flat; ``--inline``
+verifies on the event loop instead, as the login handlers used to::
+
+    python -m benchmarks.login_burst --logins 32
+    python -m benchmarks.login_burst --logins 32 --inline
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from unittest.mock import patch
+
+import httpx
+from fastapi import FastAPI
+
+from apps.auth.routes import router, verify_password
+
+app = FastAPI()
+app.include_router(router, prefix="/api/v1/auth")
+
+
+@app.get("/health")
+async def health() -> dict[str, str]:
+    return {"status": "healthy"}
+
+
+async def _verify_inline(plain_password: str, hashed_password: str) -> bool:
+    return verify_password(plain_password, hashed_password)
+
+
+async def _probe(client: httpx.AsyncClient, until: asyncio.Event) -> list[float]:
+    """Health round trips in milliseconds until ``until`` is set"""
+    latencies = []
+    while not until.is_set():
+        started = time.perf_counter()
+        await client.get("/health")
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.002)
+    return latencies
+
+
+def _summary(name: str, latencies: list[float]) -> str:
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return (
+        f"{name:<12} {len(ordered):>6} probes  p50 {statistics.median(ordered):7.2f} ms"
+        f"  p99 {p99:7.2f} ms  max {ordered[-1]:7.2f} ms"
+    )
+
+
+async def run(logins: int, idle_seconds: float) -> None:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        done = asyncio.Event()
+        probe = asyncio.create_task(_probe(client, done))
+        await asyncio.sleep(idle_seconds)
+        done.set()
+        idle = await probe
+
+        done = asyncio.Event()
+        probe = asyncio.create_task(_probe(client, done))
+        started = time.perf_counter()
+        responses = await asyncio.gather(
+            *(
+                client.post(
+                    "/api/v1/auth/login",
+                    json={"username": "admin", "password": "admin123"},
+                )
+                for _ in range(logins)
+            )
+        )
+        elapsed = time.perf_counter() - started
+        done.set()
+        burst = await probe
+
+    assert all(response.status_code == 200 for response in responses)
+    print(f"{logins} logins in {elapsed:.2f} s ({logins / elapsed:.1f} logins/s)")
+    print(_summary("idle", idle))
+    print(_summary("login burst", burst))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--idle-seconds", type=float, default=1.0)
+    parser.add_argument(
+        "--inline", action="store_true", help="verify on the event loop"
+    )
+    args = parser.parse_args()
+    if args.inline:
+        with patch("apps.auth.routes.verify_password_async", _verify_inline):
+            asyncio.run(run(args.logins, args.idle_seconds))
+    else:
+        asyncio.run(run(args.logins, args.idle_seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""SQLite storage helpers for SaltShark
+
+Each store keeps its data in its own SQLite file under ``settings.data_dir``.
+WAL mode lets several uvicorn workers on the same host read concurrently while
+one of them writes.
+"""
+
+import os
+import socket
+import sqlite3
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from config.settings import settings
+
+# Identifies this worker process when competing for leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+LEASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def database_path(name: str) -> Path:
+    """Return the path of the SQLite file for store ``name``"""
+    return Path(settings.data_dir) / f"{name}.db"
+
+
+def connect(path: Path | str) -> sqlite3.Connection:
+    """Open a SQLite connection tuned for a multi-worker web server"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={settings.database_busy_timeout_ms}")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def data_version(conn: sqlite3.Connection) -> int:
+    """Return a counter that changes whenever *another* connection commits
+
+    Used to invalidate per-process caches when a different worker writes.
+    """
+    row = conn.execute("PRAGMA data_version").fetchone()
+    return int(row[0])
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Run a block in a write transaction, rolling back on error"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def acquire_lease(
+    conn: sqlite3.Connection, name: str, owner: str, ttl: float, now: float
+) -> bool:
+    """Take or renew the lease ``name``, returning whether ``owner`` holds it
+
+    Background loops that run in every worker use this so only one of them
+    does the work at a time. The database must contain ``LEASE_SCHEMA``.
+    """
+    with transaction(conn):
+        conn.execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET "
+            "owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+            (name, owner, now + ttl, now),
+        )
+        row = conn.execute(
+            "SELECT owner FROM leases WHERE name = ?", (name,)
+        ).fetchone()
+    return bool(row and row["owner"] == owner)
+
+
+def release_lease(conn: sqlite3.Connection, name: str, owner: str) -> None:
+    """Give up a lease so another worker can take over immediately"""
+    with transaction(conn):
+        conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
@@ -0,0 +1,43 @@
+"""Opaque keyset pagination cursors
+
+A cursor encodes the sort key of the last item on a page. The next page
+starts strictly after that key, so it costs the same as the first page and
+does not shift when new items arrive. Clients treat cursors as opaque
+strings; listings return the next one in the ``X-Next-Cursor`` header (or a
+``next_cursor`` field).
+"""
+
+import base64
+import json
+from typing import Any
+
+from fastapi import Response
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*key: Any) -> str:
+    """Encode a sort key as an opaque URL-safe cursor"""
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list[Any]:
+    """Decode a cursor into its ``size`` key parts
+
+    Raises ``ValueError`` for cursors this server did not produce.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except ValueError:
+        key = None
+    if not isinstance(key, list) or len(key) != size:
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def set_next_cursor(response: Response, cursor: str | None) -> None:
+    """Expose the cursor of the next page, if there is one"""
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
@@ -0,0 +1,269 @@
+"""Audit middleware for mutating API requests
+
+Every POST/PUT/PATCH/DELETE under ``/api/v1`` (minus ``audit_exclude_paths``)
+produces an audit entry with the user, client IP, target, function, jid and
+result. The middleware is plain ASGI: it copies request and response bodies
+as they stream past (up to ``audit_max_body_bytes``) instead of buffering
+them, and only builds the entry after the response has been sent, handing
+it to the batched audit writer. Secrets and large values such as pillar data
+are redacted or truncated before they are recorded.
+"""
+
+import json
+import logging
+import time
+from collections.abc import Awaitable, Callable, MutableMapping
+from datetime import UTC, datetime
+from typing import Any
+
+from jose import JWTError, jwt
+
+from apps.audit.schemas import AuditLog
+from apps.audit.writer import audit_writer, generate_ulid
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+MUTATING_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+API_PREFIX = "/api/v1/"
+REDACTED = "[REDACTED]"
+
+
+def redact(value: Any, depth: int = 0) -> Any:
+    """Mask secret keys and cut long strings, lists and deep nesting"""
+    if depth >= 6:
+        return "[...]"
+    if isinstance(value, dict):
+        redacted: dict[str, Any] = {}
+        for key, item in value.items():
+            lowered = str(key).lower()
+            if any(word in lowered for word in settings.audit_redact_keys):
+                redacted[key] = REDACTED
+            else:
+                redacted[key] = redact(item, depth + 1)
+        return redacted
+    if isinstance(value, list):
+        limit = settings.audit_max_list_items
+        items = [redact(item, depth + 1) for item in value[:limit]]
+        if len(value) > limit:
+            items.append(f"[{len(value) - limit} more]")
+        return items
+    if isinstance(value, str) and len(value) > settings.audit_max_value_chars:
+        return value[: settings.audit_max_value_chars] + "..."
+    return value
+
+
+def find_jid(value: Any, depth: int = 0) -> str | None:
+    """Find the first ``jid`` in a (nested) JSON response"""
+    if depth > 4:
+        return None
+    if isinstance(value, dict):
+        jid = value.get("jid")
+        if isinstance(jid, str | int):
+            return str(jid)
+        children = list(value.values())
+    elif isinstance(value, list):
+        children = value[:10]
+    else:
+        return None
+    for child in children:
+        jid = find_jid(child, depth + 1)
+        if jid:
+            return jid
+    return None
+
+
+def _parse_json(body: bytes, complete: bool) -> Any:
+    if not body or not complete:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def _header(scope: Scope, name: bytes) -> str | None:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return str(value.decode("latin-1"))
+    return None
+
+
+def _username(scope: Scope) -> str:
+    authorization = _header(scope, b"authorization") or ""
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return "anonymous"
+    try:
+        payload = jwt.decode(
+            token, settings.secret_key, algorithms=[settings.jwt_algorithm]
+        )
+    except JWTError:
+        return "anonymous"
+    return str(payload.get("sub") or "anonymous")
+
+
+def _result(status_code: int) -> str:
+    if status_code >= 500:
+        return "error"
+    if status_code >= 400:
+        return "failure"
+    return "success"
+
+
+class _BodyCopy:
+    """First ``limit`` bytes of a body that streams past"""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.chunks: list[bytes] = []
+        self.size = 0
+
+    def add(self, chunk: bytes) -> None:
+        if self.size < self.limit:
+            self.chunks.append(chunk[: self.limit - self.size])
+        self.size += len(chunk)
+
+    @property
+    def complete(self) -> bool:
+        return self.size <= self.limit
+
+    def data(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+class AuditMiddleware:
+    """Record an audit entry for every mutating API request"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    def _should_audit(self, scope: Scope) -> bool:
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS:
+            return False
+        path: str = scope["path"]
+        if not path.startswith(API_PREFIX):
+            return False
+        return not any(path.startswith(p) for p in settings.audit_exclude_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self._should_audit(scope):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        request_body = _BodyCopy(settings.audit_max_body_bytes)
+        response_body = _BodyCopy(settings.audit_max_body_bytes)
+        status_code = 500
+
+        async def receive_copy() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                request_body.add(message.get("body", b""))
+            return message
+
+        async def send_copy(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_body.add(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_copy, send_copy)
+        finally:
+            try:
+                await audit_writer.record(
+                    self._build_entry(
+                        scope,
+                        request_body,
+                        response_body,
+                        status_code,
+                        (time.perf_counter() - started) * 1000,
+                    )
+                )
+            except Exception:
+                logger.exception(
+                    "Failed to audit %s %s", scope["method"], scope["path"]
+                )
+
+    def _build_entry(
+        self,
+        scope: Scope,
+        request_body: _BodyCopy,
+        response_body: _BodyCopy,
+        status_code: int,
+        duration_ms: float,
+    ) -> AuditLog:
+        path: str = scope["path"]
+        route = scope.get("route")
+        endpoint = scope.get("endpoint")
+        path_params: dict[str, Any] = scope.get("path_params") or {}
+        segments = path[len(API_PREFIX) :].split("/")
+        resource_type = segments[0].removesuffix("s") or "api"
+
+        payload = _parse_json(request_body.data(), request_body.complete)
+        body = payload if isinstance(payload, dict) else {}
+        target = body.get("target") or body.get("tgt")
+        function = body.get("function") or body.get("fun")
+        jid = path_params.get("jid") or find_jid(
+            _parse_json(response_body.data(), response_body.complete)
+        )
+
+        details: dict[str, Any] = {
+            "method": scope["method"],
+            "path": path,
+            "route": getattr(route, "path", None),
+            "status_code": status_code,
+            "duration_ms": round(duration_ms, 3),
+        }
+        if target:
+            details["target"] = redact(target)
+        if function:
+            details["function"] = function
+        if jid:
+            details["jid"] = jid
+        if path_params:
+            details["path_params"] = redact(path_params)
+        if payload is not None:
+            details["request"] = redact(payload)
+        elif request_body.size:
+            details["request_size"] = request_body.size
+
+        client = scope.get("client")
+        forwarded = _header(scope, b"x-forwarded-for")
+        ip_address = (
+            forwarded.split(",")[0].strip()
+            if forwarded and settings.audit_trust_forwarded_for
+            else (client[0] if client else None)
+        )
+        resource_id = next(iter(path_params.values()), None) or target or jid or ""
+
+        return AuditLog(
+            id=generate_ulid(),
+            timestamp=datetime.now(tz=UTC),
+            user=_username(scope),
+            action=getattr(endpoint, "__name__", None) or scope["method"].lower(),
+            resource_type=resource_type,
+            resource_id=str(resource_id),
+            details=details,
+            result=_result(status_code),
+            ip_address=ip_address,
+        )
+
+
+MIDDLEWARES = [
+    {
+        "class": "middleware.audit.AuditMiddleware",
+        "priority": 5,
+        "enabled": settings.audit_middleware_enabled,
+        "kwargs": {},
+    },
+]
@@ -1,5 +1,11 @@
 """Test configuration"""
 
+import os
+import tempfile
+
+# Keep test databases out of the working tree
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="saltshark-tests-"))
+
 import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
@@ -0,0 +1,485 @@
+"""Tests for the persistent audit log"""
+
+import csv
+import gzip
+import io
+import json
+import sqlite3
+import stat
+from datetime import UTC, datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apps.audit.archive import ArchiveIntegrityError
+from apps.audit.export import stream_export
+from apps.audit.retention import AuditRetention
+from apps.audit.routes import create_audit_log
+from apps.audit.schemas import AuditLog
+from apps.audit.store import AuditStore, from_micros, to_micros
+from apps.audit.writer import AuditWriter, generate_ulid
+from apps.auth.routes import create_access_token
+
+NOW = datetime(2026, 1, 5, 12, 0, tzinfo=UTC)
+
+
+def make_log(n: int, **overrides) -> AuditLog:
+    fields = {
+        "id": f"log-{n}",
+        "timestamp": NOW + timedelta(seconds=n),
+        "user": "admin" if n % 2 else "operator",
+        "action": "job.execute" if n % 3 else "state.apply",
+        "resource_type": "job",
+        "resource_id": str(n),
+        "details": {"function": "test.ping"},
+    }
+    return AuditLog(**{**fields, **overrides})
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Audit store holding ten entries"""
+    store = AuditStore(tmp_path / "audit.db")
+    store.append_many(make_log(n) for n in range(10))
+    yield store
+    store.close()
+
+
+def test_micros_round_trip():
+    """Test timestamps survive storage exactly"""
+    timestamp = NOW.replace(microsecond=123456)
+    assert from_micros(to_micros(timestamp)) == timestamp
+
+
+def test_list_newest_first_with_filters(store: AuditStore):
+    """Test filtered listings are newest first and paginated"""
+    logs = store.list_logs(user="admin", action="job.execute")
+    assert [log.id for log in logs] == ["log-7", "log-5", "log-1"]
+    assert [log.id for log in store.list_logs(skip=1, limit=2)] == ["log-8", "log-7"]
+    assert store.get("log-4").details == {"function": "test.ping"}
+    assert store.get("missing") is None
+    assert store.list_actions() == ["job.execute", "state.apply"]
+
+
+@pytest.mark.parametrize("column", ["user", "action", "resource_type"])
+def test_filtered_listing_uses_index(store: AuditStore, column: str):
+    """Test filtered newest-first queries never scan or sort the table"""
+    plan = " ".join(
+        row["detail"]
+        for row in store.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM audit_log "  # noqa: S608
+            f"WHERE {column} = ? ORDER BY ts DESC, seq DESC LIMIT 10",
+            ("x",),
+        )
+    )
+    assert "USING INDEX" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_entries_are_immutable(store: AuditStore):
+    """Test recorded entries cannot be rewritten"""
+    with pytest.raises(sqlite3.IntegrityError, match="immutable"):
+        store.conn.execute("UPDATE audit_log SET user = 'mallory'")
+
+
+def test_audit_endpoints(client: TestClient, api_base_url: str, store: AuditStore):
+    """Test the audit API reads from the store"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+
+    with patch("apps.audit.routes.audit_store", store):
+        response = client.get(
+            f"{api_base_url}/audit",
+            params={"resource_type": "job", "limit": 2},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert [log["id"] for log in response.json()] == ["log-9", "log-8"]
+
+        response = client.get(f"{api_base_url}/audit/log-3", headers=headers)
+        assert response.json()["action"] == "state.apply"
+
+        response = client.get(f"{api_base_url}/audit/users/operator", headers=headers)
+        assert len(response.json()) == 5
+
+
+def test_ulids_are_unique_and_sorted():
+    """Test ULIDs sort in creation order, even within one millisecond"""
+    ids = [generate_ulid() for _ in range(1000)]
+    assert len(set(ids)) == 1000
+    assert ids == sorted(ids)
+    assert all(len(i) == 26 for i in ids)
+
+
+@pytest.mark.asyncio
+async def test_writer_group_commits(tmp_path):
+    """Test queued entries are committed in batches"""
+    store = AuditStore(tmp_path / "audit.db")
+    writer = AuditWriter(store)
+    writer.start()
+
+    for n in range(100):
+        await writer.record(make_log(n, id=generate_ulid()))
+    await writer.flush()
+
+    stats = writer.stats()
+    assert stats.written == 100
+    assert stats.batches < 100
+    assert len(store.list_logs(limit=1000)) == 100
+    await writer.stop()
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_writer_drops_when_full(tmp_path):
+    """Test the drop overflow policy counts discarded entries"""
+    store = AuditStore(tmp_path / "audit.db")
+    writer = AuditWriter(store)
+    with (
+        patch("apps.audit.writer.settings.audit_queue_size", 2),
+        patch("apps.audit.writer.settings.audit_overflow", "drop"),
+    ):
+        writer.start()
+        # The writer task has not run yet, so the queue fills up
+        for n in range(5):
+            await writer.record(make_log(n))
+        assert writer.stats().dropped == 3
+        await writer.stop()
+
+    assert len(store.list_logs()) == 2
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_create_audit_log_without_writer(tmp_path):
+    """Test entries are written directly when the writer is not running"""
+    store = AuditStore(tmp_path / "audit.db")
+    with patch("apps.audit.routes.audit_writer", AuditWriter(store)):
+        log = await create_audit_log("admin", "key.accept", "key", "web-1")
+
+    assert store.get(log.id).action == "key.accept"
+    store.close()
+
+
+def test_cursor_pagination(store: AuditStore):
+    """Test cursor pages are stable while new entries arrive"""
+    first, cursor = store.list_page(user="admin", limit=2)
+    assert [log.id for log in first] == ["log-9", "log-7"]
+
+    store.append(make_log(11))
+    second, cursor = store.list_page(user="admin", cursor=cursor, limit=2)
+    assert [log.id for log in second] == ["log-5", "log-3"]
+
+    last, cursor = store.list_page(user="admin", cursor=cursor, limit=2)
+    assert [log.id for log in last] == ["log-1"]
+    assert cursor is None
+
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        store.list_page(cursor="not-a-cursor")
+
+
+def test_audit_cursor_header(client: TestClient, api_base_url: str, store):
+    """Test the next cursor is returned in a response header"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+
+    with patch("apps.audit.routes.audit_store", store):
+        response = client.get(
+            f"{api_base_url}/audit", params={"limit": 6}, headers=headers
+        )
+        cursor = response.headers["X-Next-Cursor"]
+
+        response = client.get(
+            f"{api_base_url}/audit",
+            params={"limit": 6, "cursor": cursor},
+            headers=headers,
+        )
+        assert [log["id"] for log in response.json()] == [
+            "log-3",
+            "log-2",
+            "log-1",
+            "log-0",
+        ]
+        assert "X-Next-Cursor" not in response.headers
+
+        response = client.get(
+            f"{api_base_url}/audit", params={"cursor": "%%%"}, headers=headers
+        )
+        assert response.status_code == 400
+
+
+def test_export_streams_in_pages(store: AuditStore):
+    """Test exports read the store page by page"""
+    batches = list(store.iter_batches(user="admin", batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+    chunks = list(stream_export(batches, "ndjson", "none"))
+    assert len(chunks) == 3
+    lines = b"".join(chunks).decode().splitlines()
+    assert [json.loads(line)["id"] for line in lines][:2] == ["log-9", "log-7"]
+
+
+def test_export_csv_gzip(store: AuditStore):
+    """Test gzip CSV export decompresses to one row per entry"""
+    data = b"".join(stream_export(store.iter_batches(batch_size=3), "csv", "gzip"))
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(data).decode())))
+    assert len(rows) == 10
+    assert json.loads(rows[0]["details"]) == {"function": "test.ping"}
+
+
+def test_export_endpoint(client: TestClient, api_base_url: str, store: AuditStore):
+    """Test the export endpoint applies filters and rejects bad options"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+
+    with patch("apps.audit.routes.audit_store", store):
+        response = client.get(
+            f"{api_base_url}/audit/export",
+            params={"format": "ndjson", "action": "state.apply"},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert "audit-log.ndjson" in response.headers["content-disposition"]
+        assert len(response.text.splitlines()) == 4
+
+        response = client.get(
+            f"{api_base_url}/audit/export", params={"format": "xml"}, headers=headers
+        )
+        assert response.status_code == 400
+
+
+def test_rollups_follow_appends(store: AuditStore):
+    """Test rollups count each stored entry once per granularity"""
+    # Re-appending stored entries must not double count
+    store.append_many([make_log(1), make_log(2)])
+
+    rows = store.stats(
+        "minute",
+        NOW,
+        NOW + timedelta(hours=1),
+        group_by=["action"],
+        filters={"user": "admin"},
+    )
+    assert rows == [
+        {"bucket": int(NOW.timestamp()), "action": "job.execute", "count": 3},
+        {"bucket": int(NOW.timestamp()), "action": "state.apply", "count": 2},
+    ]
+
+    with pytest.raises(ValueError, match="Unknown dimension"):
+        store.stats("day", NOW, NOW, group_by=["details"], filters={})
+
+
+def test_rollups_backfilled_for_existing_log(tmp_path, store: AuditStore):
+    """Test a log without rollups gets them rebuilt on open"""
+    store.conn.execute("DELETE FROM audit_rollup")
+    store.close()
+
+    reopened = AuditStore(tmp_path / "audit.db")
+    rows = reopened.stats("day", NOW, NOW + timedelta(days=1), [], {})
+    assert rows == [{"bucket": int(NOW.timestamp()) - 12 * 3600, "count": 10}]
+    reopened.close()
+
+
+def test_stats_endpoint(client: TestClient, api_base_url: str, store: AuditStore):
+    """Test /audit/stats groups counts per bucket"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+
+    with patch("apps.audit.routes.audit_store", store):
+        response = client.get(
+            f"{api_base_url}/audit/stats",
+            params={
+                "granularity": "hour",
+                "since": NOW.isoformat(),
+                "until": (NOW + timedelta(days=1)).isoformat(),
+                "group_by": ["user", "result"],
+            },
+            headers=headers,
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == 10
+        assert {b["user"]: b["count"] for b in data["buckets"]} == {
+            "admin": 5,
+            "operator": 5,
+        }
+
+        response = client.get(
+            f"{api_base_url}/audit/stats",
+            params={"granularity": "week"},
+            headers=headers,
+        )
+        assert response.status_code == 400
+
+
+def test_full_text_search(store: AuditStore):
+    """Test phrase and prefix search over details, with filters"""
+    store.append(
+        make_log(
+            20,
+            resource_id="web-01.example.com",
+            details={"state": "webserver.nginx", "args": ["pkg.installed"]},
+        )
+    )
+
+    logs, _ = store.search('"webserver.nginx"')
+    assert [log.id for log in logs] == ["log-20"]
+    assert [log.id for log in store.search("web*")[0]] == ["log-20"]
+    assert [log.id for log in store.search("example")[0]] == ["log-20"]
+
+    logs, cursor = store.search("ping", user="admin", limit=3)
+    assert [log.id for log in logs] == ["log-9", "log-7", "log-5"]
+    logs, cursor = store.search("ping", user="admin", cursor=cursor, limit=3)
+    assert [log.id for log in logs] == ["log-3", "log-1"]
+    assert cursor is None
+
+    with pytest.raises(ValueError, match="Invalid search query"):
+        store.search('"unterminated')
+
+
+def test_search_index_backfilled(tmp_path, store: AuditStore):
+    """Test a log without a search index gets it rebuilt on open"""
+    store.conn.execute("INSERT INTO audit_fts (audit_fts) VALUES ('delete-all')")
+    store.close()
+
+    reopened = AuditStore(tmp_path / "audit.db")
+    assert len(reopened.search("ping", limit=100)[0]) == 10
+    reopened.close()
+
+
+def test_search_endpoint(client: TestClient, api_base_url: str, store: AuditStore):
+    """Test /audit/search applies the query and filters"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+
+    with patch("apps.audit.routes.audit_store", store):
+        response = client.get(
+            f"{api_base_url}/audit/search",
+            params={"q": "test.ping", "action": "state.apply"},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert [log["id"] for log in response.json()] == [
+            "log-9",
+            "log-6",
+            "log-3",
+            "log-0",
+        ]
+
+
+RETENTION_POLICIES = [
+    {"actions": "state.*", "max_entries": 2},
+    {"actions": "*", "max_age_days": 30},
+]
+
+
+@pytest.fixture
+def retained(store: AuditStore):
+    """Store after a retention run over the ten entries plus three old ones"""
+    store.append_many(
+        make_log(n, timestamp=NOW - timedelta(days=20 + n)) for n in (20, 21, 22)
+    )
+    retention = AuditRetention(store)
+    with (
+        patch(
+            "apps.audit.retention.settings.audit_retention_policies",
+            RETENTION_POLICIES,
+        ),
+        patch("apps.audit.retention.settings.audit_archive_part_entries", 2),
+    ):
+        assert retention.run_once(NOW + timedelta(hours=1)) == 5
+        # Nothing left to expire, and another worker does not get the lease
+        assert retention.run_once(NOW + timedelta(hours=1)) == 0
+        assert AuditRetention(store).run_once(NOW + timedelta(hours=1)) is None
+    return store
+
+
+def test_retention_archives_expired_entries(retained: AuditStore):
+    """Test entries past their class's age or size limit move to the archive"""
+    hot = [log.id for log in retained.list_logs()]
+    assert hot == ["log-9", "log-8", "log-7", "log-6", "log-5", "log-4"] + [
+        "log-2",
+        "log-1",
+    ]
+    logs, _ = retained.list_page(archived=True)
+    assert [log.id for log in logs] == ["log-3", "log-0", "log-20", "log-21", "log-22"]
+    assert logs[0] == make_log(3)
+
+    # Archived entries leave the search index but stay in the rollups, except
+    # minute rollups older than two days
+    assert len(retained.search("ping")[0]) == 8
+    since, until = NOW - timedelta(days=60), NOW + timedelta(days=1)
+    for granularity, count in (("day", 13), ("hour", 13), ("minute", 10)):
+        rows = retained.stats(granularity, since, until, [], {})
+        assert sum(row["count"] for row in rows) == count
+
+    assert retained.storage_summary() == {
+        "hot_entries": 8,
+        "archived_entries": 5,
+        "archive_partitions": 5,
+        "archive_bytes": retained.storage_summary()["archive_bytes"],
+    }
+    parts = sorted(retained.archive_dir.rglob("*.ndjson.gz"))
+    assert len(parts) == 5
+    assert all(not part.stat().st_mode & stat.S_IWUSR for part in parts)
+    assert parts[-1].relative_to(retained.archive_dir).parts[:3] == ("2026", "01", "05")
+
+
+def test_archive_pagination_and_filters(retained: AuditStore):
+    """Test cursor paging, filters and time ranges over archived entries"""
+    logs, cursor = retained.list_page(archived=True, limit=2)
+    assert [log.id for log in logs] == ["log-3", "log-0"]
+    logs, cursor = retained.list_page(archived=True, cursor=cursor, limit=2)
+    assert [log.id for log in logs] == ["log-20", "log-21"]
+    logs, cursor = retained.list_page(archived=True, cursor=cursor, limit=2)
+    assert [log.id for log in logs] == ["log-22"]
+    assert cursor is None
+
+    logs, _ = retained.list_page(archived=True, user="admin")
+    assert [log.id for log in logs] == ["log-3", "log-21"]
+    logs, _ = retained.list_page(
+        archived=True, since=NOW - timedelta(days=41), until=NOW
+    )
+    assert [log.id for log in logs] == ["log-20", "log-21"]
+    batches = list(retained.iter_batches(archived=True, batch_size=3))
+    assert [len(batch) for batch in batches] == [3, 2]
+
+
+def test_archived_entry_lookup_by_ulid(store: AuditStore):
+    """Test get() finds archived ULID entries and rejects tampered parts"""
+    log = make_log(0, id=generate_ulid(), timestamp=datetime.now(tz=UTC))
+    store.append(log)
+    assert store.archive("1 = 1", [], 100) == 11
+    assert store.get(log.id) == log
+    assert store.get("log-1") is None
+
+    part = next(store.archive_dir.rglob(f"*{datetime.now(tz=UTC):%d}/*.ndjson.gz"))
+    part.chmod(0o644)
+    part.write_bytes(gzip.compress(b"{}\n"))
+    with pytest.raises(ArchiveIntegrityError):
+        store.get(log.id)
+
+
+def test_retention_endpoints(
+    client: TestClient, api_base_url: str, retained: AuditStore
+):
+    """Test the retention status, manual run and archived listing endpoints"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+    retention = AuditRetention(retained)
+
+    with (
+        patch("apps.audit.routes.audit_store", retained),
+        patch("apps.audit.routes.audit_retention", retention),
+        patch("apps.audit.retention.settings.audit_retention_policies", []),
+    ):
+        response = client.get(f"{api_base_url}/audit/retention", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["archived_entries"] == 5
+        assert response.json()["hot_entries"] == 8
+
+        response = client.post(f"{api_base_url}/audit/retention/run", headers=headers)
+        assert response.status_code == 200
+        assert response.json() == {"archived": 0, "ran": True}
+
+        response = client.get(
+            f"{api_base_url}/audit",
+            params={"archived": "true", "action": "state.apply"},
+            headers=headers,
+        )
+        assert [log["id"] for log in response.json()] == ["log-3", "log-0", "log-21"]
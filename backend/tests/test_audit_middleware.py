@@ -0,0 +1,110 @@
+"""Tests for the audit middleware"""
+
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from apps.audit.store import AuditStore
+from apps.audit.writer import AuditWriter
+from apps.auth.routes import create_access_token
+from middleware.audit import REDACTED, AuditMiddleware, redact
+
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(AuditMiddleware)
+
+    @app.post("/api/v1/jobs/execute")
+    async def execute_job(body: dict[str, Any]) -> dict[str, Any]:
+        return {"success": True, "data": {"return": [{"jid": "20260105120000"}]}}
+
+    @app.delete("/api/v1/keys/{minion_id}")
+    async def delete_key(minion_id: str) -> dict[str, Any]:
+        return {"success": False}
+
+    @app.get("/api/v1/jobs")
+    async def list_jobs() -> dict[str, Any]:
+        return {"jobs": []}
+
+    @app.post("/api/v1/audit/anything")
+    async def excluded() -> dict[str, Any]:
+        return {}
+
+    return app
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Audit store the middleware writes to"""
+    store = AuditStore(tmp_path / "audit.db")
+    with patch("middleware.audit.audit_writer", AuditWriter(store)):
+        yield store
+    store.close()
+
+
+def test_redact_masks_secrets_and_truncates():
+    """Test secrets are masked and large values are cut down"""
+    with patch("middleware.audit.settings.audit_max_list_items", 2):
+        redacted = redact(
+            {
+                "password": "hunter2",
+                "pillar": {"db": {"password": "x"}},
+                "args": ["a", "b", "c", "d"],
+                "cmd": "x" * 5000,
+            }
+        )
+    assert redacted["password"] == REDACTED
+    assert redacted["pillar"] == REDACTED
+    assert redacted["args"] == ["a", "b", "[2 more]"]
+    assert len(redacted["cmd"]) < 5000
+
+
+def test_mutating_request_is_audited(store: AuditStore):
+    """Test user, target, function and jid are captured"""
+    client = TestClient(create_app())
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+
+    response = client.post(
+        "/api/v1/jobs/execute",
+        json={"target": "web*", "function": "cmd.run", "pillar": {"secret": 1}},
+        headers=headers,
+    )
+    assert response.status_code == 200
+
+    [log] = store.list_logs()
+    assert log.user == "admin"
+    assert log.action == "execute_job"
+    assert log.resource_type == "job"
+    assert log.resource_id == "web*"
+    assert log.result == "success"
+    assert log.ip_address == "testclient"
+    assert log.details["function"] == "cmd.run"
+    assert log.details["jid"] == "20260105120000"
+    assert log.details["request"]["pillar"] == REDACTED
+
+
+def test_path_params_and_failures(store: AuditStore):
+    """Test resource ids come from the path and errors are recorded"""
+    client = TestClient(create_app())
+
+    client.delete("/api/v1/keys/web-1")
+    client.post("/api/v1/jobs/execute", content=b"not json")
+
+    logs = store.list_logs()
+    assert [log.result for log in logs] == ["failure", "success"]
+    assert logs[1].resource_id == "web-1"
+    assert logs[1].user == "anonymous"
+    assert logs[0].details["request_size"] == 8
+
+
+def test_reads_and_excluded_paths_are_not_audited(store: AuditStore):
+    """Test GET requests and excluded prefixes skip the audit log"""
+    client = TestClient(create_app())
+
+    client.get("/api/v1/jobs")
+    client.post("/api/v1/audit/anything")
+
+    assert store.list_logs() == []
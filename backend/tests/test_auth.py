@@ -1,17 +1,28 @@
 """Tests for authentication endpoints"""
 
-from datetime import datetime, timezone
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
 
 import pytest
 from fastapi.testclient import TestClient
+from jose import jwt
 
+from apps.auth.revocation import BloomFilter, RevocationList
 from apps.auth.routes import (
+    authenticate_user_async,
     create_access_token,
     fake_users_db,
+    get_current_user,
     get_password_hash,
+    users_changed,
     verify_password,
+    verify_password_async,
 )
 from apps.auth.schemas import UserInDB
+from config.settings import settings
 
 
 @pytest.fixture(autouse=True)
@@ -25,6 +36,7 @@ def reset_users_db():
     # Restore original state
     fake_users_db.clear()
     fake_users_db.update(original_db)
+    users_changed()
 
 
 def test_verify_password():
@@ -382,3 +394,170 @@ def test_inactive_user_access(client: TestClient):
 
     assert response.status_code == 400
     assert "Inactive user" in response.json()["detail"]
+
+
+@pytest.mark.asyncio
+async def test_login_verification_leaves_event_loop_free():
+    """Test bcrypt runs in the password pool while the loop keeps serving"""
+    ticks = 0
+
+    async def ticker() -> None:
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.005)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    users = await asyncio.gather(
+        *(authenticate_user_async("admin", "admin123") for _ in range(4))
+    )
+    task.cancel()
+
+    assert all(user is not None for user in users)
+    assert not await authenticate_user_async("admin", "wrong")
+    # Four bcrypt checks take far longer than a few ticks
+    assert ticks >= 5
+
+
+@pytest.mark.asyncio
+async def test_password_pool_caps_concurrency():
+    """Test no more verifications run at once than the pool has threads"""
+    running = peak = 0
+    lock = threading.Lock()
+
+    def slow_verify(plain_password: str, hashed_password: str) -> bool:
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+        return True
+
+    with patch("apps.auth.routes.verify_password", slow_verify):
+        await asyncio.gather(*(verify_password_async("x", "y") for _ in range(20)))
+    assert 1 < peak <= settings.password_hash_workers
+
+
+@pytest.mark.asyncio
+async def test_principal_cache_skips_decoding_until_expiry_or_user_change():
+    """Test a cached principal is reused until its token expires or users change"""
+    token = create_access_token({"sub": "admin"}, timedelta(minutes=5))
+    with patch("apps.auth.routes.jwt.decode", wraps=jwt.decode) as decode:
+        first = await get_current_user(token)
+        assert await get_current_user(token) is first
+        assert decode.call_count == 1
+
+        users_changed()
+        await get_current_user(token)
+        assert decode.call_count == 2
+
+        with patch("apps.auth.routes.time.time", return_value=time.time() + 600):
+            await get_current_user(token)
+        assert decode.call_count == 3
+
+
+def test_principal_cache_sees_role_changes(client: TestClient):
+    """Test a role change applies to tokens resolved before it"""
+    token = create_access_token({"sub": "admin"})
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/api/v1/auth/users", headers=headers).status_code == 200
+
+    fake_users_db["admin"] = fake_users_db["admin"].model_copy(
+        update={"role": "viewer"}
+    )
+    users_changed()
+    assert client.get("/api/v1/auth/users", headers=headers).status_code == 403
+
+
+@pytest.fixture
+def revocations(tmp_path):
+    """Use a fresh revocation list"""
+    revocations = RevocationList(tmp_path / "revocations.db")
+    with patch("apps.auth.routes.revocation_list", revocations):
+        yield revocations
+    revocations.close()
+
+
+def test_logout_revokes_only_the_presented_token(
+    client: TestClient, revocations: RevocationList
+):
+    """Test a logged-out token is rejected, cached or not, and others still work"""
+    tokens = [create_access_token({"sub": "admin"}) for _ in range(2)]
+    assert len({jwt.get_unverified_claims(t)["jti"] for t in tokens}) == 2
+    headers = [{"Authorization": f"Bearer {t}"} for t in tokens]
+    assert client.get("/api/v1/auth/me", headers=headers[0]).status_code == 200
+
+    response = client.post("/api/v1/auth/logout", headers=headers[0])
+    assert response.json()["note"] == "Token revoked"
+    assert client.get("/api/v1/auth/me", headers=headers[0]).status_code == 401
+    users_changed()
+    assert client.get("/api/v1/auth/me", headers=headers[0]).status_code == 401
+    assert client.get("/api/v1/auth/me", headers=headers[1]).status_code == 200
+
+
+def test_revocations_reach_other_workers_and_expire(tmp_path):
+    """Test another worker's revocation is seen after a sync and pruned at exp"""
+    now = time.time()
+    worker = RevocationList(tmp_path / "revocations.db")
+    other_worker = RevocationList(tmp_path / "revocations.db")
+    assert not worker.is_revoked("a", now)
+
+    other_worker.revoke("a", now + 60, now)
+    other_worker.revoke("expired", now - 1, now)
+    worker.sync(now, force=True)
+    assert worker.is_revoked("a", now)
+    assert not worker.is_revoked("expired", now)
+
+    assert worker.prune(now + 61) == 1
+    assert not worker.is_revoked("a", now + 61)
+    worker.close()
+    other_worker.close()
+
+
+def test_revocation_filter_hits_are_confirmed_exactly(tmp_path):
+    """Test Bloom filter false positives never reject a token"""
+    bloom = BloomFilter(1 << 16, 7)
+    bloom.add("revoked")
+    assert "revoked" in bloom
+    assert "valid" not in bloom
+
+    revocations = RevocationList(tmp_path / "revocations.db")
+    with patch("apps.auth.revocation.settings.token_revocation_filter_bits", 8):
+        for n in range(20):
+            revocations.revoke(f"revoked-{n}", time.time() + 60)
+        revocations.sync(force=True)
+        # Every bit of the tiny filter is set, yet only revoked ids are reported
+        assert "valid" in revocations._filter
+        assert not revocations.is_revoked("valid")
+        assert revocations.is_revoked("revoked-3")
+    revocations.close()
+
+
+@pytest.mark.asyncio
+async def test_revocation_filter_is_rebuilt_off_the_loop(tmp_path):
+    """Test the prune loop rebuilds in a worker thread and swaps the filter in"""
+    revocations = RevocationList(tmp_path / "revocations.db")
+    revocations.revoke("a", time.time() + 60)
+    revocations.revoke("gone", time.time() + 0.01)
+    first = revocations._filter
+    threads: list[threading.Thread] = []
+    prune = revocations.prune
+
+    def record_prune(now: float | None = None) -> int:
+        threads.append(threading.current_thread())
+        return prune(now)
+
+    await asyncio.sleep(0.02)
+    with patch.object(revocations, "prune", record_prune):
+        revocations.start()
+        async with asyncio.timeout(5):
+            while not threads or revocations._filter is first:
+                await asyncio.sleep(0.01)
+        await revocations.stop()
+
+    assert threads[0] is not threading.current_thread()
+    assert revocations.is_revoked("a")
+    assert "gone" not in revocations._filter
+    revocations.close()
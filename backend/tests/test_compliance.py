@@ -0,0 +1,772 @@
+"""Tests for the compliance engine and drift scanner"""
+
+import asyncio
+from datetime import UTC, datetime, timedelta
+from typing import Any
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apps.audit.compliance import (
+    ComplianceCollector,
+    ComplianceEngine,
+    ComplianceStore,
+    parse_job_arguments,
+    summarize_states,
+)
+from apps.audit.drift import DriftScanner, DriftStore, extract_drift
+from apps.audit.history import append_snapshot
+from apps.audit.remediation import Remediator, plan_remediation
+from apps.auth.routes import create_access_token, fake_users_db, users_changed
+from apps.salt.schemas import TargetExecutionResult
+from config.database import transaction
+
+JID_1 = "20260105120000000000"
+JID_2 = "20260105130000000000"
+JID_3 = "20260105140000000000"
+
+
+def state(sls: str, state_id: str, result: bool | None, comment: str = "") -> Any:
+    """One entry of a highstate return, keyed the way Salt keys it"""
+    return (
+        f"pkg_|-{state_id}_|-{state_id}_|-installed",
+        {"__sls__": sls, "__id__": state_id, "result": result, "comment": comment},
+    )
+
+
+def highstate(*states: Any) -> dict[str, Any]:
+    return dict(states)
+
+
+def pending(module: str, name: str, changes: Any, comment: str = "") -> Any:
+    """A test highstate entry that would change something"""
+    return (
+        f"{module}_|-{name}_|-{name}_|-managed",
+        {"__sls__": "base", "__id__": name, "name": name, "result": None}
+        | {"changes": changes, "comment": comment},
+    )
+
+
+@pytest.fixture(autouse=True)
+def utc_jids():
+    """Read the jids above as UTC, whatever the local timezone"""
+    with patch("apps.salt.job_engine.settings.salt_utc_jid", True):
+        yield
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Fresh compliance store"""
+    store = ComplianceStore(tmp_path / "compliance.db")
+    yield store
+    store.close()
+
+
+def test_summarize_states():
+    """Test failed, pending (test=True) and render-error returns"""
+    succeeded, failed = summarize_states(
+        highstate(
+            state("webserver.nginx", "nginx-install", False, "Package not found"),
+            state("base.users", "admin-user", True),
+            state("base.motd", "motd", None, "Would be updated"),
+        ),
+        "2026-01-05T12:00:00+00:00",
+    )
+    assert succeeded == [("base.users", "admin-user")]
+    assert [(f.state_id, f.reason) for f in failed] == [
+        ("nginx-install", "Package not found"),
+        ("motd", "Would be updated"),
+    ]
+
+    _, failed = summarize_states(["Rendering SLS 'base' failed"], "now")
+    assert [(f.state_name, f.state_id) for f in failed] == [("highstate", "render")]
+
+    assert parse_job_arguments(["webserver.nginx,base", "test=True"]) == (
+        ["webserver.nginx", "base"],
+        True,
+    )
+    assert parse_job_arguments([{"test": True, "__kwarg__": True}]) == ([], True)
+
+
+def test_record_maintains_counters(store: ComplianceStore):
+    """Test per-minion records and fleet counters follow highstate returns"""
+    store.record(
+        {
+            "web-1": highstate(
+                state("webserver.nginx", "nginx-install", False, "not found"),
+                state("base.users", "admin-user", True),
+            ),
+            "web-2": highstate(state("base.users", "admin-user", True)),
+        },
+        JID_1,
+    )
+    status = store.status()
+    assert (status.total_minions, status.compliant_minions) == (2, 1)
+    assert status.compliance_percentage == 50.0
+    assert status.last_check == "2026-01-05T12:00:00+00:00"
+
+    web1 = store.get("web-1")
+    assert web1 is not None
+    assert not web1.is_compliant
+    assert web1.compliance_score == 50.0
+    assert web1.last_highstate == "2026-01-05T12:00:00+00:00"
+
+    # A stale return is ignored, a newer one flips web-1 to compliant
+    assert store.record({"web-1": highstate()}, JID_1) == []
+    store.record(
+        {"web-1": highstate(state("webserver.nginx", "nginx-install", True))}, JID_2
+    )
+    status = store.status()
+    assert (status.total_minions, status.compliant_minions) == (2, 2)
+    assert status.compliance_percentage == 100.0
+
+
+def test_partial_run_updates_only_its_states(store: ComplianceStore):
+    """Test a state.sls run keeps failures it did not touch"""
+    store.record(
+        {
+            "web-1": highstate(
+                state("webserver.nginx", "nginx-install", False, "not found"),
+                state("base.motd", "motd", False, "template error"),
+                state("base.users", "admin-user", True),
+                state("base.ssh", "sshd", True),
+            )
+        },
+        JID_1,
+    )
+    store.record(
+        {"web-1": highstate(state("webserver.nginx", "nginx-install", True))},
+        JID_2,
+        partial=True,
+    )
+    web1 = store.get("web-1")
+    assert web1 is not None
+    assert [f.state_id for f in web1.failed_states] == ["motd"]
+    assert web1.failed_states[0].failed_at == "2026-01-05T12:00:00+00:00"
+    assert web1.compliance_score == 75.0
+    assert web1.total_states == 4
+    assert web1.last_highstate == "2026-01-05T12:00:00+00:00"
+
+
+@pytest.mark.asyncio
+async def test_collector_ingests_state_jobs(store: ComplianceStore):
+    """Test the collector reads state jobs from the job cache until settled"""
+    client = AsyncMock()
+    client.list_jobs = AsyncMock(
+        return_value={
+            "return": [
+                {
+                    JID_1: {"Function": "state.highstate", "Arguments": []},
+                    JID_2: {"Function": "test.ping", "Arguments": []},
+                    JID_3: {"Function": "state.apply", "Arguments": ["test=True"]},
+                }
+            ]
+        }
+    )
+    returns = {
+        JID_1: {"web-1": highstate(state("base.users", "admin-user", True))},
+        JID_3: {"web-2": highstate(state("base.motd", "motd", None, "Would change"))},
+    }
+    client.get_job = AsyncMock(
+        side_effect=lambda jid: {"info": [{}], "return": [returns[jid]]}
+    )
+    collector = ComplianceCollector(ComplianceEngine(store), client)
+
+    now = datetime(2026, 1, 5, 14, 30, tzinfo=UTC)
+    with patch("apps.audit.compliance.settings.compliance_settle_seconds", 3600):
+        assert await collector.collect(now) == 2
+        # JID_1 has settled and is not fetched again; JID_3 is re-read
+        assert await collector.collect(now) == 0
+    assert [call.args[0] for call in client.get_job.await_args_list] == [
+        JID_1,
+        JID_3,
+        JID_3,
+    ]
+    status = store.status()
+    assert (status.total_minions, status.compliant_minions) == (2, 1)
+
+
+def test_compliance_endpoints(
+    client: TestClient, api_base_url: str, store: ComplianceStore
+):
+    """Test the compliance status, listing and minion endpoints"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+    store.record(
+        {
+            "web-1": highstate(state("webserver.nginx", "nginx-install", False)),
+            "web-2": highstate(state("base.users", "admin-user", True)),
+        },
+        JID_1,
+    )
+
+    with patch("apps.audit.routes.compliance_store", store):
+        response = client.get(f"{api_base_url}/compliance/status", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["non_compliant_minions"] == 1
+
+        response = client.get(
+            f"{api_base_url}/compliance/minions",
+            params={"compliant": "false"},
+            headers=headers,
+        )
+        assert [m["minion_id"] for m in response.json()] == ["web-1"]
+
+        response = client.get(
+            f"{api_base_url}/compliance/failed-states", headers=headers
+        )
+        assert [(f["minion_id"], f["state_id"]) for f in response.json()] == [
+            ("web-1", "nginx-install")
+        ]
+
+        response = client.get(
+            f"{api_base_url}/compliance/minions/web-3", headers=headers
+        )
+        assert response.status_code == 404
+
+
+def test_extract_drift():
+    """Test expected/actual values and drift types from pending changes"""
+    drift = extract_drift(
+        "web-1",
+        highstate(
+            pending("pkg", "nginx", {"nginx": {"new": "1.18.0", "old": ""}}),
+            pending("pkg", "telnet", {"telnet": {"new": "", "old": "0.17"}}),
+            pending("file", "/etc/motd", {"diff": "+hello"}, "File would change"),
+            state("base.users", "admin-user", True),
+        ),
+        "2026-01-05T12:00:00+00:00",
+    )
+    assert [
+        (d.resource_type, d.resource_name, d.drift_type, d.expected_value)
+        for d in drift.values()
+    ] == [
+        ("pkg", "nginx", "missing", "1.18.0"),
+        ("pkg", "telnet", "unexpected", ""),
+        ("file", "/etc/motd", "modified", '{"diff": "+hello"}'),
+    ]
+    assert drift["file_|-/etc/motd_|-/etc/motd_|-managed"].actual_value == (
+        "File would change"
+    )
+
+
+def test_drift_store_tracks_first_and_last_seen(tmp_path):
+    """Test repeated drift keeps first_seen and vanished drift is resolved"""
+    store = DriftStore(tmp_path / "drift.db")
+    nginx = pending("pkg", "nginx", {"nginx": {"new": "1.18.0", "old": ""}})
+    motd = pending("file", "/etc/motd", {"diff": "+hello"})
+    first = datetime(2026, 1, 5, 12, tzinfo=UTC)
+    second = datetime(2026, 1, 5, 18, tzinfo=UTC)
+
+    assert store.record({"web-1": highstate(nginx, motd)}, first) == 1
+    assert store.record({"web-1": highstate(nginx), "web-2": "timeout"}, second) == 1
+
+    drift, _ = store.list_page()
+    assert [(d.resource_name, d.first_seen, d.last_seen) for d in drift] == [
+        ("nginx", first.isoformat(), second.isoformat())
+    ]
+    drift, _ = store.list_page(include_resolved=True, resource_type="file")
+    assert drift[0].resolved_at == second.isoformat()
+    assert store.list_page(since=second)[0] == []
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_drift_scanner_batches_and_feeds_compliance(
+    tmp_path, store: ComplianceStore
+):
+    """Test the scanner runs throttled test highstates per batch of minions"""
+    fleet = [f"web-{n}" for n in range(5)]
+    in_flight = peak = 0
+
+    async def fake_publish(target: str, function: str, *args: Any) -> dict[str, Any]:
+        nonlocal in_flight, peak
+        assert function == "state.highstate"
+        assert args[1] == {"test": True}
+        in_flight += 1
+        peak = max(peak, in_flight)
+        minions = target.split(",")
+        jids[args[-1]] = minions
+        return {"return": [{"jid": args[-1], "minions": minions}]}
+
+    async def fake_get_job(jid: str) -> dict[str, Any]:
+        nonlocal in_flight
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        nginx = pending("pkg", "nginx", {"nginx": {"new": "1.18.0", "old": ""}})
+        result = {
+            m: {"return": highstate(nginx) if m == "web-3" else {}, "retcode": 0}
+            for m in jids[jid]
+        }
+        return {"info": [{"Result": result}]}
+
+    jids: dict[str, list[str]] = {}
+    client = AsyncMock()
+    client.list_keys = AsyncMock(
+        return_value={"return": [{"data": {"return": {"minions": fleet}}}]}
+    )
+    client.publish_job = AsyncMock(side_effect=fake_publish)
+    client.get_job = AsyncMock(side_effect=fake_get_job)
+    drift_store = DriftStore(tmp_path / "drift.db")
+    scanner = DriftScanner(drift_store, client, ComplianceEngine(store))
+
+    with (
+        patch("apps.audit.drift.settings.drift_batch_size", 2),
+        patch("apps.audit.drift.settings.drift_concurrency", 1),
+        patch("apps.audit.drift.settings.job_poll_seconds", 0.001),
+    ):
+        scan = await scanner.scan()
+    assert (scan.minions, scan.batches, scan.drifted) == (5, 3, 1)
+    assert client.publish_job.await_count == 3
+    assert peak == 1
+    assert [d.minion_id for d in drift_store.list_page()[0]] == ["web-3"]
+    assert store.status().non_compliant_minions == 1
+    assert scanner.status().last_scan == scan
+    drift_store.close()
+
+
+@pytest.mark.asyncio
+async def test_drift_scanner_renews_its_lease_per_batch(tmp_path):
+    """Test a scan outlasting the lease keeps other workers from scanning"""
+    client = AsyncMock()
+    client.publish_job = AsyncMock(
+        return_value={"return": [{"jid": "1", "minions": ["web-1"]}]}
+    )
+    client.get_job = AsyncMock(
+        return_value={"info": [{"Result": {"web-1": {"return": {}, "retcode": 0}}}]}
+    )
+    drift_store = DriftStore(tmp_path / "drift.db")
+    scanner = DriftScanner(drift_store, client)
+    other = DriftScanner(drift_store, client)
+    now = datetime.now(tz=UTC)
+
+    with (
+        patch("apps.audit.drift.settings.drift_scan_interval_seconds", 10),
+        patch("apps.audit.drift.settings.job_poll_seconds", 0.001),
+    ):
+        # Taken long enough ago to expire a second from now
+        assert scanner._hold_lease(now - timedelta(seconds=19))
+        await scanner.scan(["web-1"])
+        assert not other._hold_lease(now + timedelta(seconds=5))
+    drift_store.close()
+
+
+def test_drift_endpoint_reads_stored_drift(
+    client: TestClient, api_base_url: str, tmp_path
+):
+    """Test /compliance/drift lists stored drift without scanning"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+    drift_store = DriftStore(tmp_path / "drift.db")
+    drift_store.record(
+        {"web-1": highstate(pending("pkg", "nginx", {"nginx": {"new": "1.18.0"}}))},
+        datetime(2026, 1, 5, 12, tzinfo=UTC),
+    )
+    salt = AsyncMock()
+    scanner = DriftScanner(drift_store, salt)
+
+    with (
+        patch("apps.audit.routes.drift_store", drift_store),
+        patch("apps.audit.routes.drift_scanner", scanner),
+    ):
+        response = client.get(
+            f"{api_base_url}/compliance/drift",
+            params={"minion_id": "web-1"},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert [d["resource_name"] for d in response.json()] == ["nginx"]
+
+        response = client.get(f"{api_base_url}/compliance/drift/scan", headers=headers)
+        assert response.json() == {"running": False, "last_scan": None}
+    assert not salt.mock_calls
+    drift_store.close()
+
+
+def test_plan_remediation_groups_by_failed_sls(store: ComplianceStore):
+    """Test minions failing the same SLS share a group, render errors go full"""
+    store.record(
+        {
+            "web-1": highstate(state("webserver.nginx", "nginx-install", False)),
+            "web-2": highstate(state("webserver.nginx", "nginx-conf", False)),
+            "db-1": highstate(
+                state("base.users", "admin-user", False),
+                state("webserver.nginx", "nginx-install", False),
+            ),
+            "db-2": ["Rendering SLS 'base' failed"],
+            "db-3": highstate(state("base.users", "admin-user", True)),
+        },
+        JID_1,
+    )
+    records, _ = store.list_page(compliant=False)
+    assert plan_remediation(records) == {
+        ("base.users", "webserver.nginx"): ["db-1"],
+        (): ["db-2"],
+        ("webserver.nginx",): ["web-1", "web-2"],
+    }
+
+
+@pytest.mark.asyncio
+async def test_remediator_runs_batches_and_feeds_compliance(store: ComplianceStore):
+    """Test remediation batches per group under the concurrency limit"""
+    fleet = [f"web-{n}" for n in range(5)]
+    store.record(
+        {m: highstate(state("webserver.nginx", "nginx-install", False)) for m in fleet},
+        JID_1,
+    )
+    in_flight = peak = 0
+
+    async def fake_run_target(target: str, **kwargs: Any) -> TargetExecutionResult:
+        nonlocal in_flight, peak
+        assert kwargs["function"] == "state.apply"
+        assert kwargs["args"] == ["webserver.nginx"]
+        assert kwargs["tgt_type"] == "list"
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        fixed = highstate(state("webserver.nginx", "nginx-install", True))
+        return TargetExecutionResult(
+            target=target,
+            tgt_type="list",
+            job_id=f"job-{target}",
+            jid=JID_2,
+            success=True,
+            minions=dict.fromkeys(target.split(","), fixed),
+        )
+
+    jobs = AsyncMock()
+    jobs.run_target = AsyncMock(side_effect=fake_run_target)
+    with (
+        patch("apps.audit.remediation.settings.remediation_batch_size", 2),
+        patch("apps.audit.remediation.settings.remediation_concurrency", 1),
+    ):
+        remediator = Remediator(store, ComplianceEngine(store), jobs)
+        run = await remediator.start(submitted_by="admin")
+    assert (run.status, run.minions, run.groups, run.batches) == ("running", 5, 1, 3)
+
+    await asyncio.gather(*remediator._tasks)
+    run = store.get_remediation(run.id)
+    assert run is not None
+    assert (run.status, run.completed_batches, run.remediated) == ("succeeded", 3, 5)
+    assert len(run.job_ids) == 3
+    assert peak == 1
+    assert store.status().compliance_percentage == 100.0
+
+
+def test_remediate_endpoint(
+    client: TestClient, api_base_url: str, store: ComplianceStore
+):
+    """Test remediating one minion starts a tracked remediation"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+    store.record(
+        {
+            "web-1": highstate(state("webserver.nginx", "nginx-install", False)),
+            "web-2": highstate(state("base.users", "admin-user", True)),
+        },
+        JID_1,
+    )
+    jobs = AsyncMock()
+    jobs.run_target = AsyncMock(
+        return_value=TargetExecutionResult(
+            target="web-1", success=False, error="Salt API unavailable"
+        )
+    )
+    remediator = Remediator(store, ComplianceEngine(store), jobs)
+
+    with (
+        patch("apps.audit.routes.compliance_store", store),
+        patch("apps.audit.routes.remediator", remediator),
+    ):
+        response = client.post(
+            f"{api_base_url}/compliance/remediate/web-2", headers=headers
+        )
+        assert response.json()["message"] == "Minion is already compliant"
+
+        response = client.post(
+            f"{api_base_url}/compliance/remediate/web-1", headers=headers
+        )
+        assert response.status_code == 200
+        body = response.json()
+        assert body["action"] == "state.apply webserver.nginx"
+
+        response = client.get(
+            f"{api_base_url}/compliance/remediations/{body['remediation_id']}",
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert response.json()["minions"] == 1
+
+        response = client.get(
+            f"{api_base_url}/compliance/remediations/missing", headers=headers
+        )
+        assert response.status_code == 404
+
+
+def test_remediate_endpoint_requires_operator(client: TestClient, api_base_url: str):
+    """Test a viewer cannot start a remediation"""
+    viewer = fake_users_db["admin"].model_copy(
+        update={"id": "2", "username": "viewer", "role": "viewer"}
+    )
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'viewer'})}"}
+    remediator = AsyncMock()
+
+    with (
+        patch.dict(fake_users_db, {"viewer": viewer}),
+        patch("apps.audit.routes.remediator", remediator),
+    ):
+        users_changed()
+        response = client.post(
+            f"{api_base_url}/compliance/remediate/web-1", headers=headers
+        )
+    users_changed()
+
+    assert response.status_code == 403
+    remediator.start.assert_not_awaited()
+
+
+def test_failure_index_follows_records(store: ComplianceStore):
+    """Test the failed-state index, counts and reason clusters stay in sync"""
+    store.record(
+        {
+            "web-1": highstate(
+                state("webserver.nginx", "nginx-install", False, "Package 'a' missing"),
+                state("base.motd", "motd", False, "Template /srv/motd.j2 failed"),
+            ),
+            "web-2": highstate(
+                state("webserver.nginx", "nginx-install", False, "Package 'b' missing")
+            ),
+        },
+        JID_1,
+    )
+    store.record(
+        {"web-3": highstate(state("webserver.nginx", "nginx-install", False))}, JID_2
+    )
+
+    top, _ = store.top_failing_states()
+    assert [(s.state_id, s.minions) for s in top] == [("nginx-install", 3), ("motd", 1)]
+    failing, _ = store.list_failures(state_id="nginx-install")
+    assert [f.minion_id for f in failing] == ["web-3", "web-2", "web-1"]
+    clusters, _ = store.failure_clusters()
+    assert [(c.pattern, c.failures) for c in clusters][0] == (
+        "Package '*' missing",
+        2,
+    )
+    new, _ = store.list_failures(since=datetime(2026, 1, 5, 13, tzinfo=UTC))
+    assert [f.minion_id for f in new] == ["web-3"]
+
+    # web-1 recovers from nginx-install; its motd reason changes
+    store.record(
+        {
+            "web-1": highstate(
+                state("webserver.nginx", "nginx-install", True),
+                state("base.motd", "motd", False, "Template /srv/motd.j3 failed"),
+            )
+        },
+        JID_3,
+    )
+    top, _ = store.top_failing_states()
+    assert [(s.state_id, s.minions) for s in top] == [("nginx-install", 2), ("motd", 1)]
+    motd, _ = store.list_failures(state_name="base.motd")
+    assert motd[0].failed_at == "2026-01-05T12:00:00+00:00"
+    assert motd[0].reason == "Template /srv/motd.j3 failed"
+    assert {c.pattern: c.failures for c in store.failure_clusters()[0]} == {
+        "Package '*' missing": 1,
+        "": 1,
+        "Template <path> failed": 1,
+    }
+
+
+def test_failure_index_pages_and_rebuilds(tmp_path):
+    """Test keyset pages of the index and indexing of older records"""
+    store = ComplianceStore(tmp_path / "compliance.db")
+    store.record(
+        {
+            f"web-{n}": highstate(state("webserver.nginx", "nginx-install", False))
+            for n in range(5)
+        },
+        JID_1,
+    )
+    seen: list[str] = []
+    cursor = None
+    while True:
+        page, cursor = store.list_failures(cursor=cursor, limit=2)
+        seen.extend(f.minion_id for f in page)
+        if cursor is None:
+            break
+    assert seen == [f"web-{n}" for n in reversed(range(5))]
+
+    with store.conn:
+        store.conn.execute("DELETE FROM failed_states")
+    store.close()
+    store = ComplianceStore(tmp_path / "compliance.db")
+    assert len(store.list_failures()[0]) == 5
+    store.close()
+
+
+def test_failed_state_endpoints(
+    client: TestClient, api_base_url: str, store: ComplianceStore
+):
+    """Test the failed-state listing, top states and reason endpoints"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+    store.record(
+        {
+            f"web-{n}": highstate(state("webserver.nginx", "nginx-install", False))
+            for n in range(3)
+        },
+        JID_1,
+    )
+
+    with patch("apps.audit.routes.compliance_store", store):
+        response = client.get(
+            f"{api_base_url}/compliance/failed-states",
+            params={"state_id": "nginx-install", "limit": 2},
+            headers=headers,
+        )
+        assert len(response.json()) == 2
+        response = client.get(
+            f"{api_base_url}/compliance/failed-states",
+            params={
+                "state_id": "nginx-install",
+                "cursor": response.headers["X-Next-Cursor"],
+            },
+            headers=headers,
+        )
+        assert [f["minion_id"] for f in response.json()] == ["web-0"]
+
+        response = client.get(
+            f"{api_base_url}/compliance/failed-states/top", headers=headers
+        )
+        assert response.json() == [
+            {"state_name": "webserver.nginx", "state_id": "nginx-install", "minions": 3}
+        ]
+        response = client.get(
+            f"{api_base_url}/compliance/failed-states/reasons", headers=headers
+        )
+        assert response.json()[0]["failures"] == 3
+
+        response = client.get(
+            f"{api_base_url}/compliance/failed-states",
+            params={"cursor": "bogus"},
+            headers=headers,
+        )
+        assert response.status_code == 400
+
+
+def test_history_downsamples_and_prunes(store: ComplianceStore):
+    """Test snapshots land in raw, hour and day series with their retention"""
+    start = datetime(2026, 1, 1, 10, tzinfo=UTC)
+    with transaction(store.conn) as conn:
+        append_snapshot(conn, "", 4, 2, start)
+        append_snapshot(conn, "", 4, 1, start + timedelta(minutes=20))
+        append_snapshot(conn, "", 4, 3, start + timedelta(minutes=40))
+        append_snapshot(conn, "", 4, 4, start + timedelta(hours=1))
+    until = start + timedelta(days=1)
+
+    assert len(store.history(None, "raw", start, until, 100)) == 4
+    hours = store.history(None, "hour", start, until, 100)
+    assert [(h["compliant"], h["low"], h["high"]) for h in hours] == [
+        (3, 25.0, 75.0),
+        (4, 100.0, 100.0),
+    ]
+    (day,) = store.history(None, "day", start, until, 100)
+    assert (day["compliant"], day["low"], day["high"]) == (4, 25.0, 100.0)
+
+    assert store.prune_history(start + timedelta(days=30)) == 4
+    assert store.history(None, "raw", start, until, 100) == []
+    assert len(store.history(None, "hour", start, until, 100)) == 2
+    store.prune_history(start + timedelta(days=365))
+    assert store.history(None, "hour", start, until, 100) == []
+    assert len(store.history(None, "day", start, until, 100)) == 1
+    with pytest.raises(ValueError, match="Unknown granularity"):
+        store.history(None, "week", start, until, 100)
+
+
+def test_nodegroup_counters_and_history(store: ComplianceStore):
+    """Test nodegroup counters follow records and membership changes"""
+    store.record(
+        {
+            "web-1": highstate(state("webserver.nginx", "nginx-install", False)),
+            "web-2": highstate(state("base.users", "admin-user", True)),
+            "db-1": highstate(state("base.users", "admin-user", True)),
+        },
+        JID_1,
+    )
+    store.set_nodegroups({"web": ["web-1", "web-2", "web-3"], "db": ["db-1"]})
+    assert [
+        (n.nodegroup, n.total_minions, n.compliant_minions)
+        for n in store.nodegroup_status()
+    ] == [("db", 1, 1), ("web", 2, 1)]
+
+    store.record(
+        {"web-1": highstate(state("webserver.nginx", "nginx-install", True))}, JID_2
+    )
+    web = {n.nodegroup: n for n in store.nodegroup_status()}["web"]
+    assert web.compliance_percentage == 100.0
+
+    since = datetime(2026, 1, 1, tzinfo=UTC)
+    until = datetime.now(tz=UTC) + timedelta(minutes=1)
+    (point,) = store.history("web", "hour", since, until, 100)
+    assert (point["compliant"], point["low"], point["high"]) == (2, 50.0, 100.0)
+    (point,) = store.history(None, "day", since, until, 100)
+    assert (point["total"], point["compliant"]) == (3, 3)
+
+
+@pytest.mark.asyncio
+async def test_collector_resolves_nodegroups_from_cache(store: ComplianceStore):
+    """Test nodegroup members are read from the master's grains cache"""
+    client = AsyncMock()
+    client.list_nodegroups = AsyncMock(
+        return_value={"return": [{"web": "G@role:web", "db": "L@db-1"}]}
+    )
+    members = {"web": {"web-1": {}, "web-2": {}}, "db": {"db-1": {}}}
+    client.run_salt_runner = AsyncMock(
+        side_effect=lambda runner, args: {
+            "return": [members[args[0].removeprefix("tgt=")]]
+        }
+    )
+    store.record({"web-1": highstate(), "db-1": ["render failed"]}, JID_1)
+    collector = ComplianceCollector(ComplianceEngine(store), client)
+
+    assert await collector.refresh_nodegroups() == 2
+    assert client.run_salt_runner.await_args_list[0].args == (
+        "cache.grains",
+        ["tgt=db", "tgt_type=nodegroup"],
+    )
+    assert [
+        (n.nodegroup, n.total_minions, n.compliant_minions)
+        for n in store.nodegroup_status()
+    ] == [("db", 1, 0), ("web", 1, 1)]
+
+
+def test_compliance_trend_endpoint(
+    client: TestClient, api_base_url: str, store: ComplianceStore
+):
+    """Test the trend endpoint reads the downsampled series"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+    with transaction(store.conn) as conn:
+        append_snapshot(conn, "web", 10, 5, datetime(2026, 1, 1, tzinfo=UTC))
+        append_snapshot(conn, "web", 10, 9, datetime(2026, 1, 2, tzinfo=UTC))
+
+    with patch("apps.audit.routes.compliance_store", store):
+        response = client.get(
+            f"{api_base_url}/compliance/trend",
+            params={
+                "nodegroup": "web",
+                "granularity": "day",
+                "since": "2026-01-01T00:00:00Z",
+                "until": "2026-01-03T00:00:00Z",
+            },
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert [p["compliance_percentage"] for p in response.json()["points"]] == [
+            50.0,
+            90.0,
+        ]
+
+        response = client.get(
+            f"{api_base_url}/compliance/trend",
+            params={"granularity": "week"},
+            headers=headers,
+        )
+        assert response.status_code == 400
@@ -0,0 +1,134 @@
+"""Tests for the fleet-wide schedule and beacon inventory"""
+
+from datetime import UTC, datetime
+from typing import Any
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apps.auth.routes import create_access_token
+from apps.salt.inventory import (
+    InventoryCollector,
+    InventoryStore,
+    definition_hash,
+    normalize_definitions,
+)
+
+BACKUP = {"function": "cmd.run", "seconds": 86400, "args": ["backup.sh"]}
+
+
+def schedule_return(**overrides: Any) -> dict[str, Any]:
+    """A raw ``schedule.list`` return with runtime bookkeeping keys"""
+    backup = {**BACKUP, "_next_fire_time": "2026-01-05T12:00:00", **overrides}
+    return {"enabled": True, "backup": backup, "ping": {"function": "test.ping"}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Fresh inventory store"""
+    store = InventoryStore(tmp_path / "inventory.db")
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def collector(store):
+    """Collector for a fleet of four minions answering in batches"""
+    fleet = {
+        "web-1": schedule_return(),
+        "web-2": schedule_return(),
+        "db-1": schedule_return(seconds=3600),
+        "db-2": {"enabled": True, "ping": {"function": "test.ping"}},
+    }
+
+    async def fake_publish(target: str, *args: Any) -> dict[str, Any]:
+        jids[args[-1]] = target.split(",")
+        return {"return": [{"jid": args[-1], "minions": jids[args[-1]]}]}
+
+    async def fake_get_job(jid: str) -> dict[str, Any]:
+        result = {m: {"return": fleet[m], "retcode": 0} for m in jids[jid]}
+        return {"info": [{"Result": result}]}
+
+    jids: dict[str, list[str]] = {}
+
+    client = AsyncMock()
+    client.list_keys = AsyncMock(
+        return_value={
+            "return": [{"data": {"return": {"minions": sorted(fleet)}}}],
+        }
+    )
+    client.publish_job = AsyncMock(side_effect=fake_publish)
+    client.get_job = AsyncMock(side_effect=fake_get_job)
+    with patch("apps.salt.inventory.settings.job_poll_seconds", 0.001):
+        yield InventoryCollector(store, client)
+
+
+def test_normalize_definitions_drops_bookkeeping():
+    """Test runtime keys do not change a definition's hash"""
+    normalized = normalize_definitions(schedule_return())
+    assert set(normalized) == {"backup", "ping"}
+    assert definition_hash(normalized["backup"]) == definition_hash(BACKUP)
+
+
+@pytest.mark.asyncio
+async def test_collect_in_batches(collector: InventoryCollector):
+    """Test collection splits the fleet into batches"""
+    with patch("apps.salt.inventory.settings.inventory_batch_size", 3):
+        collected = await collector.collect(kinds=["schedule"])
+
+    assert collected == {"schedule": 4}
+    assert collector.client.publish_job.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_inventory_queries(collector: InventoryCollector, store: InventoryStore):
+    """Test have/missing/variants answers"""
+    await collector.collect(kinds=["schedule"])
+
+    assert store.minions_with("schedule", "backup") == ["db-1", "web-1", "web-2"]
+    assert store.minions_missing("schedule", "backup") == ["db-2"]
+
+    variants = store.variants("schedule", "backup")
+    assert [v.minions for v in variants] == [2, 1]
+    assert variants[1].definition["seconds"] == 3600
+    assert store.minions_with("schedule", "backup", variant=variants[1].hash) == [
+        "db-1"
+    ]
+
+    summary = {s.name: s for s in store.summary("schedule")}
+    assert summary["backup"].missing == 1
+    assert summary["backup"].variants == 2
+    assert summary["ping"].minions == 4
+
+
+@pytest.mark.asyncio
+async def test_recollection_replaces_and_forgets(
+    collector: InventoryCollector, store: InventoryStore
+):
+    """Test re-collection replaces definitions and drops removed minions"""
+    await collector.collect(kinds=["schedule"])
+    await collector.collect(kinds=["schedule"], minion_ids=["web-1", "db-2"])
+
+    assert store.minion_count("schedule") == 2
+    assert store.minions_with("schedule", "backup") == ["web-1"]
+
+
+def test_inventory_endpoints(client: TestClient, api_base_url: str, store):
+    """Test inventory endpoints read from the store"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+    store.record(
+        "beacon",
+        {"web-1": {"diskusage": [{"/": "90%"}]}, "web-2": {}},
+        collected_at=datetime.now(tz=UTC),
+    )
+
+    with patch("apps.salt.routes.inventory_store", store):
+        response = client.get(
+            f"{api_base_url}/inventory/beacons/diskusage/missing", headers=headers
+        )
+        assert response.status_code == 200
+        assert response.json()["minions"] == ["web-2"]
+
+        response = client.get(f"{api_base_url}/inventory/grains", headers=headers)
+        assert response.status_code == 404
@@ -0,0 +1,266 @@
+"""Tests for tracked jobs and job cancellation"""
+
+import asyncio
+import time
+from datetime import UTC, datetime, timedelta
+from typing import Any
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apps.auth.routes import create_access_token
+from apps.salt.job_engine import (
+    JobEngine,
+    JobNotCancellableError,
+    generate_jid,
+    jid_time,
+)
+from apps.salt.job_store import JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Fresh job store"""
+    store = JobStore(tmp_path / "jobs.db")
+    yield store
+    store.close()
+
+
+@pytest.fixture(autouse=True)
+def fast_polling():
+    """Poll the job cache without waiting"""
+    with patch("apps.salt.job_engine.settings.job_poll_seconds", 0.001):
+        yield
+
+
+def published(jid: str, *minions: str) -> dict[str, Any]:
+    """Build a salt-api ``local_async`` response"""
+    return {"return": [{"jid": jid, "minions": list(minions)}]}
+
+
+def cached(**retcodes: int) -> dict[str, Any]:
+    """Build a ``/jobs/<jid>`` response holding the returns of some minions"""
+    result = {m: {"return": True, "retcode": rc} for m, rc in retcodes.items()}
+    return {"info": [{"Result": result}]}
+
+
+def test_generate_jid_is_unique_and_salt_formatted():
+    """Test jids are 20 digits and never repeat"""
+    jids = [generate_jid() for _ in range(1000)]
+    assert len(set(jids)) == 1000
+    assert all(len(j) == 20 and j.isdigit() for j in jids)
+
+
+def test_jids_are_in_local_time_like_the_masters(monkeypatch):
+    """Test jids are built and read in local time unless salt_utc_jid is set"""
+    monkeypatch.setenv("TZ", "JST-9")
+    monkeypatch.setattr("apps.salt.job_engine._last_jid", "")
+    time.tzset()
+    try:
+        now = datetime.now(tz=UTC)
+        issued = datetime(2026, 1, 5, 12, tzinfo=UTC)
+        with patch("apps.salt.job_engine.settings.salt_utc_jid", True):
+            jid = generate_jid()
+            assert jid.startswith(now.strftime("%Y%m%d"))
+            assert abs(jid_time(jid) - now) < timedelta(seconds=5)
+            assert jid_time("20260105120000000000") == issued
+
+        jid = generate_jid()
+        assert jid.startswith(now.astimezone().strftime("%Y%m%d%H"))
+        assert abs(jid_time(jid) - now) < timedelta(seconds=5)
+        assert jid_time("20260105210000000000") == issued
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+
+@pytest.mark.asyncio
+async def test_runs_are_tracked(store: JobStore):
+    """Test runs move from queued through running to succeeded"""
+    client = AsyncMock()
+    client.publish_job = AsyncMock(
+        side_effect=lambda target, fun, args, kwargs, tgt_type, jid: published(
+            jid, target
+        )
+    )
+    client.get_job = AsyncMock(return_value=cached(**{"web-1": 0}))
+    engine = JobEngine(client, store=store)
+
+    results = await engine.run_targets(["web-1"], "test.ping", submitted_by="admin")
+
+    job = store.get(results[0].job_id)
+    assert job.status == "succeeded"
+    assert job.jid == results[0].jid == client.publish_job.call_args.args[5]
+    assert client.publish_job.call_args.args[:2] == ("web-1", "test.ping")
+    assert job.submitted_by == "admin"
+
+
+@pytest.mark.asyncio
+async def test_cancel_queued_job_never_publishes(store: JobStore):
+    """Test a job waiting for a slot is cancelled without reaching Salt"""
+    release = asyncio.Event()
+
+    async def slow_publish(target: str, *args: Any) -> dict[str, Any]:
+        await release.wait()
+        return published(args[-1], target)
+
+    client = AsyncMock()
+    client.publish_job = AsyncMock(side_effect=slow_publish)
+    client.get_job = AsyncMock(return_value=cached(**{"web-1": 0}))
+    engine = JobEngine(client, max_concurrency=1, store=store)
+
+    task = asyncio.create_task(engine.run_targets(["web-1", "web-2"], "test.ping"))
+    while not client.publish_job.await_count:
+        await asyncio.sleep(0)
+    queued = store.list_jobs(status="queued")
+    assert [j.target for j in queued] == ["web-2"]
+
+    result = await engine.cancel(queued[0].id, cancelled_by="admin")
+    assert result.job.status == "cancelled"
+
+    release.set()
+    results = await task
+    assert results[1].success is False
+    assert client.publish_job.await_count == 1
+
+    with pytest.raises(JobNotCancellableError):
+        await engine.cancel(results[0].job_id)
+
+
+@pytest.mark.asyncio
+async def test_cancel_running_job_signals_in_batches(store: JobStore):
+    """Test only minions still running the jid are signalled, in batches"""
+    job_id = store.enqueue("state.highstate", "web*")
+    store.start(job_id, "20260105120000000000")
+
+    client = AsyncMock()
+    client.find_job = AsyncMock(
+        return_value={
+            "return": [
+                {"web-1": {"jid": "x", "pid": 1}, "web-2": {}, "web-3": {"pid": 2}}
+            ]
+        }
+    )
+    client.signal_job = AsyncMock(
+        side_effect=lambda target, jid, signal, tgt_type: {
+            "return": [dict.fromkeys(target.split(","), "Signal 9 sent")]
+        }
+    )
+    engine = JobEngine(client, store=store)
+
+    with patch("apps.salt.job_engine.settings.job_cancel_batch_size", 1):
+        result = await engine.cancel(job_id, signal="kill", cancelled_by="admin")
+
+    assert result.signalled == ["web-1", "web-3"]
+    assert client.signal_job.await_count == 2
+    assert client.signal_job.call_args.args[2] == "kill"
+    assert result.job.status == "cancelled"
+    assert result.job.cancelled_minions == ["web-1", "web-3"]
+
+
+@pytest.mark.asyncio
+async def test_long_job_is_left_running(store: JobStore):
+    """Test a job outliving the timeout stays running and cancellable"""
+    client = AsyncMock()
+    client.publish_job = AsyncMock(
+        side_effect=lambda *args: published(args[-1], "web-1", "web-2")
+    )
+    client.get_job = AsyncMock(return_value=cached(**{"web-1": 0}))
+    client.find_job = AsyncMock(return_value={"return": [{"web-2": {"pid": 7}}]})
+    client.signal_job = AsyncMock(return_value={"return": [{"web-2": "Signal sent"}]})
+    engine = JobEngine(client, store=store)
+
+    with patch("apps.salt.job_engine.settings.job_find_seconds", 0):
+        result = await engine.run_target("web*", "state.highstate", timeout=0.05)
+
+    assert result.success is False
+    assert result.running == ["web-2"]
+    assert result.minions == {"web-1": True}
+    assert store.get(result.job_id).status == "running"
+
+    cancelled = await engine.cancel(result.job_id, cancelled_by="admin")
+    assert cancelled.signalled == ["web-2"]
+    assert cancelled.job.status == "cancelled"
+
+
+@pytest.mark.asyncio
+async def test_lost_minion_fails_the_job(store: JobStore):
+    """Test a minion that stops running the job without returning is lost"""
+    client = AsyncMock()
+    client.publish_job = AsyncMock(
+        side_effect=lambda *args: published(args[-1], "web-1", "web-2")
+    )
+    client.get_job = AsyncMock(return_value=cached(**{"web-1": 0}))
+    client.find_job = AsyncMock(return_value={"return": [{"web-2": {}}]})
+    engine = JobEngine(client, store=store)
+
+    with patch("apps.salt.job_engine.settings.job_find_seconds", 0):
+        result = await engine.run_target("web*", "state.highstate")
+
+    assert result.success is False
+    assert result.running == []
+    assert result.retcodes == {"web-1": 0, "web-2": 1}
+    assert result.lost == ["web-2"]
+    assert store.get(result.job_id).status == "failed"
+
+
+@pytest.mark.asyncio
+async def test_cancel_with_nothing_running_keeps_job(store: JobStore):
+    """Test a job is only marked cancelled once a minion was signalled"""
+    job_id = store.enqueue("state.highstate", "web*")
+    store.start(job_id, "20260105120000000000")
+
+    client = AsyncMock()
+    client.find_job = AsyncMock(return_value={"return": [{"web-1": {}}]})
+    engine = JobEngine(client, store=store)
+
+    with pytest.raises(JobNotCancellableError):
+        await engine.cancel(job_id, cancelled_by="admin")
+
+    job = store.get(job_id)
+    assert job.status == "running"
+    assert job.cancelled_by is None
+    client.signal_job.assert_not_called()
+
+
+def test_cancel_job_by_jid_api(client: TestClient, api_base_url: str, store):
+    """Test cancelling an external jid through the API"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+    salt = AsyncMock()
+    salt.get_job = AsyncMock(return_value={"info": [{"Minions": ["db-1"]}]})
+    salt.find_job = AsyncMock(return_value={"return": [{"db-1": {"pid": 3}}]})
+    salt.signal_job = AsyncMock(return_value={"return": [{"db-1": "Signal sent"}]})
+    engine = JobEngine(salt, store=store)
+
+    with (
+        patch("apps.salt.routes.job_engine", engine),
+        patch("apps.salt.routes.job_store", store),
+    ):
+        response = client.post(
+            f"{api_base_url}/jobs/20260105120000000001/cancel",
+            json={"signal": "term"},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert response.json()["signalled"] == ["db-1"]
+        assert salt.find_job.call_args.kwargs["tgt_type"] == "list"
+
+        response = client.get(
+            f"{api_base_url}/tracked-jobs",
+            params={"status": "cancelled"},
+            headers=headers,
+        )
+        assert [j["jid"] for j in response.json()] == ["20260105120000000001"]
+
+
+def test_tracked_jobs_cursor(store: JobStore):
+    """Test tracked jobs page by cursor, newest first"""
+    for n in range(5):
+        store.enqueue("test.ping", f"web-{n}")
+
+    first, cursor = store.list_page(limit=3)
+    assert [j.target for j in first] == ["web-4", "web-3", "web-2"]
+    second, cursor = store.list_page(cursor=cursor, limit=3)
+    assert [j.target for j in second] == ["web-1", "web-0"]
+    assert cursor is None
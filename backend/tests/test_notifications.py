@@ -0,0 +1,531 @@
+"""Tests for the notification store and endpoints"""
+
+import asyncio
+import time
+from datetime import UTC, datetime
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apps.audit.mailer import Mailer, OutboxStore
+from apps.audit.notifications import NotificationStore
+from apps.audit.pipeline import NotificationPipeline
+from apps.audit.push import NotificationHub, format_events
+from apps.audit.routes import create_notification
+from apps.audit.schemas import Notification, NotificationSettings, NotificationUpdate
+from apps.auth.routes import create_access_token
+
+
+@pytest.fixture
+def auth_headers() -> dict[str, str]:
+    """Authorization headers for the admin user"""
+    token = create_access_token({"sub": "admin"})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Use a fresh notification store"""
+    store = NotificationStore(tmp_path / "notifications.db")
+    with (
+        patch("apps.audit.routes.notification_store", store),
+        patch("apps.audit.routes.notification_hub", NotificationHub(store)),
+    ):
+        yield store
+    store.close()
+
+
+@pytest.fixture
+def mailer(tmp_path, store: NotificationStore):
+    """Use a fresh mailer with its own outbox"""
+    outbox = OutboxStore(tmp_path / "mail.db")
+    mailer = Mailer(outbox, store)
+    with patch("apps.audit.routes.mailer", mailer):
+        yield mailer
+    mailer.pool.close()
+    outbox.close()
+
+
+def test_unread_counter_follows_marks_and_deletes(store: NotificationStore):
+    """Test the unread counter through mark, mark-all and delete"""
+    ids = [
+        store.create("admin", "job_failed", f"Job {n}", "failed").id for n in range(4)
+    ]
+    store.create("operator", "job_failed", "Other", "failed")
+    assert store.unread_count("admin") == 4
+
+    assert store.mark_read("admin", [ids[0], ids[0], "bogus"]) == 1
+    assert store.mark_read("operator", [ids[1]]) == 0
+    assert store.unread_count("admin") == 3
+
+    assert store.mark_all_read("admin") == 3
+    assert store.unread_count("admin") == 0
+    assert store.unread_count("operator") == 1
+    page, _ = store.list_page("admin")
+    assert all(n.is_read for n in page)
+
+    # Newer notifications are unread again; deletes adjust the counter
+    newer = store.create("admin", "job_completed", "Job 5", "done")
+    assert [n.id for n in store.list_page("admin", unread_only=True)[0]] == [newer.id]
+    assert store.delete("admin", ids[2])
+    assert store.unread_count("admin") == 1
+    assert store.delete("admin", newer.id)
+    assert not store.delete("admin", newer.id)
+    assert store.unread_count("admin") == 0
+
+
+def test_list_pages_per_user_and_persists(tmp_path):
+    """Test keyset pages newest first, isolated per user, across reopen"""
+    store = NotificationStore(tmp_path / "notifications.db")
+    for n in range(5):
+        store.create("admin", "job_completed", f"Job {n}", "done")
+        store.create("operator", "job_completed", f"Job {n}", "done")
+    store.close()
+
+    store = NotificationStore(tmp_path / "notifications.db")
+    titles: list[str] = []
+    cursor = None
+    while True:
+        page, cursor = store.list_page("admin", cursor=cursor, limit=2)
+        assert all(n.user == "admin" for n in page)
+        titles.extend(n.title for n in page)
+        if cursor is None:
+            break
+    assert titles == [f"Job {n}" for n in reversed(range(5))]
+    assert store.unread_count("admin") == 5
+
+    store.save_settings(NotificationSettings(user="admin", email_enabled=True))
+    settings = store.get_settings("admin")
+    assert settings is not None
+    assert settings.email_enabled
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_create_notification_uses_pipeline(
+    store: NotificationStore, mailer: Mailer
+):
+    """Test the internal helper goes through the pipeline"""
+    pipeline = NotificationPipeline(store, NotificationHub(store), mailer)
+    with patch("apps.audit.routes.notification_pipeline", pipeline):
+        for _ in range(2):
+            assert await create_notification(
+                "admin",
+                "minion_down",
+                "Minion down",
+                "web-1 stopped responding",
+                "high",
+                key="web-1",
+            ) == (_ == 0)
+
+    (notification,), _ = store.list_page("admin")
+    assert (notification.title, notification.priority) == ("Minion down", "high")
+    assert pipeline.status().deduplicated == 1
+
+
+def test_notification_endpoints(
+    client: TestClient,
+    api_base_url: str,
+    auth_headers: dict[str, str],
+    store: NotificationStore,
+):
+    """Test listing, counting, marking and deleting over the API"""
+    ids = [
+        store.create("admin", "job_failed", f"Job {n}", "failed").id for n in range(3)
+    ]
+
+    response = client.get(
+        f"{api_base_url}/notifications", params={"limit": 2}, headers=auth_headers
+    )
+    assert [n["id"] for n in response.json()] == [ids[2], ids[1]]
+    response = client.get(
+        f"{api_base_url}/notifications",
+        params={"cursor": response.headers["X-Next-Cursor"]},
+        headers=auth_headers,
+    )
+    assert [n["id"] for n in response.json()] == [ids[0]]
+
+    response = client.post(
+        f"{api_base_url}/notifications/mark-read", json=[ids[0]], headers=auth_headers
+    )
+    assert response.json() == {"message": "Marked 1 notifications as read"}
+    response = client.get(
+        f"{api_base_url}/notifications/unread-count", headers=auth_headers
+    )
+    assert response.json() == {"count": 2}
+
+    response = client.delete(
+        f"{api_base_url}/notifications/{ids[1]}", headers=auth_headers
+    )
+    assert response.status_code == 200
+    response = client.delete(
+        f"{api_base_url}/notifications/{ids[1]}", headers=auth_headers
+    )
+    assert response.status_code == 404
+
+    response = client.get(
+        f"{api_base_url}/notifications",
+        params={"cursor": "bogus"},
+        headers=auth_headers,
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_hub_pushes_new_notifications_and_counts(store: NotificationStore):
+    """Test resume after last_id, wake-ups on publish and count-only updates"""
+    hub = NotificationHub(store)
+    missed = store.create("admin", "job_failed", "Missed", "failed")
+    updates = hub.updates("admin", last_id=0, keepalive=0.05)
+
+    update = await anext(updates)
+    assert update is not None
+    assert ([n.id for n in update.notifications], update.unread) == ([missed.id], 1)
+    assert await anext(updates) is None
+
+    pending = asyncio.ensure_future(anext(updates))
+    await asyncio.sleep(0)
+    new = store.create("admin", "job_completed", "New", "done")
+    hub.publish("admin")
+    update = await pending
+    assert update is not None
+    assert ([n.id for n in update.notifications], update.unread) == ([new.id], 2)
+
+    # Reading elsewhere only changes the count
+    store.mark_read("admin", [missed.id])
+    hub.publish("admin")
+    update = await anext(updates)
+    assert update is not None
+    assert (update.notifications, update.unread) == ([], 1)
+    await updates.aclose()
+    assert hub.sessions() == 0
+
+
+@pytest.mark.asyncio
+async def test_hub_wakes_sessions_for_other_workers(tmp_path, store: NotificationStore):
+    """Test writes through another connection wake only that user's sessions"""
+    hub = NotificationHub(store)
+    hub.check()
+    other_worker = NotificationStore(tmp_path / "notifications.db")
+    woken: list[str] = []
+    with hub.subscribe("admin") as admin, hub.subscribe("operator") as operator:
+        other_worker.create("admin", "job_failed", "Job", "failed")
+        hub.check()
+        woken = [
+            user
+            for user, event in (("admin", admin), ("operator", operator))
+            if event.is_set()
+        ]
+    assert woken == ["admin"]
+    other_worker.close()
+
+
+def test_format_events():
+    """Test notifications carry their id as the SSE event id"""
+    notification = Notification(
+        id="7",
+        user="admin",
+        type="job_failed",
+        title="Job",
+        message="failed",
+        created_at=datetime(2026, 1, 5, tzinfo=UTC),
+    )
+    events = format_events(
+        NotificationUpdate(notifications=[notification], unread=3, last_id=7)
+    )
+    assert events.startswith("id: 7\nevent: notification\ndata: {")
+    assert events.endswith('event: count\ndata: {"unread": 3, "last_id": 7}\n\n')
+    assert format_events(None) == ": keepalive\n\n"
+
+
+def test_long_poll_endpoint(
+    client: TestClient,
+    api_base_url: str,
+    auth_headers: dict[str, str],
+    store: NotificationStore,
+):
+    """Test long-poll returns the current state, then only what is newer"""
+    first = store.create("admin", "job_failed", "Job 1", "failed")
+
+    response = client.get(f"{api_base_url}/notifications/poll", headers=auth_headers)
+    assert response.json() == {
+        "notifications": [],
+        "unread": 1,
+        "last_id": int(first.id),
+    }
+
+    params = {"last_id": first.id, "unread": 1, "timeout": 0.05}
+    response = client.get(
+        f"{api_base_url}/notifications/poll", params=params, headers=auth_headers
+    )
+    assert response.json()["notifications"] == []
+
+    second = store.create("admin", "job_failed", "Job 2", "failed")
+    response = client.get(
+        f"{api_base_url}/notifications/poll", params=params, headers=auth_headers
+    )
+    body = response.json()
+    assert [n["id"] for n in body["notifications"]] == [second.id]
+    assert (body["unread"], body["last_id"]) == (2, int(second.id))
+
+    # A timed-out poll hands back the client's own last_id, even 0
+    params = {"last_id": 0, "unread": 2, "count_only": True, "timeout": 0.05}
+    response = client.get(
+        f"{api_base_url}/notifications/poll", params=params, headers=auth_headers
+    )
+    assert response.json() == {"notifications": [], "unread": 2, "last_id": 0}
+
+
+@pytest.mark.asyncio
+async def test_pipeline_groups_and_deduplicates_a_storm(
+    store: NotificationStore, mailer: Mailer
+):
+    """Test a storm of minion-down events is written as first, critical and summary"""
+    pipeline = NotificationPipeline(store, NotificationHub(store), mailer)
+    with patch("apps.audit.pipeline.settings.notification_group_sample", 3):
+        for n in range(2000):
+            await pipeline.notify(
+                "admin",
+                "minion_down",
+                "Minion down",
+                f"web-{n % 1982} stopped responding",
+                priority="critical" if n == 7 else "high",
+                key=f"web-{n % 1982}",
+                now=0.0,
+            )
+        # The first and the critical event are not held
+        assert [n.message for n in store.list_page("admin")[0]] == [
+            "web-7 stopped responding",
+            "web-0 stopped responding",
+        ]
+        assert await pipeline.flush(now=1.0) == 0
+        assert await pipeline.flush(now=60.0) == 1
+
+    summary = store.list_page("admin")[0][0]
+    assert summary.title == "1,980 minions down"
+    assert summary.message == "web-1, web-2, web-3 and 1,977 more"
+    assert summary.priority == "high"
+    assert summary.data == {"count": 1980, "keys": ["web-1", "web-2", "web-3"]}
+    status = pipeline.status()
+    assert (status.deduplicated, status.grouped, status.pending_groups) == (
+        18,
+        1980,
+        0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_pipeline_rate_limits_into_a_digest(
+    store: NotificationStore, mailer: Mailer
+):
+    """Test notifications over the rate limit are folded into one digest"""
+    pipeline = NotificationPipeline(store, NotificationHub(store), mailer)
+    with (
+        patch("apps.audit.pipeline.settings.notification_rate_burst", 2),
+        patch("apps.audit.pipeline.settings.notification_rate_per_minute", 0.0),
+        patch("apps.audit.pipeline.settings.notification_group_window_seconds", 0),
+        patch("apps.audit.pipeline.settings.notification_digest_seconds", 60),
+    ):
+        for n in range(5):
+            await pipeline.notify(
+                "admin", "job_failed", f"Job {n} failed", "failed", now=float(n)
+            )
+            await pipeline.flush(now=float(n))
+        assert pipeline.status().digesting_users == 1
+        assert await pipeline.flush(now=70.0) == 1
+
+    titles = [n.title for n in store.list_page("admin")[0]]
+    assert titles == ["3 notifications held back", "Job 1 failed", "Job 0 failed"]
+    digest = store.list_page("admin")[0][0]
+    assert digest.data == {"counts": {"job_failed": 3}, "total": 3}
+
+
+@pytest.mark.asyncio
+async def test_pipeline_bounds_pending_state(store: NotificationStore, mailer: Mailer):
+    """Test preferences filter events and pending groups are capped"""
+    pipeline = NotificationPipeline(store, NotificationHub(store), mailer)
+    store.save_settings(NotificationSettings(user="admin", notify_on_minion_down=False))
+    assert not await pipeline.notify("admin", "minion_down", "Down", "web-1", now=0)
+
+    with (
+        patch("apps.audit.pipeline.settings.notification_max_pending_groups", 2),
+        patch("apps.audit.pipeline.settings.notification_dedupe_entries", 2),
+    ):
+        for user in ("u1", "u2", "u3"):
+            await pipeline.notify(user, "job_failed", "Job failed", "failed", now=0)
+        status = pipeline.status()
+        assert (status.pending_groups, status.dedupe_entries, status.written) == (
+            2,
+            2,
+            3,
+        )
+    assert store.unread_count("u1") == 1
+
+
+@pytest.mark.asyncio
+async def test_pipeline_caches_preferences_for_a_window(
+    store: NotificationStore, mailer: Mailer
+):
+    """Test a user's settings are read once per grouping window"""
+    pipeline = NotificationPipeline(store, NotificationHub(store), mailer)
+    with (
+        patch("apps.audit.pipeline.settings.notification_group_window_seconds", 60),
+        patch.object(mailer, "enqueue"),
+        patch.object(store, "get_settings", wraps=store.get_settings) as reads,
+    ):
+        for n in range(100):
+            await pipeline.notify("admin", "job_failed", "Failed", f"job {n}", now=0)
+        assert reads.call_count == 1
+
+        store.save_settings(
+            NotificationSettings(user="admin", notify_on_job_failure=False)
+        )
+        # Still cached: the change applies from the next window
+        assert await pipeline.notify("admin", "job_failed", "Failed", "x", now=30)
+        await pipeline.flush(now=60)
+        assert not await pipeline.notify("admin", "job_failed", "Failed", "y", now=61)
+
+
+class SMTPStandIn:
+    """Minimal SMTP server recording connections and delivered messages"""
+
+    def __init__(self, rcpt_reply: str = "250 OK") -> None:
+        self.rcpt_reply = rcpt_reply
+        self.connections = 0
+        self.messages: list[str] = []
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.connections += 1
+        writer.write(b"220 stand-in ESMTP\r\n")
+        while line := await reader.readline():
+            command = line.decode().strip().upper()
+            if command.startswith("RCPT"):
+                reply = self.rcpt_reply
+            elif command == "DATA":
+                writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                data = await reader.readuntil(b"\r\n.\r\n")
+                self.messages.append(data.decode())
+                reply = "250 Queued"
+            elif command == "QUIT":
+                writer.write(b"221 Bye\r\n")
+                break
+            else:
+                reply = "250 OK"
+            writer.write(f"{reply}\r\n".encode())
+            await writer.drain()
+        writer.close()
+
+
+@pytest.fixture
+async def smtp_server():
+    """Run an SMTP stand-in on a free local port"""
+    stand_in = SMTPStandIn()
+    server = await asyncio.start_server(stand_in.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    with (
+        patch("apps.audit.mailer.settings.smtp_host", "127.0.0.1"),
+        patch("apps.audit.mailer.settings.smtp_port", port),
+    ):
+        yield stand_in
+    server.close()
+
+
+def _wants_email(store: NotificationStore, user: str) -> None:
+    store.save_settings(
+        NotificationSettings(
+            user=user, email_enabled=True, email_address=f"{user}@example.com"
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_mailer_batches_into_digests_over_one_connection(
+    store: NotificationStore, mailer: Mailer, smtp_server: SMTPStandIn
+):
+    """Test queued rows are held, then sent per recipient over pooled connections"""
+    _wants_email(store, "admin")
+    _wants_email(store, "operator")
+    for n in range(3):
+        notification = store.create("admin", "job_failed", f"Job {n} failed", "boom")
+        assert mailer.enqueue(notification) is not None
+    mailer.enqueue(store.create("operator", "job_failed", "Job 9 failed", "boom"))
+    assert mailer.enqueue(store.create("nobody", "job_failed", "Job", "x")) is None
+
+    # Nothing is due before the batching delay
+    assert await mailer.deliver() == 0
+    assert await mailer.deliver(now=time.time() + 120) == 2
+    assert sorted(
+        m.split("Subject: ")[1].split("\r\n")[0] for m in smtp_server.messages
+    ) == [
+        "[SaltShark] 3 notifications",
+        "[SaltShark] Job 9 failed",
+    ]
+
+    critical = store.create("admin", "minion_down", "Down", "web-1", "critical")
+    mailer.enqueue(critical)
+    assert await mailer.deliver() == 1
+    assert smtp_server.connections <= 2
+    assert mailer.outbox.status().model_dump() == {
+        "enabled": True,
+        "pending": 0,
+        "sending": 0,
+        "sent": 5,
+        "failed": 0,
+    }
+    await mailer.stop()
+
+
+@pytest.mark.asyncio
+async def test_mailer_retries_transient_and_drops_permanent_failures(
+    store: NotificationStore, mailer: Mailer, smtp_server: SMTPStandIn
+):
+    """Test 4xx replies are retried with backoff and 5xx replies are not"""
+    _wants_email(store, "admin")
+    mailer.enqueue(store.create("admin", "minion_down", "Down", "web-1", "critical"))
+    smtp_server.rcpt_reply = "451 Try again later"
+    now = time.time()
+    with patch("apps.audit.mailer.settings.email_retry_base_seconds", 30.0):
+        assert await mailer.deliver(now) == 0
+        status = mailer.outbox.status()
+        assert (status.pending, status.sending, status.failed) == (1, 0, 0)
+        # Not retried before the backoff is up
+        assert mailer.outbox.claim(now + 29, 10) == []
+
+        smtp_server.rcpt_reply = "550 No such user"
+        assert await mailer.deliver(now + 30) == 0
+    status = mailer.outbox.status()
+    assert (status.pending, status.failed) == (0, 1)
+    await mailer.stop()
+
+
+def test_outbox_claims_rows_once(tmp_path):
+    """Test claimed rows are not handed out again until the claim lapses"""
+    outbox = OutboxStore(tmp_path / "mail.db")
+    for n in range(3):
+        outbox.add("admin", "admin@example.com", f"Job {n}", "boom", None, 0.0)
+
+    with patch("apps.audit.mailer.settings.email_claim_seconds", 600.0):
+        assert [row["subject"] for row in outbox.claim(10.0, 2)] == ["Job 0", "Job 1"]
+        assert [row["subject"] for row in outbox.claim(20.0, 10)] == ["Job 2"]
+        assert outbox.claim(30.0, 10) == []
+        assert outbox.status().sending == 3
+
+        outbox.mark_sent([1])
+        # A sender that died leaves its claims to lapse
+        assert [row["id"] for row in outbox.claim(625.0, 10)] == [2, 3]
+    outbox.close()
+
+
+@pytest.mark.asyncio
+async def test_mailer_enqueue_wakes_delivery_from_a_thread(
+    store: NotificationStore, mailer: Mailer
+):
+    """Test a critical email queued from a worker thread wakes the loop"""
+    _wants_email(store, "admin")
+    mailer._loop = asyncio.get_running_loop()
+    critical = store.create("admin", "minion_down", "Down", "web-1", "critical")
+    assert await asyncio.to_thread(mailer.enqueue, critical) is not None
+    await asyncio.wait_for(mailer._wake.wait(), 1.0)
@@ -119,3 +119,27 @@ async def test_get_grains():
     result = await client.get_grains("minion-1")
     assert result is not None
     assert "return" in result
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_login():
+    """Test concurrent requests without a token trigger a single login"""
+    import asyncio
+
+    client = SaltAPIClient()
+
+    login_response = MagicMock()
+    login_response.json = MagicMock(return_value={"return": [{"token": "shared"}]})
+    login_response.raise_for_status = MagicMock()
+    client.client.post = AsyncMock(return_value=login_response)
+
+    mock_response = MagicMock()
+    mock_response.status_code = 200
+    mock_response.json = MagicMock(return_value={"return": [{"minion-1": True}]})
+    mock_response.raise_for_status = MagicMock()
+    client.client.request = AsyncMock(return_value=mock_response)
+
+    await asyncio.gather(*(client.execute_command("*", "test.ping") for _ in range(5)))
+
+    assert client.client.post.await_count == 1
+    assert client.token == "shared"
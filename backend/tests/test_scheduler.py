@@ -0,0 +1,307 @@
+"""Tests for the central scheduler"""
+
+import asyncio
+from datetime import UTC, datetime, timedelta
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apps.auth.routes import create_access_token, fake_users_db, users_changed
+from apps.salt.cron import CronExpression
+from apps.salt.job_engine import JobEngine
+from apps.salt.scheduler import Scheduler, ScheduleStore, next_fire_time
+from apps.salt.schemas import (
+    CentralScheduleCreate,
+    JobTemplateCreate,
+    JobTemplateUpdate,
+    TargetExecutionResult,
+)
+from apps.salt.template_store import TemplateStore
+
+NOW = datetime(2026, 1, 5, 12, 0, tzinfo=UTC)
+
+
+@pytest.fixture
+def templates(tmp_path):
+    """Template store holding one ping template"""
+    store = TemplateStore(tmp_path / "templates.db")
+    store.create(
+        JobTemplateCreate(name="ping", target="*", function="test.ping"),
+        created_by="admin",
+    )
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def engine():
+    """Job engine whose runs always succeed"""
+    engine = JobEngine(AsyncMock())
+    engine.run_targets = AsyncMock(
+        side_effect=lambda targets, **kwargs: [
+            TargetExecutionResult(target=t, jid=f"jid-{t}", success=True)
+            for t in targets
+        ]
+    )
+    return engine
+
+
+def make_scheduler(path, templates, engine) -> Scheduler:
+    return Scheduler(ScheduleStore(path), templates, engine)
+
+
+def test_cron_expression_next_after():
+    """Test cron parsing and next fire time"""
+    assert CronExpression("*/15 * * * *").next_after(NOW) == NOW.replace(minute=15)
+    # 2026-01-05 is a Monday
+    assert CronExpression("0 2 * * 1-5").next_after(NOW) == datetime(
+        2026, 1, 6, 2, 0, tzinfo=UTC
+    )
+    assert CronExpression("@daily").next_after(NOW) == datetime(
+        2026, 1, 6, 0, 0, tzinfo=UTC
+    )
+    with pytest.raises(ValueError, match="out of range"):
+        CronExpression("61 * * * *")
+
+
+@pytest.mark.asyncio
+async def test_scheduler_fires_due_schedule(tmp_path, templates, engine):
+    """Test a due interval schedule runs once and records history"""
+    scheduler = make_scheduler(tmp_path / "scheduler.db", templates, engine)
+    schedule = scheduler.store.create(
+        CentralScheduleCreate(
+            name="ping-web", template_id="1", interval_seconds=60, targets=["web"]
+        ),
+        created_by="admin",
+        now=NOW,
+    )
+
+    assert await scheduler.tick(NOW) == 0
+    assert await scheduler.tick(NOW + timedelta(seconds=61)) == 1
+    await scheduler.wait_idle()
+
+    runs = scheduler.store.list_runs(schedule.id)
+    assert len(runs) == 1
+    assert runs[0].status == "succeeded"
+    assert runs[0].jids == {"web": "jid-web"}
+    next_run = scheduler.store.get(schedule.id).next_run_at
+    assert next_run == NOW + timedelta(seconds=120)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_rechecks_template_access(tmp_path, templates, engine):
+    """Test a schedule stops firing once its template goes private to someone else"""
+    scheduler = make_scheduler(tmp_path / "scheduler.db", templates, engine)
+    schedule = scheduler.store.create(
+        CentralScheduleCreate(name="ping", template_id="1", interval_seconds=60),
+        created_by="bob",
+        now=NOW,
+    )
+    templates.update("1", JobTemplateUpdate(is_public=False))
+
+    assert await scheduler.tick(NOW + timedelta(seconds=61)) == 1
+    await scheduler.wait_idle()
+
+    runs = scheduler.store.list_runs(schedule.id)
+    assert (runs[0].status, runs[0].error) == ("failed", "Access denied")
+    engine.run_targets.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_stop_interrupts_inflight_runs(tmp_path, templates, engine):
+    """Test stopping the scheduler does not wait for a run that never finishes"""
+    scheduler = make_scheduler(tmp_path / "scheduler.db", templates, engine)
+    schedule = scheduler.store.create(
+        CentralScheduleCreate(name="ping", template_id="1", interval_seconds=60),
+        created_by="admin",
+        now=NOW,
+    )
+
+    async def hang(**kwargs):
+        await asyncio.Event().wait()
+
+    engine.run_targets = AsyncMock(side_effect=hang)
+
+    assert await scheduler.tick(NOW + timedelta(seconds=61)) == 1
+    await asyncio.sleep(0)
+    await asyncio.wait_for(scheduler.stop(), timeout=1)
+
+    runs = scheduler.store.list_runs(schedule.id)
+    assert runs[0].status == "interrupted"
+    assert runs[0].finished_at is not None
+
+
+@pytest.mark.asyncio
+async def test_only_leader_fires(tmp_path, templates, engine):
+    """Test two workers sharing a database never double-fire"""
+    path = tmp_path / "scheduler.db"
+    leader = make_scheduler(path, templates, engine)
+    follower = make_scheduler(path, templates, engine)
+    leader.store.create(
+        CentralScheduleCreate(name="ping", template_id="1", interval_seconds=60),
+        created_by="admin",
+        now=NOW,
+    )
+
+    due = NOW + timedelta(seconds=61)
+    assert await leader.tick(due) == 1
+    assert await follower.tick(due) == 0
+    await leader.wait_idle()
+
+    # After the lease expires the follower takes over
+    later = due + timedelta(seconds=120)
+    assert await follower.tick(later) == 1
+    await follower.wait_idle()
+    assert len(follower.store.list_runs()) == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("policy", "expected_runs", "expected_status"),
+    [("skip", 1, "skipped"), ("run_once", 1, "succeeded"), ("run_all", 5, None)],
+)
+async def test_missed_run_policies(
+    tmp_path, templates, engine, policy, expected_runs, expected_status
+):
+    """Test what happens to runs missed while SaltShark was down"""
+    scheduler = make_scheduler(tmp_path / "scheduler.db", templates, engine)
+    scheduler.store.create(
+        CentralScheduleCreate(
+            name="hourly",
+            template_id="1",
+            cron="0 * * * *",
+            missed_run_policy=policy,
+        ),
+        created_by="admin",
+        now=NOW,
+    )
+
+    await scheduler.tick(NOW + timedelta(hours=5, minutes=30))
+    await scheduler.wait_idle()
+
+    runs = scheduler.store.list_runs()
+    assert len(runs) == expected_runs
+    if expected_status:
+        assert runs[0].status == expected_status
+    assert scheduler.store.list_schedules()[0].next_run_at == NOW + timedelta(hours=6)
+
+
+@pytest.mark.parametrize(
+    ("timing", "expected"),
+    [
+        (
+            {"interval_seconds": 1},
+            [NOW, NOW + timedelta(seconds=1), NOW + timedelta(days=30)],
+        ),
+        (
+            {"cron": "* * * * *"},
+            [NOW, NOW + timedelta(minutes=1), NOW + timedelta(minutes=2)],
+        ),
+    ],
+)
+def test_catchup_is_bounded(tmp_path, templates, engine, timing, expected):
+    """Test a long outage yields at most scheduler_max_catchup_runs occurrences"""
+    scheduler = make_scheduler(tmp_path / "scheduler.db", templates, engine)
+    schedule = scheduler.store.create(
+        CentralScheduleCreate(
+            name="often", template_id="1", missed_run_policy="run_all", **timing
+        ),
+        created_by="admin",
+        now=NOW - timedelta(seconds=1),
+    )
+    now = NOW + timedelta(days=30)
+
+    with patch("apps.salt.scheduler.settings.scheduler_max_catchup_runs", 3):
+        occurrences, following = scheduler._fire_times(schedule, now)
+
+    assert schedule.next_run_at == NOW
+    assert occurrences == expected
+    assert following == next_fire_time(schedule, now)
+
+
+def test_create_central_schedule_api(client: TestClient, api_base_url: str, tmp_path):
+    """Test creating and listing central schedules through the API"""
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+    templates = TemplateStore(tmp_path / "templates.db")
+    templates.create(
+        JobTemplateCreate(name="ping", target="*", function="test.ping"),
+        created_by="admin",
+    )
+    store = ScheduleStore(tmp_path / "scheduler.db")
+
+    with (
+        patch("apps.salt.routes.template_store", templates),
+        patch("apps.salt.routes.schedule_store", store),
+    ):
+        response = client.post(
+            f"{api_base_url}/scheduler/schedules",
+            json={"name": "ping", "template_id": "1", "cron": "not a cron"},
+            headers=headers,
+        )
+        assert response.status_code == 400
+
+        response = client.post(
+            f"{api_base_url}/scheduler/schedules",
+            json={
+                "name": "ping",
+                "template_id": "1",
+                "cron": "*/5 * * * *",
+                "targets": ["web"],
+            },
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert response.json()["next_run_at"] is not None
+
+        response = client.get(
+            f"{api_base_url}/scheduler/schedules",
+            params={"target": "web"},
+            headers=headers,
+        )
+        assert [s["name"] for s in response.json()] == ["ping"]
+
+    store.close()
+    templates.close()
+
+
+def test_schedules_are_changed_only_by_their_owner(
+    client: TestClient, api_base_url: str, tmp_path
+):
+    """Test an operator cannot update, run or delete someone else's schedule"""
+    operator = fake_users_db["admin"].model_copy(
+        update={"id": "2", "username": "bob", "role": "operator"}
+    )
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'bob'})}"}
+    templates = TemplateStore(tmp_path / "templates.db")
+    templates.create(
+        JobTemplateCreate(name="ping", target="*", function="test.ping"),
+        created_by="admin",
+    )
+    store = ScheduleStore(tmp_path / "scheduler.db")
+    schedule = store.create(
+        CentralScheduleCreate(name="ping", template_id="1", interval_seconds=60),
+        created_by="admin",
+        now=NOW,
+    )
+    url = f"{api_base_url}/scheduler/schedules/{schedule.id}"
+
+    with (
+        patch.dict(fake_users_db, {"bob": operator}),
+        patch("apps.salt.routes.template_store", templates),
+        patch("apps.salt.routes.schedule_store", store),
+        patch("apps.salt.routes.scheduler") as scheduler,
+    ):
+        users_changed()
+        responses = [
+            client.put(url, json={"enabled": False}, headers=headers),
+            client.post(f"{url}/run", headers=headers),
+            client.delete(url, headers=headers),
+        ]
+    users_changed()
+
+    assert [r.status_code for r in responses] == [403, 403, 403]
+    scheduler.fire.assert_not_called()
+    assert store.get(schedule.id).enabled
+    store.close()
+    templates.close()
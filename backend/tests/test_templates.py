@@ -0,0 +1,253 @@
+"""Tests for job template endpoints and the job engine"""
+
+import asyncio
+from typing import Any
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apps.auth.routes import create_access_token
+from apps.salt.job_engine import JobEngine
+from apps.salt.schemas import JobTemplateCreate, JobTemplateUpdate
+from apps.salt.template_store import TemplateStore
+
+
+@pytest.fixture
+def auth_headers() -> dict[str, str]:
+    """Authorization headers for the admin user"""
+    token = create_access_token({"sub": "admin"})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path):
+    """Use a fresh template store holding one template"""
+    store = TemplateStore(tmp_path / "templates.db")
+    store.create(
+        JobTemplateCreate(name="ping", target="*", function="test.ping"),
+        created_by="admin",
+    )
+    with patch("apps.salt.routes.template_store", store):
+        yield store
+    store.close()
+
+
+@pytest.fixture(autouse=True)
+def fast_polling():
+    """Poll the job cache without waiting"""
+    with patch("apps.salt.job_engine.settings.job_poll_seconds", 0.001):
+        yield
+
+
+def published(jid: str, minion: str) -> dict[str, Any]:
+    """Build a salt-api ``local_async`` response for one minion"""
+    return {"return": [{"jid": jid, "minions": [minion]}]}
+
+
+def cached(minion: str, retcode: int = 0) -> dict[str, Any]:
+    """Build a ``/jobs/<jid>`` response holding the return of one minion"""
+    return {"info": [{"Result": {minion: {"return": True, "retcode": retcode}}}]}
+
+
+def test_execute_template_uses_shared_client(
+    client: TestClient, api_base_url: str, auth_headers: dict[str, str]
+):
+    """Test single template execution goes through the shared client"""
+    with patch(
+        "apps.salt.routes.salt_client.execute_job", new_callable=AsyncMock
+    ) as mock_execute:
+        mock_execute.return_value = {"return": [{"minion-1": True}]}
+        response = client.post(
+            f"{api_base_url}/templates/1/execute", headers=auth_headers
+        )
+
+        assert response.status_code == 200
+        assert response.json()["template_name"] == "ping"
+        mock_execute.assert_called_once_with(
+            target="*", function="test.ping", args=[], kwargs={}
+        )
+
+
+def test_execute_template_batch(
+    client: TestClient, api_base_url: str, auth_headers: dict[str, str]
+):
+    """Test multi-target execution returns one jid per target"""
+
+    async def fake_publish(target: str, *args: Any) -> dict[str, Any]:
+        if target == "db":
+            raise RuntimeError("nodegroup unreachable")
+        return published(f"jid-{target}", f"{target}-1")
+
+    async def fake_get_job(jid: str) -> dict[str, Any]:
+        return cached(jid.replace("jid-", "") + "-1")
+
+    with (
+        patch(
+            "apps.salt.job_engine.salt_client.publish_job",
+            new_callable=AsyncMock,
+            side_effect=fake_publish,
+        ),
+        patch(
+            "apps.salt.job_engine.salt_client.get_job",
+            new_callable=AsyncMock,
+            side_effect=fake_get_job,
+        ),
+    ):
+        response = client.post(
+            f"{api_base_url}/templates/1/execute/batch",
+            json={"targets": ["web", "app", "db"], "tgt_type": "nodegroup"},
+            headers=auth_headers,
+        )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total_targets"] == 3
+    assert data["succeeded"] == 2
+    assert data["failed"] == 1
+    assert data["jids"] == {"web": "jid-web", "app": "jid-app", "db": None}
+    assert data["results"][2]["error"] == "nodegroup unreachable"
+
+
+def test_execute_template_batch_not_found(
+    client: TestClient, api_base_url: str, auth_headers: dict[str, str]
+):
+    """Test batch execution of an unknown template"""
+    response = client.post(
+        f"{api_base_url}/templates/404/execute/batch",
+        json={"targets": ["web"]},
+        headers=auth_headers,
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_job_engine_respects_concurrency_limit():
+    """Test the engine never runs more targets at once than allowed"""
+    running = 0
+    peak = 0
+
+    async def fake_publish(target: str, *args: Any) -> dict[str, Any]:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        return published(f"jid-{target}", target)
+
+    async def fake_get_job(jid: str) -> dict[str, Any]:
+        nonlocal running
+        await asyncio.sleep(0.01)
+        running -= 1
+        target = jid.replace("jid-", "")
+        return cached(target, retcode=1 if target == "t3" else 0)
+
+    client = AsyncMock()
+    client.publish_job = AsyncMock(side_effect=fake_publish)
+    client.get_job = AsyncMock(side_effect=fake_get_job)
+    engine = JobEngine(client, max_concurrency=3)
+
+    targets = [f"t{i}" for i in range(10)]
+    results = await engine.run_targets(targets, "test.ping", concurrency=5)
+
+    assert peak == 3
+    assert [r.target for r in results] == targets
+    assert [r.success for r in results].count(False) == 1
+    assert results[3].retcodes == {"t3": 1}
+
+
+@pytest.mark.asyncio
+async def test_job_engine_notifies_the_submitter():
+    """Test settled runs notify the submitting user, keyed by job"""
+    client = AsyncMock()
+    client.publish_job = AsyncMock(
+        side_effect=lambda target, *args: published(args[-1], target)
+    )
+    client.get_job = AsyncMock(return_value=cached("web", retcode=2))
+    notifier = AsyncMock()
+    engine = JobEngine(client, notifier=notifier)
+
+    (result,) = await engine.run_targets(["web"], "state.apply", submitted_by="alice")
+    await engine.run_targets(["web"], "state.apply", submitted_by="schedule:nightly")
+
+    notifier.notify.assert_awaited_once()
+    user, notification_type, title, message = notifier.notify.call_args.args[:4]
+    assert (user, notification_type) == ("alice", "job_failed")
+    assert (title, message) == ("state.apply failed on web", "Failed on 1 of 1 minions")
+    assert notifier.notify.call_args.kwargs["key"] == result.jid
+
+
+def test_template_ids_are_not_reused(store: TemplateStore):
+    """Test ids stay unique after deletes"""
+    second = store.create(
+        JobTemplateCreate(name="uptime", target="*", function="status.uptime"),
+        created_by="admin",
+    )
+    assert store.delete(second.id)
+
+    third = store.create(
+        JobTemplateCreate(name="disk", target="*", function="disk.usage"),
+        created_by="admin",
+    )
+    assert third.id != second.id
+    assert store.get(second.id) is None
+
+
+def test_template_visibility_and_categories(store: TemplateStore):
+    """Test private templates are only visible to their owner"""
+    store.create(
+        JobTemplateCreate(
+            name="secret",
+            target="db*",
+            function="cmd.run",
+            category="ops",
+            is_public=False,
+        ),
+        created_by="alice",
+    )
+
+    assert [t.name for t in store.list_visible("bob")] == ["ping"]
+    assert [t.name for t in store.list_visible("alice", "ops")] == ["secret"]
+    assert store.list_categories("bob") == ["general"]
+    assert store.list_categories("alice") == ["general", "ops"]
+
+    store.update("1", JobTemplateUpdate(category="health"))
+    assert store.list_categories("bob") == ["health"]
+
+
+def test_template_store_shared_between_workers(tmp_path):
+    """Test a second worker sees writes and refreshes its category cache"""
+    worker_a = TemplateStore(tmp_path / "shared.db")
+    worker_b = TemplateStore(tmp_path / "shared.db")
+
+    worker_a.create(
+        JobTemplateCreate(name="ping", target="*", function="test.ping"),
+        created_by="admin",
+    )
+    assert worker_b.list_categories("admin") == ["general"]
+
+    worker_a.create(
+        JobTemplateCreate(
+            name="patch", target="*", function="pkg.upgrade", category="patching"
+        ),
+        created_by="admin",
+    )
+    assert worker_b.list_categories("admin") == ["general", "patching"]
+    assert worker_b.get("2") is not None
+
+    worker_a.close()
+    worker_b.close()
+
+
+def test_create_and_list_templates(
+    client: TestClient, api_base_url: str, auth_headers: dict[str, str]
+):
+    """Test creating a template through the API"""
+    response = client.post(
+        f"{api_base_url}/templates",
+        json={"name": "uptime", "target": "*", "function": "status.uptime"},
+        headers=auth_headers,
+    )
+    assert response.status_code == 200
+    assert response.json()["id"] == "2"
+
+    response = client.get(f"{api_base_url}/templates", headers=auth_headers)
+    assert [t["name"] for t in response.json()] == ["ping", "uptime"]